@@ -15,8 +15,13 @@ UNLOAD (
                 effective_date,
                 organisation_name,
                 organisation_official_name,
-                organisation_gss
+                organisation_gss,
+                -- One row per division per tile it covers
+                bing_tile_quadkey(tile) AS cell_id
             FROM current_boundary_changes
+                CROSS JOIN UNNEST(
+                    geometry_to_bing_tiles(ST_POLYGON(division_boundary_wkt), $cell_zoom)
+                ) AS t (tile)
             WHERE
                 boundary_review_id = {boundary_review_id}
                 AND division_type = '{division_type}'
@@ -50,10 +55,10 @@ UNLOAD (
                 od.organisation_official_name,
                 od.organisation_gss
             FROM
-                addressbase_partitioned a JOIN old_divisionset od ON ST_WITHIN (
+                addressbase_partitioned a JOIN old_divisionset od ON a.cell_id = od.cell_id AND ST_WITHIN (
                     ST_POINT(a.longitude, a.latitude),
 				ST_POLYGON(od.division_boundary_wkt)
-			) JOIN new_divisionset nd ON ST_WITHIN(
+			) JOIN new_divisionset nd ON a.cell_id = nd.cell_id AND ST_WITHIN(
 			    ST_POINT(a.longitude, a.latitude),
 				ST_POLYGON(nd.division_boundary_wkt)
 			)
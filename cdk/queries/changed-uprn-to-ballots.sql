@@ -0,0 +1,51 @@
+UNLOAD (
+		WITH changed_boxes AS (
+			SELECT min_longitude,
+				max_longitude,
+				min_latitude,
+				max_latitude
+			FROM current_ballots_changes
+			WHERE source_table IN ('Organisation', 'Division')
+		),
+		outcode_boxes AS (
+			SELECT outcode,
+				min(longitude) AS min_longitude,
+				max(longitude) AS max_longitude,
+				min(latitude) AS min_latitude,
+				max(latitude) AS max_latitude
+			FROM addressbase_partitioned
+			GROUP BY outcode
+		),
+		changed_outcodes AS (
+			SELECT DISTINCT ob.outcode
+			FROM outcode_boxes ob
+				JOIN changed_boxes cb ON ob.min_longitude <= cb.max_longitude
+				AND ob.max_longitude >= cb.min_longitude
+				AND ob.min_latitude <= cb.max_latitude
+				AND ob.max_latitude >= cb.min_latitude
+		)
+		SELECT ab.uprn,
+			ab.address,
+			ab.postcode,
+			ab.addressbase_source,
+			array_sort(filter(array_agg(DISTINCT cb.election_id), x -> x IS NOT NULL)) AS ballot_ids,
+			ab.first_letter AS first_letter
+		FROM addressbase_partitioned ab
+			JOIN changed_outcodes co ON ab.outcode = co.outcode
+			LEFT JOIN current_ballot_cells cb ON ab.cell_id = cb.cell_id
+			AND ab.longitude BETWEEN cb.min_longitude AND cb.max_longitude
+			AND ab.latitude BETWEEN cb.min_latitude AND cb.max_latitude
+			AND ST_CONTAINS(
+				ST_GeomFromBinary(cb.geometry),
+				ST_POINT(ab.longitude, ab.latitude)
+			)
+		GROUP BY ab.uprn,
+			ab.address,
+			ab.postcode,
+			ab.addressbase_source,
+			ab.first_letter
+	) TO '$table_full_s3_path' WITH (
+		format = 'PARQUET',
+		compression = 'SNAPPY',
+		partitioned_by = ARRAY [ 'first_letter' ]
+	)
@@ -0,0 +1,32 @@
+UNLOAD (
+		WITH parsed_ballots AS (
+			SELECT cb.election_id,
+				cb.division_id,
+				cb.source_table,
+				ST_Polygon(cb.geometry) AS geometry,
+				cb.min_longitude,
+				cb.max_longitude,
+				cb.min_latitude,
+				cb.max_latitude
+			FROM current_ballots cb
+			WHERE cb.source_table IN ('Organisation', 'Division')
+		)
+		-- One row per ballot geography per tile it covers, with the
+		-- geometry as WKB so the joins don't parse the WKT again
+		SELECT pb.election_id,
+			pb.division_id,
+			pb.source_table,
+			ST_AsBinary(pb.geometry) AS geometry,
+			pb.min_longitude,
+			pb.max_longitude,
+			pb.min_latitude,
+			pb.max_latitude,
+			bing_tile_quadkey(tile) AS cell_id
+		FROM parsed_ballots pb
+			CROSS JOIN UNNEST(
+				geometry_to_bing_tiles(pb.geometry, $cell_zoom)
+			) AS t (tile)
+	) TO '$table_full_s3_path' WITH (
+		format = 'PARQUET',
+		compression = 'SNAPPY'
+	)
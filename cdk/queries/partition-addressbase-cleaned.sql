@@ -7,6 +7,13 @@ UNLOAD
        ST_X(ST_GeometryFromText(split_part(location, ';', 2))) AS longitude,
        ST_Y(ST_GeometryFromText(split_part(location, ';', 2))) AS latitude,
        '{addressbase_source}' as addressbase_source,
+       bing_tile_quadkey(
+           bing_tile_at(
+               ST_Y(ST_GeometryFromText(split_part(location, ';', 2))),
+               ST_X(ST_GeometryFromText(split_part(location, ';', 2))),
+               $cell_zoom
+           )
+       ) AS cell_id,
        substr(postcode, 1, 1) AS first_letter
     FROM "$from_table"
 )
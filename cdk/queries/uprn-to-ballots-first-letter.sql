@@ -1,44 +1,27 @@
 UNLOAD (
-		SELECT combined_results.uprn,
-			combined_results.address,
-			combined_results.postcode,
-			combined_results.addressbase_source,
-			array_sort(filter(array_agg(DISTINCT combined_results.election_id), x -> x IS NOT NULL)) AS ballot_ids,
-			combined_results.first_letter AS first_letter
-		FROM (
-				SELECT ab.uprn,
-					ab.address,
-					ab.postcode,
-					ab.first_letter,
-					ab.addressbase_source,
-					cb.election_id
-				FROM addressbase_partitioned ab
-					LEFT JOIN current_ballots cb ON ST_CONTAINS(
-						ST_Polygon(cb.geometry),
-						ST_POINT(ab.longitude, ab.latitude)
-					)
-					AND cb.source_table = 'Organisation'
-				WHERE ab.first_letter = '{first_letter}'
-				UNION
-				SELECT ab.uprn,
-					ab.address,
-					ab.postcode,
-					ab.first_letter,
-					ab.addressbase_source,
-					cb.election_id
-				FROM addressbase_partitioned ab
-					LEFT JOIN current_ballots cb ON ST_CONTAINS(
-						ST_Polygon(cb.geometry),
-						ST_POINT(ab.longitude, ab.latitude)
-					)
-					AND cb.source_table = 'Division'
-				WHERE ab.first_letter = '{first_letter}'
-			) AS combined_results
-		GROUP BY combined_results.uprn,
-			combined_results.address,
-			combined_results.postcode,
-			combined_results.addressbase_source,
-			combined_results.first_letter
+		-- Organisation and Division ballots are joined in one pass. An
+		-- address in no ballot gets one row with a NULL election_id, which
+		-- the filter drops to leave an empty ballot_ids.
+		SELECT ab.uprn,
+			ab.address,
+			ab.postcode,
+			ab.addressbase_source,
+			array_sort(filter(array_agg(DISTINCT cb.election_id), x -> x IS NOT NULL)) AS ballot_ids,
+			ab.first_letter AS first_letter
+		FROM addressbase_partitioned ab
+			LEFT JOIN current_ballot_cells cb ON ab.cell_id = cb.cell_id
+			AND ab.longitude BETWEEN cb.min_longitude AND cb.max_longitude
+			AND ab.latitude BETWEEN cb.min_latitude AND cb.max_latitude
+			AND ST_CONTAINS(
+				ST_GeomFromBinary(cb.geometry),
+				ST_POINT(ab.longitude, ab.latitude)
+			)
+		WHERE ab.first_letter = '{first_letter}'
+		GROUP BY ab.uprn,
+			ab.address,
+			ab.postcode,
+			ab.addressbase_source,
+			ab.first_letter
 	) TO '$table_full_s3_path' WITH (
 		format = 'PARQUET',
 		compression = 'SNAPPY',
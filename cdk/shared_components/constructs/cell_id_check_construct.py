@@ -0,0 +1,102 @@
+from aws_cdk import (
+    aws_lambda as lambda_,
+)
+from aws_cdk import (
+    aws_stepfunctions as sfn,
+)
+from aws_cdk import (
+    aws_stepfunctions_tasks as tasks,
+)
+from constructs import Construct
+
+
+class CellIdCheckConstruct(Construct):
+    """
+    A CDK construct that checks every located address has a cell_id.
+
+    Addresses are joined to polygons on cell_id. Rows partitioned before
+    cell_id was added have a NULL cell_id, so would join to no ballots and
+    overwrite live files with empty ones. Until addressbase_partitioned is
+    made again, this fails the run instead.
+
+    This construct creates a three-step workflow:
+    1. Run an Athena query to count located addresses without a cell_id
+    2. Get the query results
+    3. Fail if there are any, otherwise carry on to the next state.
+
+    Addresses without a location have no cell_id either, and never
+    matched a polygon, so aren't counted.
+
+    Parameters:
+    -----------
+    scope : Construct
+        The parent construct
+    id : str
+        The construct ID
+    athena_query_lambda : lambda_.IFunction
+        The Lambda function that will execute Athena queries
+    table_name : str
+        The table name to check against. Must have columns named 'cell_id',
+        'longitude' and 'latitude'
+    """
+
+    def __init__(
+        self,
+        scope: Construct,
+        construct_id: str,
+        athena_query_lambda: lambda_.IFunction,
+        table_name,
+        **kwargs,
+    ):
+        super().__init__(scope, construct_id, **kwargs)
+
+        # State names must be unique within a state machine, so they are
+        # namespaced by construct_id to allow more than one instance of this
+        # construct to be used in the same state machine.
+        count_missing_cell_ids = tasks.LambdaInvoke(
+            self,
+            f"{construct_id}: Count addresses without a cell_id",
+            lambda_function=athena_query_lambda,
+            payload=sfn.TaskInput.from_object(
+                {
+                    "context": {"table_name": table_name},
+                    "QueryString": "SELECT COUNT(*) AS missing_cell_id_count FROM {table_name} WHERE cell_id IS NULL AND longitude IS NOT NULL AND latitude IS NOT NULL;",
+                    "blocking": True,
+                }
+            ),
+        )
+
+        # Create the state to get Athena query results
+        get_missing_cell_id_count = tasks.AthenaGetQueryResults(
+            self,
+            f"{construct_id}: Get count of addresses without a cell_id",
+            query_execution_id="{% $states.input.Payload.queryExecutionId %}",
+            query_language=sfn.QueryLanguage.JSONATA,
+            assign={
+                "missing_cell_id_count": "{% $states.result.ResultSet.Rows[1].Data[0].VarCharValue %}"
+            },
+        )
+
+        # Create the state to check every located address has a cell_id
+        check_missing_cell_id_count = sfn.Choice(
+            self, f"{construct_id}: Check addresses all have a cell_id"
+        ).when(
+            sfn.Condition.not_(
+                sfn.Condition.string_equals("$missing_cell_id_count", "0")
+            ),
+            sfn.Fail(
+                self,
+                f"{construct_id}: Addresses without a cell_id!",
+                cause=f"{table_name} needs partitioning again, by the "
+                "MakeAddressBasePartitioned state machine",
+            ),
+        )
+
+        # Chain the states together
+        self.entry_point = (
+            sfn.Chain.start(count_missing_cell_ids)
+            .next(get_missing_cell_id_count)
+            .next(
+                check_missing_cell_id_count.afterwards(include_otherwise=True)
+            )
+        )
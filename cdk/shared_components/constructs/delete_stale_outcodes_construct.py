@@ -12,7 +12,8 @@ from constructs import Construct
 
 class DeleteStaleOutcodesConstruct(Construct):
     """
-    Removes orphaned <outcode>.parquet files from an outcode-grouped product.
+    Removes orphaned <outcode>.parquet files, and their postcode indexes,
+    from an outcode-grouped product.
 
     The 'by outcode products are rebuilt by overwriting one file per outcode.
     This means that when we're rebuilding them we don't have to delete them all first.
@@ -26,7 +27,8 @@ class DeleteStaleOutcodesConstruct(Construct):
     1. Run an Athena query for outcodes in the target but not the source.
     2. Get the query results.
     3. Drop the header row.
-    4. Map over each stale outcode and delete its <outcode>.parquet file.
+    4. Map over each stale outcode and delete its <outcode>.parquet file,
+       then its <outcode>.json index if there is one.
 
     Parameters:
     -----------
@@ -46,6 +48,9 @@ class DeleteStaleOutcodesConstruct(Construct):
         Bucket holding the <outcode>.parquet files.
     dest_path : str
         Prefix such that a file lives at {dest_path}/{outcode}.parquet.
+    index_path : str, optional
+        Prefix such that the file's postcode index lives at
+        {index_path}/{outcode}.json, if the product has one.
     """
 
     def __init__(
@@ -58,6 +63,7 @@ class DeleteStaleOutcodesConstruct(Construct):
         target_table_name: str,
         dest_bucket_name: str,
         dest_path: str,
+        index_path: str | None = None,
         **kwargs,
     ):
         super().__init__(scope, construct_id, **kwargs)
@@ -116,8 +122,33 @@ class DeleteStaleOutcodesConstruct(Construct):
                     ),
                 }
             ),
+            # Keep the Athena row as the state, for deleting the index.
+            result_path=sfn.JsonPath.DISCARD,
         )
 
+        delete_outcode = sfn.Chain.start(delete_outcode_file)
+        if index_path:
+            # The index is uploaded before its outcode file, so delete it
+            # after, and there's never a file without its index.
+            delete_outcode = delete_outcode.next(
+                tasks.LambdaInvoke(
+                    self,
+                    f"{construct_id}: Delete stale outcode index",
+                    lambda_function=delete_objects_lambda,
+                    payload=sfn.TaskInput.from_object(
+                        {
+                            "bucket": dest_bucket_name,
+                            "prefix": sfn.JsonPath.format(
+                                index_path + "/{}.json",
+                                sfn.JsonPath.string_at(
+                                    "$.Data[0].VarCharValue"
+                                ),
+                            ),
+                        }
+                    ),
+                )
+            )
+
         delete_stale_outcodes = sfn.Map(
             self,
             f"{construct_id}: Delete each stale outcode file",
@@ -125,7 +156,7 @@ class DeleteStaleOutcodesConstruct(Construct):
             max_concurrency=5,
         )
         delete_stale_outcodes.item_processor(
-            delete_outcode_file, mode=sfn.ProcessorMode.INLINE
+            delete_outcode, mode=sfn.ProcessorMode.INLINE
         )
 
         self.entry_point = (
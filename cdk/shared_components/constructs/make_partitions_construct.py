@@ -1,3 +1,7 @@
+from aws_cdk import (
+    ArnFormat,
+    Stack,
+)
 from aws_cdk import (
     aws_lambda as lambda_,
 )
@@ -12,6 +16,13 @@ class MakePartitionsConstruct(Construct):
     """
     A CDK construct that creates partitions on Athena for a given table.
 
+    MSCK REPAIR TABLE only adds partitions it hasn't seen. A partition keeps
+    the storage format the table had when it was added, so if the table's
+    format changes, its existing partitions have to be dropped first. With
+    `database_name` given, every partition is dropped through the Glue API
+    before MSCK REPAIR TABLE adds back the ones on S3. That also drops
+    partitions whose data has been deleted.
+
     Parameters:
     -----------
     scope : Construct
@@ -22,6 +33,9 @@ class MakePartitionsConstruct(Construct):
         The Lambda function that will execute Athena queries
     target_table_name : str
         The target table to partition
+    database_name : str, optional
+        The Glue database of the target table. If given, existing
+        partitions are dropped before they're made again.
     """
 
     def __init__(
@@ -30,6 +44,7 @@ class MakePartitionsConstruct(Construct):
         construct_id: str,
         athena_query_lambda: lambda_.IFunction,
         target_table_name: str,
+        database_name: str | None = None,
         **kwargs,
     ):
         super().__init__(scope, construct_id, **kwargs)
@@ -47,5 +62,77 @@ class MakePartitionsConstruct(Construct):
             ),
         )
 
-        # Expose the entry point as a property to connect to other state machines
-        self.entry_point = make_partitions
+        if not database_name:
+            # Expose the entry point as a property to connect to other state machines
+            self.entry_point = make_partitions
+            return
+
+        stack = Stack.of(self)
+        glue_resources = [
+            stack.format_arn(
+                service="glue",
+                resource="catalog",
+                arn_format=ArnFormat.NO_RESOURCE_NAME,
+            ),
+            stack.format_arn(
+                service="glue", resource="database", resource_name=database_name
+            ),
+            stack.format_arn(
+                service="glue",
+                resource="table",
+                resource_name=f"{database_name}/{target_table_name}",
+            ),
+        ]
+
+        get_partitions = tasks.CallAwsService(
+            self,
+            f"Get partitions of {target_table_name}",
+            service="glue",
+            action="getPartitions",
+            parameters={
+                "DatabaseName": database_name,
+                "TableName": target_table_name,
+                "ExcludeColumnSchema": True,
+                "MaxResults": 100,
+            },
+            iam_action="glue:GetPartitions",
+            iam_resources=glue_resources,
+        )
+
+        delete_partition = tasks.CallAwsService(
+            self,
+            f"Drop partition of {target_table_name}",
+            service="glue",
+            action="deletePartition",
+            parameters={
+                "DatabaseName": database_name,
+                "TableName": target_table_name,
+                "PartitionValues": sfn.JsonPath.list_at("$.Values"),
+            },
+            iam_action="glue:DeletePartition",
+            iam_resources=glue_resources,
+        )
+        delete_partitions = sfn.Map(
+            self,
+            f"Drop each partition of {target_table_name}",
+            items_path="$.Partitions",
+            max_concurrency=10,
+            result_path=sfn.JsonPath.DISCARD,
+        )
+        delete_partitions.item_processor(
+            delete_partition, mode=sfn.ProcessorMode.INLINE
+        )
+
+        # Drop a page of partitions at a time until there are none left,
+        # then make them again from what's on S3.
+        get_partitions.next(
+            sfn.Choice(self, f"Any partitions of {target_table_name} left?")
+            .when(
+                sfn.Condition.is_present("$.Partitions[0]"),
+                delete_partitions.next(get_partitions),
+            )
+            .otherwise(make_partitions)
+        )
+        self.entry_point = sfn.Chain.custom(
+            get_partitions, [make_partitions], make_partitions
+        )
@@ -0,0 +1,100 @@
+from aws_cdk import (
+    aws_lambda as lambda_,
+)
+from aws_cdk import (
+    aws_stepfunctions as sfn,
+)
+from aws_cdk import aws_stepfunctions_tasks as tasks
+from constructs import Construct
+
+
+class OutcodeParquetWorkUnitsConstruct(Construct):
+    """
+    Makes a <outcode>.parquet file per outcode from a table partitioned by
+    first_letter, in work units of about the same size.
+
+    Postcode letters are very skewed, so one lambda per letter means the
+    run takes as long as the biggest letter. Instead:
+
+    Workflow:
+    1. Plan work units from the size of each first_letter=X partition.
+       Small letters are packed together and big ones are split into
+       shards by outcode range.
+    2. Map over the work units, running first_letter_to_outcode_parquet
+       for each.
+
+    Parameters:
+    -----------
+    scope : Construct
+        The parent construct
+    construct_id : str
+        The construct ID
+    plan_work_units_lambda : lambda_.IFunction
+        Plans the work units (plan_outcode_work_units).
+    outcode_parquet_lambda : lambda_.IFunction
+        Bakes a work unit (first_letter_to_outcode_parquet).
+    outcode_parquet_payload : dict
+        The event for first_letter_to_outcode_parquet, without first_letter.
+        Must include source_bucket_name and source_path.
+    max_concurrency : int
+        How many work units to bake at once.
+    """
+
+    def __init__(
+        self,
+        scope: Construct,
+        construct_id: str,
+        plan_work_units_lambda: lambda_.IFunction,
+        outcode_parquet_lambda: lambda_.IFunction,
+        outcode_parquet_payload: dict,
+        max_concurrency: int = 32,
+        **kwargs,
+    ):
+        super().__init__(scope, construct_id, **kwargs)
+
+        plan_work_units = tasks.LambdaInvoke(
+            self,
+            f"{construct_id}: Plan outcode work units",
+            lambda_function=plan_work_units_lambda,
+            payload=sfn.TaskInput.from_object(
+                {
+                    "source_bucket_name": outcode_parquet_payload[
+                        "source_bucket_name"
+                    ],
+                    "source_path": outcode_parquet_payload["source_path"],
+                }
+            ),
+            result_selector={
+                "work_units": sfn.JsonPath.list_at("$.Payload.work_units"),
+            },
+        )
+
+        # Each item is a work unit: a list of
+        # {"first_letter", "shard_index", "shard_count"} to bake in turn.
+        # Shards stream their source unless the payload sets stream_source,
+        # so each reads only its range of outcodes.
+        make_outcode_parquet = tasks.LambdaInvoke(
+            self,
+            f"{construct_id}: Make outcode parquet for work unit",
+            lambda_function=outcode_parquet_lambda,
+            payload=sfn.TaskInput.from_object(
+                {
+                    **outcode_parquet_payload,
+                    "work_unit": sfn.JsonPath.list_at("$"),
+                }
+            ),
+        )
+
+        make_outcode_parquet_per_work_unit = sfn.Map(
+            self,
+            f"{construct_id}: Make outcode parquet per work unit",
+            items_path="$.work_units",
+            max_concurrency=max_concurrency,
+        )
+        make_outcode_parquet_per_work_unit.item_processor(
+            make_outcode_parquet, mode=sfn.ProcessorMode.INLINE
+        )
+
+        self.entry_point = sfn.Chain.start(plan_work_units).next(
+            make_outcode_parquet_per_work_unit
+        )
@@ -1,23 +1,20 @@
-import csv
 import io
 
 import boto3
+import ee_database
+import polars
 import psycopg
 
-ssm_client = boto3.client("ssm")
-
-host_response = ssm_client.get_parameter(
-    Name="/EveryElectionProd/DATABASE_HOST",
-)
-db_host = host_response["Parameter"]["Value"]
-
-password_response = ssm_client.get_parameter(
-    Name="/EveryElectionProd/DatabasePassword",
-)
-db_password = password_response["Parameter"]["Value"]
-
 ee_public_data_bucket = "ee.public.data"
 
+# The current_boundary_changes partition columns. These are in the S3 key
+# rather than the file.
+PARTITION_COLUMNS = [
+    "boundary_review_id",
+    "divisionset_generation",
+    "division_type",
+]
+
 
 def export_sql():
     return f"""
@@ -90,66 +87,131 @@ def export_sql():
         JOIN organisations_divisiongeographysubdivided dgs ON dgs.division_geography_id = dg.id
     ORDER BY
         r.review_created DESC,
-        r.organisation_name;
+        r.organisation_name
 
 """
 
 
-def handler(event, context):
-    db_name = "every_election"
-    db_user = "every_election"
-    db_port = "5432"
+def partitions_sql(query: str) -> str:
+    """
+    The current_boundary_changes partitions in the export. Postgres doesn't
+    work out the WKT for this, as it isn't selected.
+    """
+    return f"""
+    SELECT DISTINCT {", ".join(PARTITION_COLUMNS)} FROM ({query}) export
+    """
+
+
+def partition_sql(query: str, colnames: list) -> str:
+    """
+    The rows of one partition of the export, without the partition columns,
+    which are in the S3 key. Takes a value for each of PARTITION_COLUMNS as
+    parameters.
+    """
+    columns = [name for name in colnames if name not in PARTITION_COLUMNS]
+    filters = " AND ".join(
+        f"{name} IS NOT DISTINCT FROM %s" for name in PARTITION_COLUMNS
+    )
+    return f"""
+    SELECT {", ".join(columns)} FROM ({query}) export WHERE {filters}
+    """
+
+
+class CopyReader(io.RawIOBase):
+    """
+    Reads the CSV from a COPY TO STDOUT as a file, so it can be streamed to
+    S3 with `upload_fileobj` as Postgres writes it.
+    """
+
+    def __init__(self, copy):
+        self.copy = copy
+        self.data = b""
+
+    def readable(self) -> bool:
+        return True
 
+    def readinto(self, buffer) -> int:
+        if not self.data:
+            # An empty chunk means the COPY has finished
+            self.data = bytes(self.copy.read())
+        size = min(len(buffer), len(self.data))
+        buffer[:size] = self.data[:size]
+        self.data = self.data[size:]
+        return size
+
+
+def copy_sql(query: str) -> str:
+    return f"COPY ({query}) TO STDOUT WITH (FORMAT csv)"
+
+
+def copy_export(cur, query: str, params=None) -> polars.DataFrame:
+    """
+    Runs `query` with COPY, so Postgres writes the rows as CSV, which
+    Polars parses. The rows, and their WKT, never become Python objects.
+
+    Every column in current_boundary_changes is a string, so every column
+    is read as one.
+    """
+    buf = io.BytesIO()
+    with cur.copy(
+        f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER)", params
+    ) as copy:
+        for data in copy:
+            buf.write(data)
+    return polars.read_csv(buf.getvalue(), infer_schema=False)
+
+
+def handler(event, context):
     s3_bucket = event["s3_bucket"]
     s3_prefix = event["s3_prefix"]
+    # "csv" or "parquet", from the format of the current_boundary_changes
+    # table
+    export_format = event.get("export_format", "csv")
 
     query = export_sql()
 
-    conn = psycopg.connect(
-        host=db_host,
-        dbname=db_name,
-        user=db_user,
-        password=db_password,
-        port=db_port,
-    )
-    cur = conn.cursor(row_factory=psycopg.rows.dict_row)
-    cur.execute(query)
-    rows = cur.fetchall()
-
-    # Partition buffers: {(boundary_review_id, divisionset_generation, division_type): StringIO}
-    partition_buffers = {}
-
-    for row in rows:
-        boundary_review_id = row["boundary_review_id"]
-        divisionset_generation = row["divisionset_generation"]
-        division_type = row["division_type"]
-
-        key = (boundary_review_id, divisionset_generation, division_type)
-        if key not in partition_buffers:
-            buf = io.StringIO()
-            writer = csv.writer(buf)
-            partition_buffers[key] = (buf, writer)
-        else:
-            buf, writer = partition_buffers[key]
-
-        writer.writerow(row.values())
+    # Reused across warm invocations
+    conn = ee_database.get_connection()
+    # Every partition is read from the same snapshot
+    conn.isolation_level = psycopg.IsolationLevel.REPEATABLE_READ
+    cur = conn.cursor()
+    cur.execute(f"SELECT * FROM ({query}) export LIMIT 0")
+    colnames = [desc[0] for desc in cur.description]
+    cur.execute(partitions_sql(query))
+    partitions = cur.fetchall()
+    # Each partition is exported with a COPY of its own. CSV streams from
+    # Postgres to S3 without being held, while parquet is written from a
+    # dataframe, so holds one partition's rows at a time.
+    partition_query = partition_sql(query, colnames)
 
     s3 = boto3.client("s3")
-    for (boundary_review_id, divisionset_generation, division_type), (
-        buf,
-        writer,
-    ) in partition_buffers.items():
-        buf.seek(0)
+    for partition in partitions:
+        (
+            boundary_review_id,
+            divisionset_generation,
+            division_type,
+        ) = partition
         s3_key = (
             f"{s3_prefix}/boundary_review_id={boundary_review_id}/"
-            f"divisionset_generation={divisionset_generation}/division_type={division_type}/part-0000.csv"
+            f"divisionset_generation={divisionset_generation}/division_type={division_type}/part-0000.{export_format}"
         )
-        s3.put_object(Bucket=s3_bucket, Key=s3_key, Body=buf.getvalue())
+        if export_format == "parquet":
+            body = io.BytesIO()
+            copy_export(cur, partition_query, partition).write_parquet(
+                body, compression="zstd"
+            )
+            s3.put_object(Bucket=s3_bucket, Key=s3_key, Body=body.getvalue())
+        else:
+            with cur.copy(copy_sql(partition_query), partition) as copy:
+                s3.upload_fileobj(
+                    io.BufferedReader(CopyReader(copy)), s3_bucket, s3_key
+                )
 
     cur.close()
-    conn.close()
+    # Keep the connection for the next invocation
+    conn.rollback()
 
     return {
         "statusCode": 200,
-        "body": "Partitioned CSVs successfully exported to S3.",
+        "body": f"Partitioned {export_format} files successfully exported to S3.",
     }
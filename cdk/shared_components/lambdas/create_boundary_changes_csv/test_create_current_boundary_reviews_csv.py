@@ -0,0 +1,129 @@
+import io
+from unittest.mock import MagicMock, patch
+
+import polars
+
+# The modules make boto3 clients when they're imported.
+with patch("boto3.client"):
+    import create_current_boundary_reviews_csv
+    from create_current_boundary_reviews_csv import (
+        CopyReader,
+        handler,
+        partition_sql,
+    )
+
+COLNAMES = [
+    "slug",
+    "division_boundary_wkt",
+    "boundary_review_id",
+    "divisionset_generation",
+    "division_type",
+]
+PARTITIONS = [(963, "old", "DIW"), (963, None, "DIW")]
+ROWS = {
+    PARTITIONS[0]: b'a-review,"POLYGON((0 0, 1 1))"\n',
+    PARTITIONS[1]: b"a-review,\n",
+}
+
+
+class FakeCopy:
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def read(self):
+        return self.chunks.pop(0) if self.chunks else b""
+
+
+def make_cursor():
+    cur = MagicMock()
+    cur.description = [(name,) for name in COLNAMES]
+    cur.fetchall.return_value = PARTITIONS
+
+    def copy(statement, params):
+        if "HEADER" in statement:
+            return FakeCopy([b"slug,division_boundary_wkt\n", ROWS[params]])
+        return FakeCopy([ROWS[params]])
+
+    cur.copy.side_effect = copy
+    return cur
+
+
+def run_handler(export_format):
+    cur = make_cursor()
+    s3 = MagicMock()
+    uploaded = {}
+    s3.upload_fileobj.side_effect = lambda f, bucket, key: uploaded.update(
+        {key: f.read()}
+    )
+    s3.put_object.side_effect = lambda **kwargs: uploaded.update(
+        {kwargs["Key"]: kwargs["Body"]}
+    )
+    with (
+        patch.object(
+            create_current_boundary_reviews_csv.ee_database,
+            "get_connection",
+        ) as get_connection,
+        patch("boto3.client", return_value=s3),
+    ):
+        get_connection.return_value.cursor.return_value = cur
+        handler(
+            {
+                "s3_bucket": "bucket",
+                "s3_prefix": "prefix",
+                "export_format": export_format,
+            },
+            None,
+        )
+    return uploaded
+
+
+class TestPartitionSQL:
+    def test_selects_one_partition_without_partition_columns(self):
+        sql = partition_sql("SELECT 1", COLNAMES)
+        assert "SELECT slug, division_boundary_wkt FROM" in sql
+        # divisionset_generation can be NULL
+        assert sql.count("IS NOT DISTINCT FROM %s") == 3
+
+
+class TestCopyReader:
+    def test_reads_chunks_in_any_size(self):
+        reader = io.BufferedReader(
+            CopyReader(FakeCopy([b"abc", b"", b"defg"])), buffer_size=2
+        )
+        # An empty chunk ends the COPY
+        assert reader.read(2) == b"ab"
+        assert reader.read() == b"c"
+
+
+class TestHandler:
+    def test_csv_streamed_per_partition(self):
+        assert run_handler("csv") == {
+            "prefix/boundary_review_id=963/divisionset_generation=old/division_type=DIW/part-0000.csv": ROWS[
+                PARTITIONS[0]
+            ],
+            "prefix/boundary_review_id=963/divisionset_generation=None/division_type=DIW/part-0000.csv": ROWS[
+                PARTITIONS[1]
+            ],
+        }
+
+    def test_parquet_per_partition(self):
+        uploaded = run_handler("parquet")
+        exported = polars.read_parquet(
+            uploaded[
+                "prefix/boundary_review_id=963/divisionset_generation=old/division_type=DIW/part-0000.parquet"
+            ]
+        )
+        assert exported.rows() == [("a-review", "POLYGON((0 0, 1 1))")]
+        assert exported.schema == {
+            "slug": polars.Utf8,
+            "division_boundary_wkt": polars.Utf8,
+        }
@@ -1,21 +1,87 @@
 import csv
 import datetime
+import gzip
 import io
+import os
+import sqlite3
+from collections.abc import MutableMapping
 
 import boto3
+import ee_database
+import polars
 import psycopg
+from botocore.exceptions import ClientError
 
-ssm_client = boto3.client("ssm")
+# "csv" or "parquet", set by the stack from the format of the
+# current_ballots table.
+EXPORT_FORMAT = os.environ.get("EXPORT_FORMAT", "csv")
 
-host_response = ssm_client.get_parameter(
-    Name="/EveryElectionProd/DATABASE_HOST",
-)
-db_host = host_response["Parameter"]["Value"]
 
-password_response = ssm_client.get_parameter(
-    Name="/EveryElectionProd/DatabasePassword",
+s3_bucket = "ee.data-cache.production"
+# Exports are written to keys starting with these. See `upload_export`.
+s3_path = "ballots-with-wkt/current_elections"
+# The export without the WKT: each row has a hash of its geography
+# instead, so exports can be compared without reading the geographies.
+manifest_s3_key = "ballots-with-wkt-manifest/current_elections.csv.gz"
+# A copy of the manifest of the export that the current elections parquet
+# was last baked from, made by the state machine once a bake succeeds.
+# Changes are worked out against this rather than the last export written,
+# so a failed run doesn't lose them.
+baked_manifest_s3_key = (
+    "ballots-with-wkt-baked/current_elections-manifest.csv.gz"
 )
-db_password = password_response["Parameter"]["Value"]
+# The geographies that changed since the last bake, for the
+# current_ballots_changes table.
+changes_s3_path = "ballots-with-wkt-changes/changed_ballots"
+
+# Object metadata on the manifest with when the last full rebuild was
+# planned.
+LAST_FULL_REBUILD_METADATA_KEY = "last-full-rebuild"
+# Do a full rebuild if the last one is older than this, so the nightly
+# run still picks up new AddressBase data.
+FULL_REBUILD_INTERVAL = datetime.timedelta(hours=20)
+# Past this many changed geographies a full rebuild is about as quick.
+MAX_INCREMENTAL_GEOGRAPHIES = 200
+
+# The WKT of each subdivided geography from earlier runs, keyed on its
+# source table, id and a hash of the geography. Most don't change from one
+# run to the next, so only new or changed ones are serialised again. The
+# geographies in the last baked export are kept too, for the old version
+# of any that changed.
+geography_cache_s3_key = "ballots-with-wkt-cache/geographies.csv.gz"
+# Where the cache is kept while the lambda runs. See `GeographyCache`.
+GEOGRAPHY_CACHE_PATH = "/tmp/geography_cache.sqlite3"
+# Decimal places of longitude and latitude in the WKT. 6 is about 10cm,
+# well within the accuracy of the boundaries, and a lot shorter than the
+# full precision.
+WKT_DECIMAL_DIGITS = 6
+GEOGRAPHY_TABLES = {
+    "Organisation": "organisations_organisationgeographysubdivided",
+    "Division": "organisations_divisiongeographysubdivided",
+}
+
+# How many rows the export cursor fetches from the database at a time.
+EXPORT_BATCH_SIZE = 2000
+# Exports are uploaded in parts of about this size. S3 needs every part
+# but the last to be at least 5MB.
+UPLOAD_PART_SIZE = 8 * 1024 * 1024
+# Parquet exports are split into files of about this many rows, as Polars
+# only writes a parquet file from a whole dataframe.
+PARQUET_FILE_ROWS = 50_000
+
+# Parquet columns are read by name rather than position, so they're named
+# after the current_ballots columns.
+PARQUET_COLUMN_NAMES = {
+    "geography_id": "division_id",
+    "geography_text": "geometry",
+}
+# Columns that aren't strings in current_ballots.
+PARQUET_COLUMN_TYPES = {
+    "min_longitude": polars.Float64,
+    "max_longitude": polars.Float64,
+    "min_latitude": polars.Float64,
+    "max_latitude": polars.Float64,
+}
 
 
 def export_sql(date: str):
@@ -23,12 +89,23 @@ def export_sql(date: str):
     SELECT
         ee.election_id,
         COALESCE(odd.id, ogd.id) AS geography_id,
-        COALESCE(st_astext(odd.geography), st_astext(ogd.geography)) AS geography_text,
+        -- Only a hash of the geography here. The WKT comes from the
+        -- geography cache, or geography_text_sql if it isn't cached.
+        md5(st_asbinary(COALESCE(odd.geography, ogd.geography))) AS geography_hash,
+        -- In the same order as the COALESCEs, so an election with both a
+        -- division and an organisation geography is labelled with the one
+        -- exported, and its WKT is looked up in the right table.
         CASE
-           WHEN ogd.id IS NOT NULL THEN 'Organisation'
            WHEN odd.id IS NOT NULL THEN 'Division'
+           WHEN ogd.id IS NOT NULL THEN 'Organisation'
            ELSE 'None'
-        END AS source_table
+        END AS source_table,
+        -- The bounding box lets Athena rule out most addresses with a
+        -- cheap range check before parsing and testing the polygon.
+        st_xmin(COALESCE(odd.geography, ogd.geography)::geometry) AS min_longitude,
+        st_xmax(COALESCE(odd.geography, ogd.geography)::geometry) AS max_longitude,
+        st_ymin(COALESCE(odd.geography, ogd.geography)::geometry) AS min_latitude,
+        st_ymax(COALESCE(odd.geography, ogd.geography)::geometry) AS max_latitude
     FROM
         elections_election ee
         LEFT JOIN organisations_divisiongeographysubdivided odd
@@ -43,44 +120,565 @@ def export_sql(date: str):
     """
 
 
-def handler(event, context):
-    db_name = "every_election"
-    db_user = "every_election"
-    db_port = "5432"
+def geography_text_sql(table: str) -> str:
+    return f"""
+    SELECT
+        id,
+        md5(st_asbinary(geography)) AS geography_hash,
+        st_astext(geography::geometry, {WKT_DECIMAL_DIGITS}) AS geography_text
+    FROM {table}
+    WHERE id = ANY(%s)
+    """
+
+
+class GeographyCache(MutableMapping):
+    """
+    The geography cache, kept in an SQLite database on local disk so the
+    WKT of every geography isn't held in memory at once.
+
+    Maps (source_table, geography_id, geography_hash) to WKT, like a dict.
+    """
+
+    def __init__(self, path: str = GEOGRAPHY_CACHE_PATH):
+        # Start again rather than use one left by a warm invocation
+        if os.path.exists(path):
+            os.remove(path)
+        self.db = sqlite3.connect(path)
+        self.db.execute(
+            """
+            CREATE TABLE geographies (
+                source_table TEXT,
+                geography_id TEXT,
+                geography_hash TEXT,
+                geography_text TEXT,
+                PRIMARY KEY (source_table, geography_id, geography_hash)
+            )
+            """
+        )
+
+    def __getitem__(self, key: tuple) -> str:
+        row = self.db.execute(
+            """
+            SELECT geography_text FROM geographies
+            WHERE source_table = ? AND geography_id = ? AND geography_hash = ?
+            """,
+            key,
+        ).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return row[0]
+
+    def __setitem__(self, key: tuple, text: str):
+        self.db.execute(
+            "INSERT OR REPLACE INTO geographies VALUES (?, ?, ?, ?)",
+            (*key, text),
+        )
+
+    def __delitem__(self, key: tuple):
+        if key not in self:
+            raise KeyError(key)
+        self.db.execute(
+            """
+            DELETE FROM geographies
+            WHERE source_table = ? AND geography_id = ? AND geography_hash = ?
+            """,
+            key,
+        )
+
+    def __iter__(self):
+        return iter(
+            self.db.execute(
+                """
+                SELECT source_table, geography_id, geography_hash
+                FROM geographies
+                ORDER BY source_table, geography_id, geography_hash
+                """
+            ).fetchall()
+        )
+
+    def __len__(self) -> int:
+        return self.db.execute("SELECT count(*) FROM geographies").fetchone()[0]
+
+    def update_from_rows(self, rows):
+        """
+        Adds (source_table, geography_id, geography_hash, geography_text)
+        rows, as they're read, without holding them all.
+        """
+        self.db.executemany(
+            "INSERT OR REPLACE INTO geographies VALUES (?, ?, ?, ?)", rows
+        )
+
+
+def get_geography_cache(s3) -> GeographyCache:
+    """
+    Returns: WKT keyed on (source_table, geography_id, geography_hash)
+    """
+    cache = GeographyCache()
+    try:
+        response = s3.get_object(Bucket=s3_bucket, Key=geography_cache_s3_key)
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+            return cache
+        raise
+    # Decompress and parse a line at a time, straight into the database
+    with gzip.open(response["Body"], "rt", newline="") as f:
+        reader = csv.reader(f)
+        next(reader)
+        cache.update_from_rows(reader)
+    return cache
+
+
+def put_geography_cache(s3, cache: MutableMapping, keys: set = None):
+    """
+    Uploads the geographies in `cache` with one of `keys`, or all of them.
+    """
+    with (
+        MultipartUpload(s3, s3_bucket, geography_cache_s3_key) as upload,
+        gzip.open(upload, "wt", newline="") as f,
+    ):
+        csv_writer = csv.writer(f)
+        csv_writer.writerow(
+            ["source_table", "geography_id", "geography_hash", "geography_text"]
+        )
+        for key in cache:
+            if keys is None or key in keys:
+                csv_writer.writerow((*key, cache[key]))
+
+
+def geography_key(row) -> tuple | None:
+    """
+    Returns: the geography cache key of an export or manifest row, or None
+        if it has no geography
+    """
+    if row[3] not in GEOGRAPHY_TABLES:
+        return None
+    return row[3], str(row[1]), row[2]
+
+
+def fill_geography_text(cur, rows: list, cache: MutableMapping) -> list:
+    """
+    Swaps the geography hash in each exported row for its WKT, from `cache`
+    or from the database if it isn't there. Geographies fetched from the
+    database are added to `cache`.
+
+    `cur` must be in the same repeatable read transaction as the export, so
+    the geographies fetched are the ones that were hashed.
+
+    Returns: the rows
+    """
+    keys = {geography_key(row) for row in rows} - {None}
+    missing = {key for key in keys if key not in cache}
+    for source_table, table in GEOGRAPHY_TABLES.items():
+        ids = sorted({int(key[1]) for key in missing if key[0] == source_table})
+        if not ids:
+            continue
+        cur.execute(geography_text_sql(table), (ids,))
+        for geography_id, digest, text in cur.fetchall():
+            cache[(source_table, str(geography_id), digest)] = text
+    print(f"{len(keys) - len(missing)} geographies cached, {len(missing)} not")
+
+    return [with_geography_text(row, cache) for row in rows]
+
+
+def with_geography_text(row, cache: MutableMapping) -> tuple:
+    key = geography_key(row)
+    return (row[0], row[1], cache[key] if key else None, *row[3:])
+
+
+def iter_export_batches(
+    export_cur, cur, cache: MutableMapping, manifest_rows: list
+):
+    """
+    Yields the export a batch of rows at a time, with the WKT of each
+    geography filled in by `fill_geography_text`. The rows as they come
+    from `export_cur`, with the geography hash, are added to
+    `manifest_rows`.
+    """
+    while batch := export_cur.fetchmany(EXPORT_BATCH_SIZE):
+        manifest_rows.extend(batch)
+        yield fill_geography_text(cur, batch, cache)
+
+
+def diff_ballots(previous_rows: list, current_rows: list) -> list:
+    """
+    Finds the geographies that changed between two manifests.
+
+    Rows start (election_id, geography_id, geography_hash, ...), and are
+    keyed on election_id and geography_id. A row is changed if it was
+    added, removed, or its geography hash is different. Rows from the
+    database have None where rows read back from a CSV have "", in the
+    geography_id as well as the hash, so both count as no geography.
+
+    Returns: the changed rows with a version column added. version is "new" for an added geography or the new
+        version of a changed one, and "old" for a removed geography or the
+        old version of a changed one. Addresses in either may need new
+        ballots.
+    """
+
+    def by_key(rows):
+        return {
+            (str(row[0]), "" if row[1] is None else str(row[1])): row
+            for row in rows
+        }
+
+    previous = by_key(previous_rows)
+    current = by_key(current_rows)
+
+    changes = []
+    for key in sorted(previous.keys() | current.keys()):
+        previous_row = previous.get(key)
+        current_row = current.get(key)
+        if (
+            previous_row
+            and current_row
+            and (previous_row[2] or "") == (current_row[2] or "")
+        ):
+            continue
+        if previous_row:
+            changes.append((*previous_row, "old"))
+        if current_row:
+            changes.append((*current_row, "new"))
+    return changes
 
-    s3_bucket = "ee.data-cache.production"
-    s3_key = "ballots-with-wkt/current_elections.csv"
 
+def get_baked_manifest(
+    s3, colnames: list
+) -> tuple[list, datetime.datetime | None] | None:
+    """
+    Returns: the rows of the manifest of the export the parquet was last
+        baked from, and when the last full rebuild was. None if there isn't
+        one, or if it has different columns to `colnames` and so can't be
+        compared.
+    """
+    try:
+        response = s3.get_object(Bucket=s3_bucket, Key=baked_manifest_s3_key)
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+            return None
+        raise
+    last_full_rebuild = response.get("Metadata", {}).get(
+        LAST_FULL_REBUILD_METADATA_KEY
+    )
+    with gzip.open(response["Body"], "rt", newline="") as f:
+        reader = csv.reader(f)
+        if next(reader) != colnames:
+            print("The baked manifest has different columns")
+            return None
+        # NULLs are written to the CSV as "", so read them back as None,
+        # as they came from the database. Polars can't make a Float64 bbox
+        # column from "" when old rows are exported as parquet.
+        baked_rows = [[value or None for value in row] for row in reader]
+    return (
+        baked_rows,
+        datetime.datetime.fromisoformat(last_full_rebuild)
+        if last_full_rebuild
+        else None,
+    )
+
+
+def put_manifest(
+    s3, colnames: list, rows: list, last_full_rebuild: datetime.datetime
+):
+    with (
+        MultipartUpload(
+            s3,
+            s3_bucket,
+            manifest_s3_key,
+            metadata={
+                LAST_FULL_REBUILD_METADATA_KEY: last_full_rebuild.isoformat()
+            },
+        ) as upload,
+        gzip.open(upload, "wt", newline="") as f,
+    ):
+        csv_writer = csv.writer(f)
+        csv_writer.writerow(colnames)
+        csv_writer.writerows(rows)
+
+
+def plan_rebuild(
+    baked: tuple[list, datetime.datetime | None] | None,
+    rows: list,
+    geography_cache: MutableMapping,
+    now: datetime.datetime,
+) -> tuple[str, list, datetime.datetime]:
+    """
+    Decides how much of the current elections parquet to rebuild, from
+    the baked manifest from `get_baked_manifest` and the manifest `rows`
+    of this export.
+
+    An incremental rebuild needs the WKT of the old version of each changed
+    geography from `geography_cache`. If one isn't there, this does a full
+    rebuild instead.
+
+    Returns: "none", "incremental" or "full", the changed manifest rows
+        from `diff_ballots`, and when the last full rebuild will have been
+        once this one is done
+    """
+    if not baked:
+        print("No baked manifest to compare with, doing a full rebuild")
+        return "full", [], now
+
+    baked_rows, last_full_rebuild = baked
+    if not last_full_rebuild or now - last_full_rebuild > FULL_REBUILD_INTERVAL:
+        print(f"Last full rebuild was {last_full_rebuild}, doing another")
+        return "full", [], now
+
+    changes = diff_ballots(baked_rows, rows)
+    if not changes:
+        return "none", changes, last_full_rebuild
+    if len(changes) > MAX_INCREMENTAL_GEOGRAPHIES:
+        print(f"{len(changes)} changed geographies, doing a full rebuild")
+        return "full", changes, now
+    uncached = {
+        key
+        for key in {geography_key(row) for row in changes} - {None}
+        if key not in geography_cache
+    }
+    if uncached:
+        print(
+            f"{len(uncached)} changed geographies not cached, doing a full rebuild"
+        )
+        return "full", changes, now
+    return "incremental", changes, last_full_rebuild
+
+
+class MultipartUpload:
+    """
+    A file-like object that uploads what's written to it to S3 in parts,
+    so the whole object is never held in memory.
+
+    Usage:
+
+        with MultipartUpload(s3, bucket, key) as f:
+            csv.writer(f).writerows(rows)
+
+    The upload is completed when the block exits, or aborted if it raises.
+    """
+
+    def __init__(
+        self,
+        s3,
+        bucket: str,
+        key: str,
+        metadata: dict = None,
+        part_size: int = UPLOAD_PART_SIZE,
+    ):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.metadata = metadata or {}
+        self.part_size = part_size
+        self.buffer = io.BytesIO()
+        self.parts = []
+        self.upload_id = None
+
+    def __enter__(self):
+        self.upload_id = self.s3.create_multipart_upload(
+            Bucket=self.bucket, Key=self.key, Metadata=self.metadata
+        )["UploadId"]
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type:
+            self.s3.abort_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self.upload_id
+            )
+            return
+        self.upload_part()
+        self.s3.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            MultipartUpload={"Parts": self.parts},
+        )
+
+    def write(self, data: str | bytes) -> int:
+        written = self.buffer.write(
+            data.encode() if isinstance(data, str) else data
+        )
+        if self.buffer.tell() >= self.part_size:
+            self.upload_part()
+        return written
+
+    def flush(self):
+        # Parts are uploaded once they're big enough, or on exit
+        pass
+
+    def upload_part(self):
+        part_number = len(self.parts) + 1
+        response = self.s3.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            PartNumber=part_number,
+            Body=self.buffer.getvalue(),
+        )
+        self.parts.append({"ETag": response["ETag"], "PartNumber": part_number})
+        self.buffer = io.BytesIO()
+
+
+def rows_to_dataframe(colnames: list, rows: list) -> polars.DataFrame:
+    return polars.DataFrame(
+        rows,
+        schema={
+            PARQUET_COLUMN_NAMES.get(name, name): PARQUET_COLUMN_TYPES.get(
+                name, polars.Utf8
+            )
+            for name in colnames
+        },
+        orient="row",
+        strict=False,
+    )
+
+
+def iter_parquet_files(colnames: list, batches):
+    """
+    Joins `batches` of rows into dataframes of about PARQUET_FILE_ROWS
+    rows. There's always at least one, even if it's empty.
+    """
+    frames = []
+    rows = 0
+    yielded = False
+    for batch in batches:
+        frames.append(rows_to_dataframe(colnames, batch))
+        rows += len(batch)
+        if rows >= PARQUET_FILE_ROWS:
+            yield polars.concat(frames)
+            yielded = True
+            frames = []
+            rows = 0
+    if frames or not yielded:
+        yield polars.concat([rows_to_dataframe(colnames, []), *frames])
+
+
+def upload_export(s3, path: str, colnames: list, batches) -> list[str]:
+    """
+    Uploads `batches` of rows as CSV or parquet, depending on
+    EXPORT_FORMAT, and deletes any other export under `path`, from an
+    earlier run or in the other format.
+
+    CSV is written to <path>.csv a batch at a time. Polars can only write
+    a parquet file from a whole dataframe, so parquet is split into files
+    of about PARQUET_FILE_ROWS rows, <path>-00000.parquet and so on, and
+    only one file's rows are held at a time. The tables read every file
+    under their prefix.
+
+    Returns: the keys written
+    """
+    keys = []
+    if EXPORT_FORMAT == "parquet":
+        for i, df in enumerate(iter_parquet_files(colnames, batches)):
+            keys.append(f"{path}-{i:05d}.parquet")
+            with MultipartUpload(s3, s3_bucket, keys[-1]) as f:
+                df.write_parquet(f, compression="zstd")
+    else:
+        keys.append(f"{path}.csv")
+        with MultipartUpload(s3, s3_bucket, keys[-1]) as f:
+            csv_writer = csv.writer(f)
+            csv_writer.writerow(colnames)
+            for rows in batches:
+                csv_writer.writerows(rows)
+    delete_stale_exports(s3, path, keys)
+    return keys
+
+
+def delete_stale_exports(s3, path: str, keys: list[str]):
+    """
+    Deletes objects starting with `path` that aren't in `keys`.
+    """
+    paginator = s3.get_paginator("list_objects_v2")
+    stale = [
+        {"Key": obj["Key"]}
+        for page in paginator.paginate(Bucket=s3_bucket, Prefix=path)
+        for obj in page.get("Contents", [])
+        if obj["Key"] not in keys
+    ]
+    # delete_objects takes up to 1000 keys at a time
+    for i in range(0, len(stale), 1000):
+        response = s3.delete_objects(
+            Bucket=s3_bucket, Delete={"Objects": stale[i : i + 1000]}
+        )
+        if response.get("Errors"):
+            raise Exception(
+                f"Failed to delete stale exports: {response['Errors']}"
+            )
+
+
+def handler(event, context):
     delta = datetime.datetime.now() - datetime.timedelta(days=30)
 
     query = export_sql(delta.date().strftime("%Y-%m-%d"))
 
-    conn = psycopg.connect(
-        host=db_host,
-        dbname=db_name,
-        user=db_user,
-        password=db_password,
-        port=db_port,
-    )
+    # Reused across warm invocations
+    conn = ee_database.get_connection()
+    # The export and fetching uncached geographies see the same data
+    conn.isolation_level = psycopg.IsolationLevel.REPEATABLE_READ
+    # A server-side cursor, so rows come from the database in batches
+    # rather than all at once.
+    export_cur = conn.cursor(name="current_elections_export")
+    export_cur.execute(query)
+
+    # Get column headers from the cursor description. The export has the
+    # geography text where the query and manifest have its hash.
+    manifest_colnames = [desc[0] for desc in export_cur.description]
+    colnames = [
+        "geography_text" if name == "geography_hash" else name
+        for name in manifest_colnames
+    ]
+
     cur = conn.cursor()
-    cur.execute(query)
-    rows = cur.fetchall()
+    s3 = boto3.client("s3")
+    geography_cache = get_geography_cache(s3)
+    cached_keys = set(geography_cache)
+    baked = get_baked_manifest(s3, manifest_colnames)
 
-    # Get column headers from the cursor description
-    colnames = [desc[0] for desc in cur.description]
+    # Upload the export to S3 as the rows come from the database. Only the
+    # manifest rows, without the WKT, are kept for working out what
+    # changed.
+    manifest_rows = []
+    upload_export(
+        s3,
+        s3_path,
+        colnames,
+        iter_export_batches(export_cur, cur, geography_cache, manifest_rows),
+    )
+    export_cur.close()
 
-    # Write CSV data to an in-memory string buffer
-    csv_buffer = io.StringIO()
-    csv_writer = csv.writer(csv_buffer)
-    csv_writer.writerow(colnames)  # Write header row
-    csv_writer.writerows(rows)  # Write data rows
+    now = datetime.datetime.now(datetime.timezone.utc)
+    rebuild, changes, last_full_rebuild = plan_rebuild(
+        baked, manifest_rows, geography_cache, now
+    )
+    print(f"Rebuild: {rebuild}, {len(changes)} changed geographies")
 
-    # Upload the CSV data to S3
-    s3 = boto3.client("s3")
-    s3.put_object(Bucket=s3_bucket, Key=s3_key, Body=csv_buffer.getvalue())
+    if rebuild == "incremental":
+        upload_export(
+            s3,
+            changes_s3_path,
+            [*colnames, "version"],
+            [[with_geography_text(row, geography_cache) for row in changes]],
+        )
+
+    # The state machine copies the manifest, metadata and all, to
+    # baked_manifest_s3_key once the parquet has been rebuilt from the
+    # export.
+    put_manifest(s3, manifest_colnames, manifest_rows, last_full_rebuild)
+
+    # Keep the geographies in this export and the baked one
+    used_keys = {geography_key(row) for row in manifest_rows}
+    if baked:
+        used_keys |= {geography_key(row) for row in baked[0]}
+    used_keys.discard(None)
+    if used_keys != cached_keys:
+        put_geography_cache(s3, geography_cache, used_keys)
 
     # Clean up
     cur.close()
-    conn.close()
+    # Keep the connection for the next invocation
+    conn.rollback()
 
-    return {"statusCode": 200, "body": "CSV successfully exported to S3."}
+    return {
+        "statusCode": 200,
+        "body": "CSV successfully exported to S3.",
+        "rebuild": rebuild,
+        "changed_geographies": len(changes),
+    }
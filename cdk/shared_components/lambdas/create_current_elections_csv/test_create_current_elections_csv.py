@@ -0,0 +1,516 @@
+import csv
+import datetime
+import gzip
+import io
+import re
+from unittest.mock import MagicMock, patch
+
+import polars
+import pytest
+from botocore.exceptions import ClientError
+
+# The modules make boto3 clients when they're imported.
+with patch("boto3.client"):
+    import create_current_elections_csv
+    from create_current_elections_csv import (
+        GeographyCache,
+        MultipartUpload,
+        diff_ballots,
+        export_sql,
+        fill_geography_text,
+        get_baked_manifest,
+        get_geography_cache,
+        iter_export_batches,
+        plan_rebuild,
+        put_geography_cache,
+        put_manifest,
+        upload_export,
+        with_geography_text,
+    )
+
+NOW = datetime.datetime(2026, 5, 1, 12, tzinfo=datetime.timezone.utc)
+MANIFEST_COLNAMES = [
+    "election_id",
+    "geography_id",
+    "geography_hash",
+    "source_table",
+    "min_longitude",
+]
+
+
+def make_s3():
+    s3 = MagicMock()
+    s3.get_object.side_effect = ClientError(
+        {"Error": {"Code": "NoSuchKey"}}, "GetObject"
+    )
+    s3.create_multipart_upload.return_value = {"UploadId": "upload-1"}
+    s3.upload_part.side_effect = lambda **kwargs: {
+        "ETag": f"etag-{kwargs['PartNumber']}"
+    }
+    return s3
+
+
+def read_back(s3):
+    """
+    Makes `s3.get_object` return what was last uploaded to `s3` in parts.
+    """
+    s3.get_object.side_effect = None
+    s3.get_object.return_value = {
+        "Body": io.BytesIO(
+            b"".join(
+                call.kwargs["Body"] for call in s3.upload_part.call_args_list
+            )
+        ),
+        "Metadata": s3.create_multipart_upload.call_args.kwargs["Metadata"],
+    }
+    s3.upload_part.reset_mock()
+
+
+def make_baked(rows, last_full_rebuild=NOW - datetime.timedelta(hours=1)):
+    """
+    A baked manifest as `get_baked_manifest` reads it back, with strings
+    for every value but NULLs.
+    """
+    return (
+        [
+            [None if value is None else str(value) for value in row]
+            for row in rows
+        ],
+        last_full_rebuild,
+    )
+
+
+class TestDiffBallots:
+    def test_unchanged(self):
+        rows = [("local.a.2026-05-07", 1, "aaa", "Division")]
+        previous = [("local.a.2026-05-07", "1", "aaa", "Division")]
+        assert diff_ballots(previous, rows) == []
+
+    def test_missing_geography_read_back_from_csv(self):
+        assert (
+            diff_ballots([("e", "1", "", "None")], [("e", 1, None, "None")])
+            == []
+        )
+
+    def test_no_geography_read_back_from_csv(self):
+        # Elections without a geography have a NULL geography_id too
+        assert (
+            diff_ballots([("e", "", "", "None")], [("e", None, None, "None")])
+            == []
+        )
+
+    def test_added_removed_and_changed(self):
+        previous = [
+            ("removed", "1", "aaa", "Division"),
+            ("changed", "2", "bbb", "Organisation"),
+        ]
+        current = [
+            ("changed", 2, "ccc", "Organisation"),
+            ("added", 4, "ddd", "Division"),
+        ]
+        assert diff_ballots(previous, current) == [
+            ("added", 4, "ddd", "Division", "new"),
+            ("changed", "2", "bbb", "Organisation", "old"),
+            ("changed", 2, "ccc", "Organisation", "new"),
+            ("removed", "1", "aaa", "Division", "old"),
+        ]
+
+
+class TestPlanRebuild:
+    rows = [("local.a.2026-05-07", 1, "aaa", "Division", -1.5)]
+    cache = {
+        ("Division", "1", "aaa"): "POLYGON((0 0))",
+        ("Division", "1", "old"): "POLYGON((9 9))",
+        ("Division", "2", "bbb"): "POLYGON((1 1))",
+    }
+
+    def test_full_without_baked_manifest(self):
+        assert plan_rebuild(None, self.rows, self.cache, NOW) == (
+            "full",
+            [],
+            NOW,
+        )
+
+    def test_full_when_last_full_rebuild_is_old(self):
+        baked = make_baked(
+            self.rows, last_full_rebuild=NOW - datetime.timedelta(days=1)
+        )
+        assert plan_rebuild(baked, self.rows, self.cache, NOW)[0] == "full"
+
+    def test_none_when_unchanged(self):
+        last_full_rebuild = NOW - datetime.timedelta(hours=1)
+        baked = make_baked(self.rows, last_full_rebuild=last_full_rebuild)
+        assert plan_rebuild(baked, self.rows, self.cache, NOW) == (
+            "none",
+            [],
+            last_full_rebuild,
+        )
+
+    def test_incremental_when_a_few_changed(self):
+        rows = [
+            *self.rows,
+            ("local.b.2026-05-07", 2, "bbb", "Division", -1.0),
+        ]
+        rebuild, changes, _ = plan_rebuild(
+            make_baked(self.rows), rows, self.cache, NOW
+        )
+        assert rebuild == "incremental"
+        assert [change[0] for change in changes] == ["local.b.2026-05-07"]
+
+    def test_full_when_many_changed(self):
+        rows = [
+            (f"local.{i}.2026-05-07", i, "bbb", "Division", -1.0)
+            for i in range(500)
+        ]
+        rebuild, changes, last_full_rebuild = plan_rebuild(
+            make_baked(self.rows), rows, self.cache, NOW
+        )
+        assert rebuild == "full"
+        assert last_full_rebuild == NOW
+
+    def test_full_when_old_geography_not_cached(self):
+        baked = make_baked(
+            [("local.a.2026-05-07", 1, "gone", "Division", -1.5)]
+        )
+        assert plan_rebuild(baked, self.rows, self.cache, NOW)[0] == "full"
+
+
+class TestBakedManifest:
+    rows = [
+        ("local.a.2026-05-07", 1, "aaa", "Division", -1.5),
+        ("ref.b.2026-05-07", None, None, "None", None),
+    ]
+
+    def test_round_trip(self):
+        s3 = make_s3()
+        put_manifest(s3, MANIFEST_COLNAMES, self.rows, NOW)
+        read_back(s3)
+
+        baked = get_baked_manifest(s3, MANIFEST_COLNAMES)
+
+        assert baked == make_baked(self.rows, NOW)
+        assert diff_ballots(baked[0], self.rows) == []
+
+    def test_columns_changed(self):
+        s3 = make_s3()
+        put_manifest(s3, MANIFEST_COLNAMES, self.rows, NOW)
+        read_back(s3)
+        assert (
+            get_baked_manifest(s3, [*MANIFEST_COLNAMES, "max_longitude"])
+            is None
+        )
+
+    def test_no_baked_manifest(self):
+        assert get_baked_manifest(make_s3(), MANIFEST_COLNAMES) is None
+
+
+class TestExportSQL:
+    def test_source_table_matches_exported_geography(self):
+        # Elections can join to both a division and an organisation
+        # geography. The id and geography are the division's, so the
+        # source_table has to be too.
+        sql = export_sql("2026-05-01")
+        assert re.findall(r"COALESCE\((\w+)\.id, (\w+)\.id\)", sql) == [
+            ("odd", "ogd")
+        ]
+        assert re.findall(r"WHEN (\w+)\.id IS NOT NULL THEN '(\w+)'", sql) == [
+            ("odd", "Division"),
+            ("ogd", "Organisation"),
+        ]
+
+
+class TestGeographyCache:
+    def test_fills_cached_and_fetches_missing(self):
+        rows = [
+            ("local.a.2026-05-07", 1, "aaa", "Division", -1.5),
+            ("local.b.2026-05-07", 2, "bbb", "Organisation", -1.0),
+            ("ref.c.2026-05-07", None, None, "None", None),
+        ]
+        cache = {
+            ("Division", "1", "aaa"): "POLYGON((1 1))",
+            ("Division", "9", "old"): "POLYGON((9 9))",
+        }
+        cur = MagicMock()
+        cur.fetchall.return_value = [(2, "bbb", "POLYGON((2 2))")]
+
+        filled = fill_geography_text(cur, rows, cache)
+
+        assert filled == [
+            ("local.a.2026-05-07", 1, "POLYGON((1 1))", "Division", -1.5),
+            ("local.b.2026-05-07", 2, "POLYGON((2 2))", "Organisation", -1.0),
+            ("ref.c.2026-05-07", None, None, "None", None),
+        ]
+        # Only the organisation geography wasn't cached
+        cur.execute.assert_called_once()
+        assert "organisationgeographysubdivided" in cur.execute.call_args[0][0]
+        assert cur.execute.call_args[0][1] == ([2],)
+        assert cache == {
+            ("Division", "1", "aaa"): "POLYGON((1 1))",
+            ("Division", "9", "old"): "POLYGON((9 9))",
+            ("Organisation", "2", "bbb"): "POLYGON((2 2))",
+        }
+
+    def test_round_trip(self):
+        cache = {("Division", "1", "aaa"): "POLYGON((1 1, 2 2))"}
+        s3 = make_s3()
+        put_geography_cache(s3, cache)
+        read_back(s3)
+        assert get_geography_cache(s3) == cache
+
+    def test_only_puts_used_keys(self):
+        cache = {
+            ("Division", "1", "aaa"): "POLYGON((1 1))",
+            ("Division", "2", "bbb"): "POLYGON((2 2))",
+        }
+        s3 = make_s3()
+        put_geography_cache(s3, cache, {("Division", "2", "bbb")})
+        read_back(s3)
+        assert get_geography_cache(s3) == {
+            ("Division", "2", "bbb"): "POLYGON((2 2))"
+        }
+
+    def test_no_cache_yet(self):
+        assert get_geography_cache(make_s3()) == {}
+
+    def test_on_disk_cache_is_a_mapping(self, tmp_path):
+        cache = GeographyCache(str(tmp_path / "cache.sqlite3"))
+        cache[("Organisation", "2", "bbb")] = "POLYGON((2 2))"
+        cache[("Division", "1", "aaa")] = "POLYGON((0 0))"
+        cache[("Division", "1", "aaa")] = "POLYGON((1 1))"
+
+        assert len(cache) == 2
+        assert ("Division", "1", "aaa") in cache
+        assert ("Division", "1", "zzz") not in cache
+        assert list(cache) == [
+            ("Division", "1", "aaa"),
+            ("Organisation", "2", "bbb"),
+        ]
+        del cache[("Organisation", "2", "bbb")]
+        assert cache == {("Division", "1", "aaa"): "POLYGON((1 1))"}
+        with pytest.raises(KeyError):
+            del cache[("Organisation", "2", "bbb")]
+
+
+class TestExportBatches:
+    def test_streams_filled_batches_and_keeps_manifest_rows(self):
+        batches = [
+            [("local.a.2026-05-07", 1, "aaa", "Division", -1.5)],
+            [("ref.b.2026-05-07", None, None, "None", None)],
+        ]
+        export_cur = MagicMock()
+        export_cur.fetchmany.side_effect = [*batches, []]
+        cache = {("Division", "1", "aaa"): "POLYGON((1 1))"}
+        manifest_rows = []
+        s3 = make_s3()
+
+        upload_export(
+            s3,
+            "key",
+            ["election_id", "geography_id", "geography_text", "source_table"],
+            iter_export_batches(export_cur, MagicMock(), cache, manifest_rows),
+        )
+
+        assert manifest_rows == [*batches[0], *batches[1]]
+        body = s3.upload_part.call_args.kwargs["Body"].decode()
+        assert list(csv.reader(io.StringIO(body))) == [
+            ["election_id", "geography_id", "geography_text", "source_table"],
+            ["local.a.2026-05-07", "1", "POLYGON((1 1))", "Division", "-1.5"],
+            ["ref.b.2026-05-07", "", "", "None", ""],
+        ]
+
+    def test_manifest_is_gzipped_csv(self):
+        s3 = make_s3()
+        put_manifest(s3, MANIFEST_COLNAMES, [], NOW)
+        body = s3.upload_part.call_args.kwargs["Body"]
+        assert gzip.decompress(body).decode().splitlines() == [
+            ",".join(MANIFEST_COLNAMES)
+        ]
+
+
+class TestMultipartUpload:
+    def make_s3(self):
+        s3 = MagicMock()
+        s3.create_multipart_upload.return_value = {"UploadId": "upload-1"}
+        s3.upload_part.side_effect = lambda **kwargs: {
+            "ETag": f"etag-{kwargs['PartNumber']}"
+        }
+        return s3
+
+    def test_uploads_in_parts(self):
+        s3 = self.make_s3()
+        with MultipartUpload(s3, "bucket", "key", part_size=10) as f:
+            f.write("a" * 12)
+            f.write("b" * 3)
+
+        bodies = [call.kwargs["Body"] for call in s3.upload_part.call_args_list]
+        assert bodies == [b"a" * 12, b"b" * 3]
+        s3.complete_multipart_upload.assert_called_once_with(
+            Bucket="bucket",
+            Key="key",
+            UploadId="upload-1",
+            MultipartUpload={
+                "Parts": [
+                    {"ETag": "etag-1", "PartNumber": 1},
+                    {"ETag": "etag-2", "PartNumber": 2},
+                ]
+            },
+        )
+
+    def test_aborts_on_error(self):
+        s3 = self.make_s3()
+        with (
+            pytest.raises(ValueError),
+            MultipartUpload(s3, "bucket", "key") as f,
+        ):
+            f.write("a")
+            raise ValueError
+        s3.abort_multipart_upload.assert_called_once_with(
+            Bucket="bucket", Key="key", UploadId="upload-1"
+        )
+        s3.complete_multipart_upload.assert_not_called()
+
+
+class TestParquetExport:
+    def test_round_trip(self):
+        colnames = [
+            "election_id",
+            "geography_id",
+            "geography_text",
+            "source_table",
+            "min_longitude",
+            "max_longitude",
+        ]
+        batches = [
+            [
+                (
+                    "local.a.2026-05-07",
+                    1,
+                    "POLYGON((0 0))",
+                    "Division",
+                    -1.5,
+                    1.0,
+                )
+            ],
+            [("ref.b.2026-05-07", None, None, "None", None, None)],
+        ]
+        s3 = make_s3()
+        with patch.object(
+            create_current_elections_csv, "EXPORT_FORMAT", "parquet"
+        ):
+            upload_export(s3, "key", colnames, batches)
+
+        exported = polars.read_parquet(s3.upload_part.call_args.kwargs["Body"])
+        # Named after the current_ballots columns, with division_id a string
+        assert exported.columns == [
+            "election_id",
+            "division_id",
+            "geometry",
+            "source_table",
+            "min_longitude",
+            "max_longitude",
+        ]
+        assert exported.rows() == [
+            (
+                "local.a.2026-05-07",
+                "1",
+                "POLYGON((0 0))",
+                "Division",
+                -1.5,
+                1.0,
+            ),
+            ("ref.b.2026-05-07", None, None, "None", None, None),
+        ]
+
+    def test_removed_election_without_geography(self):
+        colnames = [
+            "election_id",
+            "geography_id",
+            "geography_text",
+            "source_table",
+            "min_longitude",
+        ]
+        s3 = make_s3()
+        put_manifest(
+            s3,
+            MANIFEST_COLNAMES,
+            [("ref.b.2026-05-07", None, None, "None", None)],
+            NOW,
+        )
+        read_back(s3)
+        baked_rows, _ = get_baked_manifest(s3, MANIFEST_COLNAMES)
+        changes = diff_ballots(baked_rows, [])
+
+        with patch.object(
+            create_current_elections_csv, "EXPORT_FORMAT", "parquet"
+        ):
+            upload_export(
+                s3,
+                "key",
+                [*colnames, "version"],
+                [[with_geography_text(row, {}) for row in changes]],
+            )
+
+        exported = polars.read_parquet(s3.upload_part.call_args.kwargs["Body"])
+        assert exported.rows() == [
+            ("ref.b.2026-05-07", None, None, "None", None, "old")
+        ]
+
+    def test_written_in_files_and_stale_files_deleted(self):
+        batches = [
+            [(f"local.{i}.2026-05-07", "POLYGON((0 0))")] for i in range(5)
+        ]
+        s3 = make_s3()
+        s3.get_paginator.return_value.paginate.return_value = [
+            {
+                "Contents": [
+                    {"Key": "key-00000.parquet"},
+                    {"Key": "key-00005.parquet"},
+                    {"Key": "key.csv"},
+                ]
+            }
+        ]
+        s3.delete_objects.return_value = {"Deleted": []}
+        with (
+            patch.object(
+                create_current_elections_csv, "EXPORT_FORMAT", "parquet"
+            ),
+            patch.object(create_current_elections_csv, "PARQUET_FILE_ROWS", 2),
+        ):
+            keys = upload_export(
+                s3, "key", ["election_id", "geography_text"], iter(batches)
+            )
+
+        assert keys == [
+            "key-00000.parquet",
+            "key-00001.parquet",
+            "key-00002.parquet",
+        ]
+        parts = [
+            polars.read_parquet(call.kwargs["Body"])["election_id"].to_list()
+            for call in s3.upload_part.call_args_list
+        ]
+        assert parts == [
+            ["local.0.2026-05-07", "local.1.2026-05-07"],
+            ["local.2.2026-05-07", "local.3.2026-05-07"],
+            ["local.4.2026-05-07"],
+        ]
+        s3.delete_objects.assert_called_once_with(
+            Bucket=create_current_elections_csv.s3_bucket,
+            Delete={
+                "Objects": [{"Key": "key-00005.parquet"}, {"Key": "key.csv"}]
+            },
+        )
+
+    def test_empty_export_writes_one_file(self):
+        s3 = make_s3()
+        with patch.object(
+            create_current_elections_csv, "EXPORT_FORMAT", "parquet"
+        ):
+            keys = upload_export(
+                s3, "key", ["election_id", "geography_text"], []
+            )
+
+        assert keys == ["key-00000.parquet"]
+        exported = polars.read_parquet(s3.upload_part.call_args.kwargs["Body"])
+        assert exported.columns == ["election_id", "geometry"]
+        assert exported.is_empty()
@@ -0,0 +1,113 @@
+"""
+Connecting to the EveryElection database, for the lambdas that export
+from it (create_current_elections_csv and
+create_current_boundary_reviews_csv).
+
+This is deployed as a Lambda layer. Module state lasts as long as the
+Lambda execution environment, so warm invocations reuse the credentials
+from SSM and the connection, rather than paying for the SSM calls, TLS and
+auth each time.
+
+psycopg comes from the function using the layer.
+"""
+
+import time
+
+import boto3
+import psycopg
+
+DATABASE_HOST_PARAMETER = "/EveryElectionProd/DATABASE_HOST"
+DATABASE_PASSWORD_PARAMETER = "/EveryElectionProd/DatabasePassword"
+DB_NAME = "every_election"
+DB_USER = "every_election"
+DB_PORT = "5432"
+
+# Credentials are fetched from SSM again after this many seconds, so a
+# changed host or password is picked up by warm environments.
+CREDENTIALS_TTL = 300
+
+ssm_client = boto3.client("ssm")
+
+_credentials = None
+_credentials_fetched_at = None
+_connection = None
+
+
+def get_credentials(refresh: bool = False) -> dict:
+    """
+    Returns: {"host", "password"} for the EE database, from SSM if they
+        weren't fetched in the last CREDENTIALS_TTL seconds or `refresh`
+    """
+    global _credentials, _credentials_fetched_at
+    now = time.monotonic()
+    if (
+        refresh
+        or _credentials is None
+        or now - _credentials_fetched_at > CREDENTIALS_TTL
+    ):
+        response = ssm_client.get_parameters(
+            Names=[DATABASE_HOST_PARAMETER, DATABASE_PASSWORD_PARAMETER]
+        )
+        if response["InvalidParameters"]:
+            raise ValueError(
+                f"Missing SSM parameters: {response['InvalidParameters']}"
+            )
+        values = {
+            parameter["Name"]: parameter["Value"]
+            for parameter in response["Parameters"]
+        }
+        _credentials = {
+            "host": values[DATABASE_HOST_PARAMETER],
+            "password": values[DATABASE_PASSWORD_PARAMETER],
+        }
+        _credentials_fetched_at = now
+    return _credentials
+
+
+def connect(credentials: dict) -> psycopg.Connection:
+    return psycopg.connect(
+        host=credentials["host"],
+        dbname=DB_NAME,
+        user=DB_USER,
+        password=credentials["password"],
+        port=DB_PORT,
+    )
+
+
+def is_healthy(conn: psycopg.Connection) -> bool:
+    if conn.closed:
+        return False
+    try:
+        # End anything an earlier invocation left open, for example if it
+        # failed part way through, and leave the connection idle so
+        # isolation level and so on can be set on it.
+        conn.rollback()
+        conn.execute("SELECT 1")
+        conn.rollback()
+    except psycopg.Error:
+        return False
+    return True
+
+
+def get_connection() -> psycopg.Connection:
+    """
+    Returns: a connection to the EE database. The one from an earlier
+        invocation is reused if it still works, otherwise a new one is
+        made. If connecting fails the credentials are fetched again, in
+        case they changed, and it's tried once more.
+
+    Callers should end their transaction with rollback() or commit()
+    rather than closing the connection.
+    """
+    global _connection
+    if _connection is not None and is_healthy(_connection):
+        return _connection
+    if _connection is not None:
+        print("Reconnecting to the EE database")
+        _connection.close()
+
+    try:
+        _connection = connect(get_credentials())
+    except psycopg.OperationalError:
+        _connection = connect(get_credentials(refresh=True))
+    return _connection
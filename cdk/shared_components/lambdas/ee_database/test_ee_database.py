@@ -0,0 +1,76 @@
+from unittest.mock import MagicMock, patch
+
+import psycopg
+import pytest
+
+with patch("boto3.client"):
+    import ee_database
+
+
+@pytest.fixture(autouse=True)
+def reset_state():
+    ee_database.ssm_client = MagicMock()
+    ee_database.ssm_client.get_parameters.return_value = {
+        "Parameters": [
+            {"Name": ee_database.DATABASE_HOST_PARAMETER, "Value": "db.host"},
+            {"Name": ee_database.DATABASE_PASSWORD_PARAMETER, "Value": "pw"},
+        ],
+        "InvalidParameters": [],
+    }
+    ee_database._credentials = None
+    ee_database._credentials_fetched_at = None
+    ee_database._connection = None
+
+
+class TestGetCredentials:
+    def test_cached_until_ttl(self):
+        with patch("time.monotonic", return_value=1000):
+            assert ee_database.get_credentials() == {
+                "host": "db.host",
+                "password": "pw",
+            }
+            ee_database.get_credentials()
+        ee_database.ssm_client.get_parameters.assert_called_once()
+
+        with patch(
+            "time.monotonic", return_value=1001 + ee_database.CREDENTIALS_TTL
+        ):
+            ee_database.get_credentials()
+        assert ee_database.ssm_client.get_parameters.call_count == 2
+
+    def test_missing_parameter(self):
+        ee_database.ssm_client.get_parameters.return_value = {
+            "Parameters": [],
+            "InvalidParameters": [ee_database.DATABASE_HOST_PARAMETER],
+        }
+        with pytest.raises(ValueError):
+            ee_database.get_credentials()
+
+
+class TestGetConnection:
+    def test_reuses_healthy_connection(self):
+        conn = MagicMock(closed=False)
+        with patch("psycopg.connect", return_value=conn) as connect:
+            assert ee_database.get_connection() is conn
+            assert ee_database.get_connection() is conn
+        connect.assert_called_once()
+        conn.execute.assert_called_once_with("SELECT 1")
+
+    def test_reconnects_when_health_check_fails(self):
+        broken = MagicMock(closed=False)
+        broken.execute.side_effect = psycopg.OperationalError
+        ee_database._connection = broken
+        new = MagicMock(closed=False)
+        with patch("psycopg.connect", return_value=new):
+            assert ee_database.get_connection() is new
+        broken.close.assert_called_once()
+
+    def test_refreshes_credentials_when_connecting_fails(self):
+        conn = MagicMock(closed=False)
+        with patch(
+            "psycopg.connect",
+            side_effect=[psycopg.OperationalError, conn],
+        ) as connect:
+            assert ee_database.get_connection() is conn
+        assert connect.call_count == 2
+        assert ee_database.ssm_client.get_parameters.call_count == 2
@@ -1,13 +1,36 @@
+import argparse
+import array
+import base64
+import contextlib
+import hashlib
+import importlib.util
+import io
+import json
 import logging
+import math
 import os
+import resource
 import shutil
+import string
+import threading
+import time
 import urllib.parse
+from concurrent.futures import (
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+)
 from pathlib import Path
+from typing import Iterator, NamedTuple
 
 import boto3
 import polars
 import sentry_sdk
-from polars import DataFrame
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from polars import DataFrame, Series
 from sentry_sdk.integrations.aws_lambda import AwsLambdaIntegration
 
 sentry_sdk.init(
@@ -27,7 +50,168 @@ class ConflictingDuplicateUPRNError(Exception):
 
 logger = logging.getLogger(__name__)
 
-s3_client = boto3.client("s3")
+MB = 1024 * 1024
+
+# Number of part files to download at once.
+DOWNLOAD_WORKERS = 8
+
+# Athena's UNLOAD parts are usually well under the multipart threshold, but
+# when one isn't, fetch it as ranged GETs in parallel too.
+download_transfer_config = TransferConfig(
+    multipart_threshold=64 * MB,
+    multipart_chunksize=16 * MB,
+    max_concurrency=4,
+)
+
+# S3 object metadata key holding `frame_content_hash` of an outcode file.
+CONTENT_HASH_METADATA_KEY = "content-hash"
+# Fixed seeds, so the same rows hash the same in every run.
+CONTENT_HASH_SEEDS = (0, 1, 2, 3)
+
+# DataFrame.write_parquet arguments a layer can set for its outcode files
+# with the parquet_options event key. Polars' writer already dictionary
+# encodes low cardinality string columns like addressbase_source and
+# postcode, and has no per column switch for it.
+PARQUET_WRITE_OPTIONS = {
+    "compression",
+    "compression_level",
+    "statistics",
+    "row_group_size",
+    "data_page_size",
+}
+
+# Number of outcode files to upload at once.
+UPLOAD_WORKERS = 16
+
+# Downloads and uploads share the client, so its connection pool needs to
+# be as big as the biggest pool of threads using it at once. botocore's
+# default of 10 would leave threads waiting for, and discarding,
+# connections.
+S3_MAX_POOL_CONNECTIONS = max(
+    UPLOAD_WORKERS, DOWNLOAD_WORKERS * download_transfer_config.max_concurrency
+)
+s3_client = boto3.client(
+    "s3", config=Config(max_pool_connections=S3_MAX_POOL_CONNECTIONS)
+)
+
+# CloudWatch namespace for the per stage metrics in `StageMetrics`.
+METRICS_NAMESPACE = "DataBaker/OutcodeParquet"
+
+# Values a stage can record, with their CloudWatch metric name and unit.
+STAGE_METRICS = {
+    "duration_ms": ("Duration", "Milliseconds"),
+    "peak_rss_mb": ("PeakRSS", "Megabytes"),
+    "bytes_read": ("BytesRead", "Bytes"),
+    "bytes_written": ("BytesWritten", "Bytes"),
+    "files": ("Files", "Count"),
+    "rows": ("Rows", "Count"),
+    "outcodes": ("Outcodes", "Count"),
+}
+
+
+class UploadPool:
+    """
+    Runs S3 uploads on a pool of threads while the caller carries on
+    encoding the next outcode.
+
+    `submit` blocks once `max_pending` uploads are queued or running, so a
+    slow S3 can't let encoded files pile up without limit. Leaving the
+    `with` block waits for every upload and re-raises the first failure.
+    """
+
+    def __init__(self, max_workers: int = UPLOAD_WORKERS, max_pending=None):
+        self.max_workers = max_workers
+        self._slots = threading.BoundedSemaphore(max_pending or max_workers * 2)
+        self._futures: list[Future] = []
+
+    def __enter__(self):
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._executor.shutdown(wait=True)
+        if exc_type is None:
+            for future in self._futures:
+                future.result()
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        self._futures.append(future)
+        return future
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux.
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+class StageMetrics:
+    """
+    Records how long each stage of baking a letter took, and what it did.
+
+    At the end of each stage a CloudWatch Embedded Metric Format line is
+    printed, which CloudWatch Logs turns into metrics with Layer and Stage
+    dimensions. The stages so far are also set as Sentry context, so an
+    error or timeout report shows how far the letter got.
+
+    Peak RSS is the high water mark of the whole process, so it only goes
+    up. The stage where it jumps is the one that needed the memory.
+    """
+
+    def __init__(self, layer: str, first_letter: str, shard_index: int = 0):
+        self.dimensions = {"Layer": layer, "Stage": None}
+        self.properties = {
+            "FirstLetter": first_letter,
+            "ShardIndex": shard_index,
+        }
+        self.stages: dict[str, dict] = {}
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """
+        Times the body of the `with` block as stage `name`. The block can
+        add counts from STAGE_METRICS to the dict it's given.
+        """
+        values = {}
+        start = time.perf_counter()
+        try:
+            yield values
+        finally:
+            values["duration_ms"] = round(
+                (time.perf_counter() - start) * 1000, 1
+            )
+            values["peak_rss_mb"] = peak_rss_mb()
+            self.stages[name] = values
+            sentry_sdk.set_context("outcode_stages", self.stages)
+        print(json.dumps(self.emf_record(name, values)))
+
+    def emf_record(self, name: str, values: dict) -> dict:
+        metrics = [
+            {"Name": STAGE_METRICS[key][0], "Unit": STAGE_METRICS[key][1]}
+            for key in values
+        ]
+        return {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": METRICS_NAMESPACE,
+                        "Dimensions": [list(self.dimensions)],
+                        "Metrics": metrics,
+                    }
+                ],
+            },
+            **self.dimensions,
+            "Stage": name,
+            **self.properties,
+            **{STAGE_METRICS[key][0]: value for key, value in values.items()},
+        }
 
 
 def check_duplicate_uprns(
@@ -40,15 +224,28 @@ def check_duplicate_uprns(
     If all duplicates are identical rows, deduplicate, report to Sentry and return deduplicated dataframe.
     If duplicates have conflicting data, raise ConflictingDuplicateUPRNError.
 
+    Memory: finding duplicates is one hash pass over the uprn column, and
+    only the duplicated rows are collected. Whether a UPRN's rows are
+    identical is decided by counting distinct row hashes within those
+    rows. So with no duplicates (the normal case) the frame is returned as
+    is and peak memory is the input plus a hash table of UPRNs. A
+    deduplicated copy of the frame is only made when every duplicate is
+    identical.
     """
-    duplicated_rows = first_letter_data.filter(
-        polars.col("uprn").is_duplicated()
+    duplicated_rows = (
+        first_letter_data.lazy()
+        .filter(polars.col("uprn").is_duplicated())
+        .collect()
     )
-    duplicated_uprn_count = duplicated_rows["uprn"].n_unique()
 
-    if duplicated_uprn_count == 0:
+    if duplicated_rows.is_empty():
         return first_letter_data
 
+    duplicate_groups = duplicated_rows.group_by("uprn").agg(
+        polars.struct(polars.all()).n_unique().alias("distinct_rows")
+    )
+    duplicated_uprn_count = len(duplicate_groups)
+
     logger.warning(
         f"check_duplicate_uprns: {first_letter=} {len(first_letter_data)=} {duplicated_uprn_count=}"
     )
@@ -58,9 +255,8 @@ def check_duplicate_uprns(
         msg = f"{duplicated_uprn_count} UPRN has duplicated rows for first_letter={first_letter}"
     else:
         msg = f"{duplicated_uprn_count} UPRNs have duplicate rows for first_letter={first_letter}"
-    unique_rows = first_letter_data.unique()
 
-    if unique_rows["uprn"].n_unique() == len(unique_rows):
+    if (duplicate_groups["distinct_rows"] == 1).all():
         # All duplicate rows are identical, safe to deduplicate
         msg += (
             " All duplicates are identical. Deduplicating and continuing."
@@ -77,7 +273,9 @@ def check_duplicate_uprns(
                 },
             )
             scope.capture_exception(IdenticalDuplicateUPRNError(msg))
-        return unique_rows
+        # Every row for a duplicated UPRN is the same, so it doesn't matter
+        # which one is kept.
+        return first_letter_data.unique(subset="uprn", keep="any")
 
     # Some duplicate UPRNs have conflicting data
     with sentry_sdk.new_scope() as scope:
@@ -119,45 +317,188 @@ def handler(event, context):
             },
         )
 
+    # A work unit from plan_outcode_work_units is a list of letters (or
+    # shards of a letter) to bake one after another, with the rest of the
+    # event shared between them.
+    if "work_unit" in event:
+        shared_event = {k: v for k, v in event.items() if k != "work_unit"}
+        return [
+            bake_first_letter({**shared_event, **work_item})
+            for work_item in event["work_unit"]
+        ]
+    return bake_first_letter(event)
+
+
+def bake_first_letter(event):
     # Get parameters from the event.
     first_letter = event["first_letter"]
-    source_bucket_name = event["source_bucket_name"]
-    source_path = event["source_path"]
+    # A local directory of first_letter=X directories of parquet parts can
+    # be given as source_dir instead of a source bucket and path.
+    source_dir = event.get("source_dir")
+    source_bucket_name = event.get("source_bucket_name")
+    source_path = event.get("source_path")
     dest_bucket_name = event["dest_bucket_name"]
     dest_path = event["dest_path"]
     filter_column = event["filter_column"]
+    # Big letters are split into shard_count shards, each baking one
+    # contiguous range of the letter's outcodes.
+    shard_index = event.get("shard_index", 0)
+    shard_count = event.get("shard_count", 1)
+    # Scan the parquet parts in place on S3 rather than downloading them
+    # to /tmp first. A shard only reads its range of outcodes when
+    # streaming, so sharded letters stream unless told otherwise.
+    stream_source = event.get("stream_source", shard_count > 1)
+    download_workers = event.get("download_workers", DOWNLOAD_WORKERS)
+    upload_workers = event.get("upload_workers", UPLOAD_WORKERS)
+    # Encode outcode files in memory and PUT them directly, rather than
+    # staging them in /tmp.
+    in_memory_output = event.get("in_memory_output", False)
+    content_md5 = event.get("content_md5", False)
+    # Don't re-upload outcode files whose data hasn't changed since the
+    # last run.
+    skip_unchanged = event.get("skip_unchanged", False)
+    parquet_options = get_parquet_write_options(event.get("parquet_options"))
+    # Where to write a postcode index for each outcode file. This has to be
+    # outside dest_path, which Athena reads as a parquet table.
+    index_path = event.get("index_path")
+    # List outcodes with no filter_column data in a manifest at
+    # <empty_outcodes_path>/<first_letter>.json, rather than writing an
+    # empty parquet file for each. Like index_path, this must be outside
+    # dest_path.
+    empty_outcodes_path = event.get("empty_outcodes_path")
+    # Read the letter a batch of whole outcodes at a time, with about this
+    # many rows in each batch, rather than all at once. See
+    # `iter_outcode_dfs_chunked`.
+    max_chunk_rows = event.get("max_chunk_rows")
+
+    metrics = StageMetrics(dest_path, first_letter, shard_index)
 
-    prefix = f"{source_path}first_letter={first_letter}"
+    if source_dir:
+        letter_source_dir = Path(source_dir) / f"first_letter={first_letter}"
+        if not any(letter_source_dir.glob("*")):
+            print(f"No files found in {letter_source_dir}")
+            return None
+    else:
+        prefix = f"{source_path}first_letter={first_letter}"
 
-    object_keys = get_all_object_keys(source_bucket_name, prefix)
-    # Check if there are any objects returned.
-    if not object_keys:
-        print(f"No objects found in s3://{source_bucket_name}/{prefix}")
-        return
+        with metrics.stage("list") as stage:
+            object_keys = get_all_object_keys(source_bucket_name, prefix)
+            stage["files"] = len(object_keys)
+        # Check if there are any objects returned.
+        if not object_keys:
+            print(f"No objects found in s3://{source_bucket_name}/{prefix}")
+            return None
 
     local_source_dir = None
     by_outcode_dir = None
 
     try:
-        local_source_dir = clean_and_make_dir(
-            f"/tmp/{filter_column}/{first_letter}"
-        )
-        by_outcode_dir = clean_and_make_dir(
-            f"/tmp/by_outcodes/{filter_column}/{first_letter}"
-        )
-        download_parquet(object_keys, local_source_dir, source_bucket_name)
+        if not in_memory_output:
+            by_outcode_dir = clean_and_make_dir(
+                f"/tmp/by_outcodes/{filter_column}/{first_letter}"
+            )
+        if source_dir:
+            source = letter_source_dir
+        elif stream_source:
+            source = get_s3_uris(source_bucket_name, object_keys)
+        else:
+            local_source_dir = clean_and_make_dir(
+                f"/tmp/{filter_column}/{first_letter}"
+            )
+            with metrics.stage("download") as stage:
+                stage["files"] = len(object_keys)
+                stage["bytes_read"] = download_parquet(
+                    object_keys,
+                    local_source_dir,
+                    source_bucket_name,
+                    max_workers=download_workers,
+                )
+            source = local_source_dir
+
+        if max_chunk_rows:
+            outcode_frames = iter_outcode_dfs_chunked(
+                first_letter,
+                source,
+                filter_column,
+                shard_index=shard_index,
+                shard_count=shard_count,
+                max_chunk_rows=max_chunk_rows,
+                metrics=metrics,
+            )
+        else:
+            outcode_frames = get_outcode_dfs(
+                first_letter,
+                source,
+                filter_column,
+                shard_index=shard_index,
+                shard_count=shard_count,
+                metrics=metrics,
+            )
 
-        outcode_dfs = get_outcode_dfs(first_letter, local_source_dir)
+        empty_outcodes = []
+        # Encoding and uploading overlap, so the upload stage includes the
+        # encode stage plus the wait for the last uploads to finish.
+        with (
+            metrics.stage("upload") as upload_stage,
+            UploadPool(max_workers=upload_workers) as upload_pool,
+            metrics.stage("encode") as encode_stage,
+        ):
+            uploads = []
+            encode_stage["bytes_written"] = 0
+            # Encode on this thread, upload on the pool.
+            for outcode_frame in outcode_frames:
+                if (
+                    empty_outcodes_path
+                    and outcode_frame.has_filter_column_data is False
+                ):
+                    empty_outcodes.append(outcode_frame.df["outcode"][0])
+                    continue
+                uploads.append(
+                    upload_outcode_parquet(
+                        by_outcode_dir,
+                        dest_bucket_name,
+                        dest_path,
+                        filter_column,
+                        outcode_frame.df,
+                        upload_pool=upload_pool,
+                        content_md5=content_md5,
+                        skip_unchanged=skip_unchanged,
+                        has_filter_column_data=outcode_frame.has_filter_column_data,
+                        parquet_options=parquet_options,
+                        index_path=index_path,
+                        stage_metrics=encode_stage,
+                    )
+                )
+            encode_stage["outcodes"] = len(uploads)
+            upload_stage["outcodes"] = len(uploads)
 
-        for outcode_df in outcode_dfs:
-            upload_outcode_parquet(
-                by_outcode_dir,
+        if empty_outcodes_path:
+            write_empty_outcodes_manifest(
                 dest_bucket_name,
                 dest_path,
-                filter_column,
-                outcode_df,
+                empty_outcodes_path,
+                first_letter,
+                empty_outcodes,
+                index_path=index_path,
+                shard_index=shard_index,
+                shard_count=shard_count,
             )
 
+        changed = sum(upload.result() for upload in uploads)
+        unchanged = len(uploads) - changed
+        print(
+            f"first_letter={first_letter}: {changed} outcode files uploaded,"
+            f" {unchanged} unchanged, {len(empty_outcodes)} empty"
+        )
+        return {
+            "first_letter": first_letter,
+            "shard_index": shard_index,
+            "shard_count": shard_count,
+            "changed_outcodes": changed,
+            "unchanged_outcodes": unchanged,
+            "empty_outcodes": len(empty_outcodes),
+        }
+
     finally:
         if local_source_dir:
             shutil.rmtree(local_source_dir)
@@ -166,6 +507,94 @@ def handler(event, context):
             shutil.rmtree(by_outcode_dir)
 
 
+def empty_outcodes_manifest_name(
+    first_letter: str, shard_index: int = 0, shard_count: int = 1
+) -> str:
+    if shard_count == 1:
+        return f"{first_letter}.json"
+    return f"{first_letter}-{shard_index}-of-{shard_count}.json"
+
+
+def write_empty_outcodes_manifest(
+    bucket_name: str,
+    dest_path: str,
+    empty_outcodes_path: str,
+    first_letter: str,
+    empty_outcodes: list[str],
+    index_path: str | None = None,
+    shard_index: int = 0,
+    shard_count: int = 1,
+):
+    """
+    Writes the list of outcodes in first_letter with no data to
+    s3://<bucket_name>/<empty_outcodes_path>/<first_letter>.json, then
+    deletes any <outcode>.parquet file (and postcode index) left for them
+    by an earlier run.
+
+    A sharded letter gets one manifest per shard, named
+    <first_letter>-<shard_index>-of-<shard_count>.json, so readers should
+    read every manifest starting with the letter. Manifests for the letter
+    left by a run that split it differently are deleted.
+
+    The manifest is written first. A reader that finds an outcode in it
+    doesn't open the outcode file, so a file that's not deleted yet is
+    never read.
+    """
+    manifest = {
+        "first_letter": first_letter,
+        "outcodes": sorted(empty_outcodes),
+    }
+    put_outcode_object(
+        json.dumps(manifest, separators=(",", ":")).encode(),
+        bucket_name,
+        f"{empty_outcodes_path}/{empty_outcodes_manifest_name(first_letter, shard_index, shard_count)}",
+    )
+
+    current_manifests = {
+        f"{empty_outcodes_path}/{empty_outcodes_manifest_name(first_letter, i, shard_count)}"
+        for i in range(shard_count)
+    }
+    stale_manifests = [
+        key
+        for key in get_all_object_keys(
+            bucket_name, f"{empty_outcodes_path}/{first_letter}"
+        )
+        if key not in current_manifests
+    ]
+
+    keys = stale_manifests + [
+        f"{dest_path}/{outcode}.parquet" for outcode in empty_outcodes
+    ]
+    if index_path:
+        keys += [f"{index_path}/{outcode}.json" for outcode in empty_outcodes]
+    # delete_objects takes at most 1000 keys
+    for i in range(0, len(keys), 1000):
+        batch = [{"Key": key} for key in keys[i : i + 1000]]
+        response = s3_client.delete_objects(
+            Bucket=bucket_name, Delete={"Objects": batch, "Quiet": True}
+        )
+        if response.get("Errors"):
+            raise Exception(
+                f"Failed to delete some empty outcode files: {response['Errors']}"
+            )
+
+
+def get_parquet_write_options(parquet_options: dict | None) -> dict:
+    """
+    Checks the parquet_options from the event only contains arguments in
+    PARQUET_WRITE_OPTIONS, so a typo in a stack fails the run rather than
+    being silently ignored.
+    """
+    parquet_options = parquet_options or {}
+    unknown_options = set(parquet_options) - PARQUET_WRITE_OPTIONS
+    if unknown_options:
+        raise ValueError(
+            f"Unknown parquet_options: {sorted(unknown_options)}."
+            f" Expected some of {sorted(PARQUET_WRITE_OPTIONS)}"
+        )
+    return parquet_options
+
+
 def get_all_object_keys(bucket_name: str, prefix: str) -> list[str]:
     """
     Args:
@@ -182,6 +611,10 @@ def get_all_object_keys(bucket_name: str, prefix: str) -> list[str]:
     return object_keys
 
 
+def get_s3_uris(bucket_name: str, object_keys: list[str]) -> list[str]:
+    return [f"s3://{bucket_name}/{key}" for key in object_keys]
+
+
 def clean_and_make_dir(path: str) -> Path:
     dir_path = Path(path)
     if dir_path.exists():
@@ -191,105 +624,881 @@ def clean_and_make_dir(path: str) -> Path:
     return dir_path
 
 
-def get_outcode_dfs(first_letter, local_source_dir: Path) -> list[DataFrame]:
+def read_first_letter_data(source: Path | list[str]) -> DataFrame:
+    """
+    Reads all the parquet files for a first letter into one dataframe.
+
+    Args:
+        source: Either a local directory the parquet files have been
+            downloaded to, or a list of s3:// URIs. S3 URIs are scanned in
+            place: Polars reads each file's footer and then fetches the
+            column chunks it needs with ranged GETs, so nothing is written
+            to local disk.
+
+    Returns: dataframe with all the data for the first letter
+    """
+    if isinstance(source, Path):
+        return polars.read_parquet(f"{source}/*")
+
+    return scan_first_letter_data(source).collect()
+
+
+def scan_first_letter_data(source: Path | list[str]) -> polars.LazyFrame:
+    """
+    Lazily scans all the parquet files for a first letter. See
+    `read_first_letter_data` for `source`.
+    """
+    if isinstance(source, Path):
+        source = f"{source}/*"
+    # The keys sit under a `first_letter=X` prefix. Don't let Polars turn
+    # that into a column, so both modes produce the same schema.
+    return polars.scan_parquet(source, hive_partitioning=False)
+
+
+class OutcodeFrame(NamedTuple):
+    # All the rows for one outcode, sorted by postcode, uprn.
+    df: DataFrame
+    # Whether any row has a non-null value in filter_column. None if no
+    # filter_column was given.
+    has_filter_column_data: bool | None
+
+
+def sort_by_outcode(first_letter_data: polars.LazyFrame) -> polars.LazyFrame:
+    """
+    Adds an outcode column, and sorts by outcode, postcode, uprn.
+    """
+    return first_letter_data.with_columns(
+        polars.col("postcode").str.split(" ").list.first().alias("outcode")
+    ).sort(by=["outcode", "postcode", "uprn"])
+
+
+def split_sorted_outcodes(
+    sorted_data: DataFrame, filter_column: str | None = None
+) -> Iterator[OutcodeFrame]:
+    """
+    Yields a zero-copy slice of `sorted_data` for each outcode in it, in
+    order. `sorted_data` must be sorted with `sort_by_outcode`.
+    """
+    aggs = [polars.len().alias("rows")]
+    if filter_column:
+        aggs.append(
+            has_non_null_expr(filter_column)
+            .any()
+            .alias("has_filter_column_data")
+        )
+    outcodes = sorted_data.group_by("outcode", maintain_order=True).agg(aggs)
+
+    offset = 0
+    for outcode in outcodes.iter_rows(named=True):
+        yield OutcodeFrame(
+            df=sorted_data.slice(offset, outcode["rows"]),
+            has_filter_column_data=outcode.get("has_filter_column_data"),
+        )
+        offset += outcode["rows"]
+
+
+def in_shard(offset: int, total_rows: int, shard_index: int, shard_count: int):
+    """
+    Whether the outcode starting at row `offset` of a letter sorted by
+    outcode is in shard `shard_index`. The shard an outcode is in depends
+    on where its first row falls in the letter, which keeps each shard a
+    contiguous range with about the same number of rows.
+    """
+    return offset * shard_count // total_rows == shard_index
+
+
+def has_non_null_expr(filter_column: str) -> polars.Expr:
+    """
+    True for each row with at least one non-null value in the list column
+    `filter_column`.
+    """
+    return (
+        polars.col(filter_column)
+        .list.eval(polars.element().is_not_null())
+        .list.sum()
+        > 0
+    )
+
+
+def outcode_range_expr(first_outcode: str, last_outcode: str) -> polars.Expr:
+    """
+    True for each row whose postcode is in an outcode from `first_outcode`
+    to `last_outcode`, in the order `sort_by_outcode` gives.
+
+    This compares the postcode column itself rather than the outcode taken
+    from it, so Polars can skip row groups using the parquet statistics
+    and only read the rows in the range. A space sorts before every other
+    character in a postcode, so postcodes sort in the same order as their
+    outcodes, and the postcodes of `last_outcode` all sort before
+    `last_outcode` followed by "!".
+    """
+    return (polars.col("postcode") >= first_outcode) & (
+        polars.col("postcode") < f"{last_outcode}!"
+    )
+
+
+def find_duplicated_uprns(
+    letter_data: polars.LazyFrame, first_letter: str
+) -> tuple[Series, DataFrame]:
+    """
+    Finds UPRNs that are in more than one row of the letter, reading only
+    the uprn column, then reads the rows for just those UPRNs and checks
+    them with `check_duplicate_uprns`. This checks the whole letter for
+    duplicates without holding the whole letter in memory.
+
+    Returns: the duplicated UPRNs, and a row for each of them
+    """
+    duplicated_uprns = (
+        letter_data.select(
+            polars.col("uprn")
+            .filter(polars.col("uprn").is_duplicated())
+            .unique()
+        )
+        .collect()
+        .get_column("uprn")
+    )
+    deduplicated_rows = check_duplicate_uprns(
+        letter_data.filter(
+            polars.col("uprn").is_in(duplicated_uprns)
+        ).collect(),
+        first_letter,
+    )
+    return duplicated_uprns, deduplicated_rows
+
+
+def get_shard_outcode_rows(
+    letter_data: polars.LazyFrame, shard_index: int, shard_count: int
+) -> DataFrame:
+    """
+    Counts the rows in each outcode of the letter, reading only the
+    postcode column, and keeps the outcodes in shard `shard_index`.
+
+    Rows for duplicated UPRNs are counted, so every shard works out the
+    same ranges however it goes on to read them.
+
+    Returns: outcode, rows for each outcode in the shard, in outcode order
+    """
+    outcode_rows = (
+        letter_data.select(
+            polars.col("postcode").str.split(" ").list.first().alias("outcode")
+        )
+        .group_by("outcode")
+        .agg(polars.len().alias("rows"))
+        .sort("outcode")
+        .collect()
+    )
+    total_rows = outcode_rows["rows"].sum()
+    offsets = outcode_rows["rows"].cum_sum() - outcode_rows["rows"]
+    return outcode_rows.filter(
+        [
+            in_shard(offset, total_rows, shard_index, shard_count)
+            for offset in offsets
+        ]
+    )
+
+
+def scan_outcode_range(
+    letter_data: polars.LazyFrame,
+    duplicated_uprns: Series,
+    deduplicated_rows: DataFrame,
+    first_outcode: str,
+    last_outcode: str,
+) -> polars.LazyFrame:
+    """
+    Scans the rows of the letter in a range of outcodes, with the rows for
+    duplicated UPRNs swapped for the ones `find_duplicated_uprns` kept.
+    """
+    in_range = outcode_range_expr(first_outcode, last_outcode)
+    return polars.concat(
+        [
+            letter_data.filter(
+                in_range & ~polars.col("uprn").is_in(duplicated_uprns)
+            ),
+            deduplicated_rows.lazy().filter(in_range),
+        ]
+    )
+
+
+def get_outcode_dfs(
+    first_letter,
+    source: Path | list[str],
+    filter_column: str | None = None,
+    shard_index: int = 0,
+    shard_count: int = 1,
+    metrics: StageMetrics | None = None,
+) -> list[OutcodeFrame]:
     """
     Reads all the parquet files for postcodes starting with 'first_letter' into
     a dataframe. Then adds an 'outcode' column, and then partitions the dataframe
     into a dataframe per outcode.
     These 'outcode dataframes' are returned as a list.
 
+    The whole letter is sorted once by outcode, postcode, uprn, and a single
+    group_by works out the row count and filter_column flag for every
+    outcode. Each outcode dataframe is then a zero-copy slice of the sorted
+    frame, so there's no per-outcode query to run afterwards.
+
+    When a letter is sharded, the outcodes are split into shard_count
+    contiguous ranges with about the same number of rows in each, and only
+    the shard_index'th range is read. Each shard reads the uprn and
+    postcode columns of the whole letter to find its range and duplicated
+    UPRNs, as `iter_outcode_dfs_chunked` does, so a UPRN duplicated across
+    two ranges is still found.
+
     Args:
         first_letter: The first letter of the postcode.
-        local_source_dir: Where the parquet files are stored locally
+        source: Where the parquet files are. See `read_first_letter_data`.
+        filter_column: List column to flag outcodes with data in.
+        shard_index: Which shard of the letter to return.
+        shard_count: How many shards the letter is split into.
+        metrics: Records the read, dedupe and partition stages, if given.
 
-    Returns: list of outcode dataframes
+    Returns: list of outcode dataframes, in outcode order
 
     """
-    first_letter_data = polars.read_parquet(f"{local_source_dir}/*")
+    timed_stage = (
+        metrics.stage if metrics else lambda name: contextlib.nullcontext({})
+    )
 
-    first_letter_data = check_duplicate_uprns(first_letter_data, first_letter)
+    if shard_count > 1:
+        letter_data = scan_first_letter_data(source)
+        with timed_stage("dedupe") as stage:
+            duplicated_uprns, deduplicated_rows = find_duplicated_uprns(
+                letter_data, first_letter
+            )
+            stage["rows"] = len(deduplicated_rows)
 
-    first_letter_data = first_letter_data.with_columns(
-        polars.col("postcode").str.split(" ").list.first().alias("outcode")
+        with timed_stage("read") as stage:
+            shard_outcodes = get_shard_outcode_rows(
+                letter_data, shard_index, shard_count
+            )["outcode"]
+            if shard_outcodes.is_empty():
+                return []
+            first_letter_data = scan_outcode_range(
+                letter_data,
+                duplicated_uprns,
+                deduplicated_rows,
+                shard_outcodes.first(),
+                shard_outcodes.last(),
+            ).collect()
+            stage["rows"] = len(first_letter_data)
+    else:
+        with timed_stage("read") as stage:
+            first_letter_data = read_first_letter_data(source)
+            stage["rows"] = len(first_letter_data)
+            if isinstance(source, Path):
+                stage["bytes_read"] = sum(
+                    path.stat().st_size for path in source.iterdir()
+                )
+
+        with timed_stage("dedupe") as stage:
+            first_letter_data = check_duplicate_uprns(
+                first_letter_data, first_letter
+            )
+            stage["rows"] = len(first_letter_data)
+
+    with timed_stage("partition") as stage:
+        first_letter_data = sort_by_outcode(first_letter_data.lazy()).collect()
+        outcode_frames = list(
+            split_sorted_outcodes(first_letter_data, filter_column)
+        )
+        stage["rows"] = len(first_letter_data)
+        stage["outcodes"] = len(outcode_frames)
+    return outcode_frames
+
+
+def iter_outcode_dfs_chunked(
+    first_letter,
+    source: Path | list[str],
+    filter_column: str | None = None,
+    shard_index: int = 0,
+    shard_count: int = 1,
+    max_chunk_rows: int = 500_000,
+    metrics: StageMetrics | None = None,
+) -> Iterator[OutcodeFrame]:
+    """
+    Like `get_outcode_dfs`, but only holds a batch of outcodes in memory
+    at a time rather than the whole letter.
+
+    First the uprn and postcode columns of the whole letter are read, to
+    find duplicated UPRNs and count the rows in each outcode. The outcodes
+    are then grouped into batches of about `max_chunk_rows` rows, and each
+    batch is read, sorted and split in turn. A batch is always at least
+    one whole outcode, so peak memory is set by max_chunk_rows or the
+    biggest outcode, plus the two columns.
+
+    Duplicates are checked across the whole letter, as in
+    `check_duplicate_uprns`. Rows for duplicated UPRNs are read up front,
+    deduplicated once, and added to the batch with their outcode, so two
+    copies of a UPRN in different batches (or different parquet parts)
+    are still caught.
+
+    Each batch is a new scan of the parquet parts, so this trades reading
+    the source several times for memory. It's for letters too big to read
+    at once.
+    """
+    timed_stage = (
+        metrics.stage if metrics else lambda name: contextlib.nullcontext({})
     )
+    letter_data = scan_first_letter_data(source)
+
+    with timed_stage("dedupe") as stage:
+        duplicated_uprns, deduplicated_rows = find_duplicated_uprns(
+            letter_data, first_letter
+        )
+        stage["rows"] = len(deduplicated_rows)
 
-    return first_letter_data.partition_by("outcode")
+    with timed_stage("partition") as stage:
+        shard_outcode_rows = get_shard_outcode_rows(
+            letter_data, shard_index, shard_count
+        )
+        batches = []
+        batch_rows = max_chunk_rows
+        for outcode in shard_outcode_rows.iter_rows(named=True):
+            if batch_rows + outcode["rows"] > max_chunk_rows:
+                batches.append([])
+                batch_rows = 0
+            batches[-1].append(outcode["outcode"])
+            batch_rows += outcode["rows"]
+        stage["rows"] = shard_outcode_rows["rows"].sum()
+        stage["outcodes"] = len(shard_outcode_rows)
+
+    for batch in batches:
+        batch_data = scan_outcode_range(
+            letter_data,
+            duplicated_uprns,
+            deduplicated_rows,
+            batch[0],
+            batch[-1],
+        )
+        yield from split_sorted_outcodes(
+            sort_by_outcode(batch_data).collect(), filter_column
+        )
 
 
 def upload_outcode_parquet(
-    by_outcode_dir: Path,
+    by_outcode_dir: Path | None,
     dest_bucket_name: str,
     dest_path: str,
     filter_column: str,
     outcode_df: DataFrame,
-):
+    upload_pool: UploadPool | None = None,
+    content_md5: bool = False,
+    skip_unchanged: bool = False,
+    has_filter_column_data: bool | None = None,
+    parquet_options: dict | None = None,
+    index_path: str | None = None,
+    stage_metrics: dict | None = None,
+) -> Future | bool:
     """
     Checks outcode dataframe for any null values in filter_column,
     and either writes outcode file with data, or an empty file if
     all values are null. Then uploads the file to s3.
 
     Args:
-        by_outcode_dir: Local directory for writing <outcode>.parquet files
+        by_outcode_dir: Local directory for writing <outcode>.parquet files.
+            If None the file is encoded into an in-memory buffer and sent
+            with put_object, so nothing is written to local disk.
         dest_bucket_name: Bucket to upload <outcode>.parquet files to
         dest_path: s3 prefix after bucket before file: s3://<dest_bucket_name>/<dest_path>/<outcode>.parquet
         filter_column: column to check if it has non null values. Included here for print logs
         outcode_df: dataframe with all outcode data.
+        upload_pool: If given, the upload is queued on the pool and this
+            returns as soon as the file is written. Otherwise the upload
+            happens before returning.
+        content_md5: Send a Content-MD5 header with in-memory uploads so
+            S3 rejects a body that was corrupted in transit.
+        skip_unchanged: Don't upload the file if the object already on S3
+            was written from identical data. See `upload_outcode`.
+        has_filter_column_data: If given, the caller has already worked out
+            whether any row has filter_column data and sorted outcode_df
+            by postcode, uprn, as `get_outcode_dfs` does. Otherwise both
+            are done here.
+        parquet_options: Keyword arguments for DataFrame.write_parquet.
+            See PARQUET_WRITE_OPTIONS.
+        index_path: If given, also upload a postcode index for the file to
+            s3://<dest_bucket_name>/<index_path>/<outcode>.json. See
+            `make_postcode_index`.
+        stage_metrics: If given, the size of the encoded file is added to
+            its bytes_written. See `StageMetrics.stage`.
+
+    Returns: Whether the file was uploaded, or a Future of that if
+        `upload_pool` was given.
     """
     outcode = outcode_df["outcode"][0]
     print(outcode)
 
-    expr_has_non_null_filter_column = (
-        polars.col(filter_column)
-        .list.eval(polars.element().is_not_null())
-        .list.sum()
-        .alias(f"has_non_null_{filter_column}")
-    )
-
-    has_any_non_null_filter_column_df = outcode_df.select(
-        (expr_has_non_null_filter_column > 0)
-        .any()
-        .alias(f"any_row_has_{filter_column}")
-    )
-    has_any_non_null_filter_column = has_any_non_null_filter_column_df[
-        f"any_row_has_{filter_column}"
-    ][0]  # Boolean True/False
+    if has_filter_column_data is None:
+        has_filter_column_data = outcode_df.select(
+            has_non_null_expr(filter_column).any()
+        ).item()  # Boolean True/False
+        outcode_df = outcode_df.sort(by=["postcode", "uprn"])
 
-    outcode_path = by_outcode_dir / f"{outcode}.parquet"
-
-    if has_any_non_null_filter_column:
+    if has_filter_column_data:
         print(
             f"At least one UPRN in {outcode} has data in {filter_column}, writing a file with data"
         )
-        outcode_df.sort(by=["postcode", "uprn"]).write_parquet(outcode_path)
+        output_df = outcode_df
     else:
         print(
             f"No {filter_column} for any address in {outcode}, writing an empty file"
         )
-        polars.DataFrame().write_parquet(outcode_path)
-    s3_client.upload_file(
-        outcode_path, dest_bucket_name, f"{dest_path}/{outcode}.parquet"
+        output_df = polars.DataFrame()
+
+    parquet_options = parquet_options or {}
+    if by_outcode_dir is None:
+        buffer = io.BytesIO()
+        output_df.write_parquet(buffer, **parquet_options)
+        outcode_target = buffer.getvalue()
+    else:
+        outcode_target = by_outcode_dir / f"{outcode}.parquet"
+        output_df.write_parquet(outcode_target, **parquet_options)
+    if stage_metrics is not None:
+        stage_metrics["bytes_written"] += (
+            len(outcode_target)
+            if isinstance(outcode_target, bytes)
+            else outcode_target.stat().st_size
+        )
+
+    upload_args = (
+        outcode_target,
+        dest_bucket_name,
+        f"{dest_path}/{outcode}.parquet",
+    )
+    upload_kwargs = {
+        "content_hash": frame_content_hash(
+            output_df, parquet_options, index_path
+        )
+        if skip_unchanged
+        else None,
+        "content_md5": content_md5,
+    }
+    if index_path:
+        postcode_index = make_postcode_index(output_df)
+        upload_kwargs["sidecars"] = {
+            f"{index_path}/{outcode}.json": json.dumps(
+                postcode_index, separators=(",", ":")
+            ).encode()
+        }
+    if upload_pool:
+        return upload_pool.submit(upload_outcode, *upload_args, **upload_kwargs)
+    return upload_outcode(*upload_args, **upload_kwargs)
+
+
+def make_postcode_index(output_df: DataFrame) -> dict:
+    """
+    Maps each postcode in a sorted outcode dataframe to the rows it's in.
+
+    Each postcode maps to `[offset, length]`, so a reader can fetch just
+    those rows with `polars.scan_parquet(uri).slice(offset, length)`.
+    Polars then uses the row group metadata in the file's footer to make
+    ranged GETs for only the row groups that hold them.
+
+    Returns: {"rows": <total rows>, "postcodes": {<postcode>: [offset, length]}}
+    """
+    if output_df.is_empty():
+        return {"rows": 0, "postcodes": {}}
+
+    postcode_counts = output_df.group_by("postcode", maintain_order=True).len()
+    postcodes = {}
+    offset = 0
+    for postcode, length in postcode_counts.iter_rows():
+        postcodes[postcode] = [offset, length]
+        offset += length
+    return {"rows": offset, "postcodes": postcodes}
+
+
+def row_hash_expr(name: str, dtype: polars.DataType) -> polars.Expr:
+    """
+    Hashes each value of a column. Polars can't hash lists of strings, so
+    the elements of a list are hashed first, giving a list of integers.
+    """
+    if isinstance(dtype, polars.List):
+        return (
+            polars.col(name)
+            .list.eval(polars.element().hash(*CONTENT_HASH_SEEDS))
+            .hash(*CONTENT_HASH_SEEDS)
+        )
+    return polars.col(name).hash(*CONTENT_HASH_SEEDS)
+
+
+def frame_content_hash(
+    df: DataFrame,
+    parquet_options: dict | None = None,
+    index_path: str | None = None,
+) -> str:
+    """
+    A hash of the schema and every row of `df`, in order, and of the
+    options the file is written with.
+
+    Only the values are hashed, not how Polars holds them, so a slice of a
+    bigger frame hashes the same as an equal frame read on its own.
+
+    The postcode index is only uploaded along with its outcode file, so
+    `index_path` is part of the hash too. Turning the index on or moving
+    it means every outcode is written again, along with its index.
+
+    Polars doesn't promise its hashes are stable between versions, so the
+    version is part of the hash. Upgrading Polars or changing a layer's
+    parquet_options means every outcode is written once more, rather than
+    a changed file being skipped.
+    """
+    content_hash = hashlib.sha256(polars.__version__.encode())
+    content_hash.update(repr(sorted((parquet_options or {}).items())).encode())
+    content_hash.update(repr(index_path).encode())
+    content_hash.update(repr(list(df.schema.items())).encode())
+    if df.width:
+        row_hashes = df.select(
+            row_hash_expr(name, dtype) for name, dtype in df.schema.items()
+        ).hash_rows(*CONTENT_HASH_SEEDS)
+        content_hash.update(array.array("Q", row_hashes.to_list()).tobytes())
+    return content_hash.hexdigest()
+
+
+def get_content_hash(bucket_name: str, key: str) -> str | None:
+    """
+    Returns the content hash stored on an existing outcode file, or None if
+    the file doesn't exist or was written without one.
+    """
+    try:
+        response = s3_client.head_object(Bucket=bucket_name, Key=key)
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+            return None
+        raise
+    return response.get("Metadata", {}).get(CONTENT_HASH_METADATA_KEY)
+
+
+def upload_outcode(
+    outcode_target: Path | bytes,
+    bucket_name: str,
+    key: str,
+    content_hash: str | None = None,
+    content_md5: bool = False,
+    sidecars: dict[str, bytes] | None = None,
+) -> bool:
+    """
+    Uploads an outcode file from disk or from memory.
+
+    If `content_hash` is given and matches the hash stored on the object
+    already at `key`, the upload is skipped. Otherwise the hash is stored
+    as object metadata for the next run to compare against.
+
+    `sidecars` maps keys to the bodies of small files that belong with the
+    outcode file, like its postcode index. They're skipped along with it,
+    and uploaded before it so that a failure part way through can't leave
+    a new outcode file next to a stale index.
+
+    Returns: True if the file was uploaded, False if it was unchanged.
+    """
+    metadata = {}
+    if content_hash:
+        if get_content_hash(bucket_name, key) == content_hash:
+            print(f"s3://{bucket_name}/{key} is unchanged, not uploading")
+            return False
+        metadata[CONTENT_HASH_METADATA_KEY] = content_hash
+
+    for sidecar_key, sidecar_body in (sidecars or {}).items():
+        put_outcode_object(sidecar_body, bucket_name, sidecar_key, content_md5)
+
+    if isinstance(outcode_target, bytes):
+        put_outcode_object(
+            outcode_target, bucket_name, key, content_md5, metadata
+        )
+    elif metadata:
+        s3_client.upload_file(
+            outcode_target,
+            bucket_name,
+            key,
+            ExtraArgs={"Metadata": metadata},
+        )
+    else:
+        s3_client.upload_file(outcode_target, bucket_name, key)
+    return True
+
+
+def put_outcode_object(
+    body: bytes,
+    bucket_name: str,
+    key: str,
+    content_md5: bool = False,
+    metadata: dict[str, str] | None = None,
+):
+    put_kwargs = {"Bucket": bucket_name, "Key": key, "Body": body}
+    if content_md5:
+        put_kwargs["ContentMD5"] = base64.b64encode(
+            hashlib.md5(body).digest()
+        ).decode()
+    if metadata:
+        put_kwargs["Metadata"] = metadata
+    s3_client.put_object(**put_kwargs)
+
+
+class DownloadProgress:
+    """
+    boto3 transfer callback that counts the bytes downloaded for one key.
+
+    With multipart downloads the callback is called from several threads,
+    so updates are done under a lock.
+    """
+
+    def __init__(self):
+        self.bytes_transferred = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, bytes_amount: int):
+        with self._lock:
+            self.bytes_transferred += bytes_amount
+
+
+def download_object(key: str, local_source_dir: Path, source_bucket_name: str):
+    # Use the basename of the key as the local filename.
+    local_file = local_source_dir / os.path.basename(key)
+
+    print(f"Downloading s3://{source_bucket_name}/{key} to {local_file}")
+    progress = DownloadProgress()
+    start = time.perf_counter()
+    s3_client.download_file(
+        source_bucket_name,
+        key,
+        local_file,
+        Config=download_transfer_config,
+        Callback=progress,
+    )
+    elapsed = time.perf_counter() - start
+    megabytes = progress.bytes_transferred / MB
+    print(
+        f"Downloaded {key}: {megabytes:.1f} MB in {elapsed:.2f}s"
+        f" ({megabytes / max(elapsed, 1e-6):.1f} MB/s)"
     )
+    return progress.bytes_transferred
 
 
 def download_parquet(
-    object_keys: list[str], local_source_dir: Path, source_bucket_name: str
+    object_keys: list[str],
+    local_source_dir: Path,
+    source_bucket_name: str,
+    max_workers: int = DOWNLOAD_WORKERS,
 ):
-    for key in object_keys:
-        # Use the basename of the key as the local filename.
-        local_file = local_source_dir / os.path.basename(key)
+    """
+    Downloads the parquet parts to local_source_dir using a pool of
+    threads, so one slow GET doesn't hold up the rest.
+
+    Args:
+        object_keys: Keys of the parquet parts to download
+        local_source_dir: Directory to download the parts to
+        source_bucket_name: Bucket the parts are in
+        max_workers: Number of parts to download at the same time
 
-        print(f"Downloading s3://{source_bucket_name}/{key} to {local_file}")
-        s3_client.download_file(source_bucket_name, key, local_file)
+    Returns: The number of bytes downloaded
+    """
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(
+                download_object, key, local_source_dir, source_bucket_name
+            )
+            for key in object_keys
+        ]
+        # Re-raises the first failed download, if any.
+        total_bytes = sum(future.result() for future in futures)
+    elapsed = time.perf_counter() - start
+    megabytes = total_bytes / MB
+    print(
+        f"Downloaded {len(object_keys)} files: {megabytes:.1f} MB in"
+        f" {elapsed:.2f}s ({megabytes / max(elapsed, 1e-6):.1f} MB/s)"
+    )
+    return total_bytes
 
 
-if __name__ == "__main__":
-    event = {
-        "first_letter": "A",
-        "source_bucket_name": "pollingstations.private.data",
-        "source_path": "addressbase/development/current_ballots_joined_to_address_base/",
-        "dest_bucket_name": "dc-data-baker-results-bucket",
-        "dest_path": "current_election_parquet",
-        "filter_column": "ballot_ids",
+def run_work_unit(event) -> tuple[str, float, list]:
+    """
+    Bakes one work unit for `main`, through `handler` as the Map state
+    does. Runs in a worker process.
+
+    Returns: the letters (and shards) in the work unit, how long it took in
+        seconds, and the result from `handler`
+    """
+    name = ",".join(
+        work_item["first_letter"]
+        if work_item["shard_count"] == 1
+        else f"{work_item['first_letter']}{work_item['shard_index'] + 1}"
+        f"/{work_item['shard_count']}"
+        for work_item in event["work_unit"]
+    )
+    start = time.perf_counter()
+    result = handler(event, None)
+    return name, time.perf_counter() - start, result
+
+
+def load_shared_module(path: Path):
+    """
+    Imports a module from outside this lambda's directory, which isn't
+    bundled with the lambda, for `main`.
+    """
+    spec = importlib.util.spec_from_file_location(path.stem, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+SHARED_COMPONENTS_DIR = Path(__file__).resolve().parents[2]
+
+
+def get_local_first_letter_sizes(source_dir: str) -> dict:
+    """
+    Returns: the total size in bytes of the files in each first_letter=X
+        directory of source_dir
+    """
+    return {
+        letter_dir.name.removeprefix("first_letter="): sum(
+            path.stat().st_size for path in letter_dir.glob("*")
+        )
+        for letter_dir in Path(source_dir).glob("first_letter=*")
+    }
+
+
+def plan_local_work_units(args) -> list[list[dict]]:
+    """
+    Plans work units for `main`. With --work-units, the letters are packed
+    and sharded by plan_outcode_work_units, as in the stacks. Otherwise
+    each letter is a work unit of its own.
+    """
+    letters = list(args.letters.upper())
+    if not args.work_units:
+        return [
+            [{"first_letter": letter, "shard_index": 0, "shard_count": 1}]
+            for letter in letters
+        ]
+
+    planner = load_shared_module(
+        SHARED_COMPONENTS_DIR
+        / "lambdas/plan_outcode_work_units/plan_outcode_work_units.py"
+    )
+    if args.source_dir:
+        letter_sizes = get_local_first_letter_sizes(args.source_dir)
+    else:
+        letter_sizes = planner.get_first_letter_sizes(
+            args.source_bucket_name, args.source_path
+        )
+    letter_sizes = {
+        letter: size
+        for letter, size in letter_sizes.items()
+        if letter in letters
+    }
+    target_unit_bytes = max(
+        math.ceil(sum(letter_sizes.values()) / args.work_units), 1
+    )
+    return planner.plan_work_units(letter_sizes, target_unit_bytes)
+
+
+def main(argv=None):
+    """
+    Bakes a layer's outcode files on this machine, one work unit per process.
+
+    This is for rebuilding a layer without Step Functions, e.g. on a big
+    box during an outage, and for profiling the same code the Lambda runs.
+    Each work unit is baked by `handler`, with the event the stacks' Map
+    state sends.
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__.split("\n\n")[0])
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument(
+        "--source-bucket-name", default="pollingstations.private.data"
+    )
+    source.add_argument(
+        "--source-dir",
+        help="Local directory of first_letter=X directories of parquet parts",
+    )
+    parser.add_argument(
+        "--source-path",
+        default="addressbase/development/current_ballots_joined_to_address_base/",
+    )
+    parser.add_argument(
+        "--dest-bucket-name", default="dc-data-baker-results-bucket"
+    )
+    parser.add_argument("--dest-path", default="current_election_parquet")
+    parser.add_argument("--filter-column", default="ballot_ids")
+    parser.add_argument(
+        "--letters",
+        default=string.ascii_uppercase,
+        help="Letters to bake, e.g. ABS. Defaults to A-Z",
+    )
+    parser.add_argument(
+        "--work-units",
+        type=int,
+        help="Pack and shard the letters into about this many work units,"
+        " as the stacks do. Defaults to one work unit per letter",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of work units to bake at once",
+    )
+    parser.add_argument(
+        "--stream-source",
+        action="store_true",
+        help="Stream the source from S3. Sharded letters always do",
+    )
+    parser.add_argument("--in-memory-output", action="store_true")
+    parser.add_argument("--skip-unchanged", action="store_true")
+    parser.add_argument(
+        "--parquet-options",
+        type=json.loads,
+        default=load_shared_module(
+            SHARED_COMPONENTS_DIR / "outcode_parquet_options.py"
+        ).OUTCODE_PARQUET_OPTIONS,
+        help="JSON parquet_options. Defaults to the stacks'"
+        " OUTCODE_PARQUET_OPTIONS",
+    )
+    parser.add_argument("--index-path")
+    parser.add_argument("--empty-outcodes-path")
+    args = parser.parse_args(argv)
+
+    shared_event = {
+        "dest_bucket_name": args.dest_bucket_name,
+        "dest_path": args.dest_path,
+        "filter_column": args.filter_column,
+        "in_memory_output": args.in_memory_output,
+        "skip_unchanged": args.skip_unchanged,
+        "parquet_options": args.parquet_options,
+        "index_path": args.index_path,
+        "empty_outcodes_path": args.empty_outcodes_path,
     }
-    print(event)
-    handler(event, {})
+    # Leave it unset so sharded letters stream by default
+    if args.stream_source:
+        shared_event["stream_source"] = True
+    if args.source_dir:
+        shared_event["source_dir"] = args.source_dir
+    else:
+        shared_event["source_bucket_name"] = args.source_bucket_name
+        shared_event["source_path"] = args.source_path
+    print(shared_event)
+
+    work_units = plan_local_work_units(args)
+    start = time.perf_counter()
+    timings = {}
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = [
+            executor.submit(
+                run_work_unit, {**shared_event, "work_unit": work_unit}
+            )
+            for work_unit in work_units
+        ]
+        for future in as_completed(futures):
+            name, elapsed, result = future.result()
+            timings[name] = elapsed
+            print(f"{name}: {elapsed:.1f}s {result}")
+
+    print(
+        f"Baked {len(timings)} work units in {time.perf_counter() - start:.1f}s"
+    )
+    for name, elapsed in sorted(
+        timings.items(), key=lambda item: item[1], reverse=True
+    ):
+        print(f"  {name} {elapsed:8.1f}s")
+
+
+if __name__ == "__main__":
+    main()
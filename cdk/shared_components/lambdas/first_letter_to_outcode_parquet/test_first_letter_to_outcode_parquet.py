@@ -1,12 +1,41 @@
+import base64
+import hashlib
+import io
+import json
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import patch
 
 import polars
 import pytest
+from botocore.exceptions import ClientError
 from first_letter_to_outcode_parquet import (
+    DOWNLOAD_WORKERS,
+    SHARED_COMPONENTS_DIR,
+    UPLOAD_WORKERS,
     ConflictingDuplicateUPRNError,
     IdenticalDuplicateUPRNError,
+    StageMetrics,
+    UploadPool,
     check_duplicate_uprns,
+    download_parquet,
+    download_transfer_config,
+    frame_content_hash,
+    get_outcode_dfs,
+    get_parquet_write_options,
+    get_s3_uris,
+    handler,
+    iter_outcode_dfs_chunked,
+    load_shared_module,
+    main,
+    make_postcode_index,
+    outcode_range_expr,
+    read_first_letter_data,
+    s3_client,
     upload_outcode_parquet,
+    write_empty_outcodes_manifest,
 )
 
 
@@ -226,6 +255,41 @@ class TestCheckDuplicateUPRNs:
         assert result["uprn"].n_unique() == 3
         assert len(result) == 3
 
+    def test_no_duplicates_makes_no_copy(self):
+        """The common case shouldn't hold a second copy of the letter."""
+        df = make_df(
+            [
+                {
+                    "uprn": "1",
+                    "postcode": "AA1 1AA",
+                    "addressbase_source": "s3://path/to/v1/addressbase_cleaned",
+                },
+            ]
+        )
+        assert check_duplicate_uprns(df, "A") is df
+
+    def test_list_column_duplicates(self):
+        df = polars.DataFrame(
+            {
+                "uprn": ["1", "1", "2", "2"],
+                "ballot_ids": [["b1"], ["b1"], ["b2"], ["b2"]],
+            }
+        )
+        result = check_duplicate_uprns(df, "A")
+        assert result.sort("uprn").equals(
+            polars.DataFrame(
+                {"uprn": ["1", "2"], "ballot_ids": [["b1"], ["b2"]]}
+            )
+        )
+
+        conflicting = df.with_columns(
+            polars.Series("ballot_ids", [["b1"], ["b1"], ["b2"], ["b3"]])
+        )
+        with pytest.raises(
+            ConflictingDuplicateUPRNError, match="2 UPRNs have duplicate rows"
+        ):
+            check_duplicate_uprns(conflicting, "A")
+
 
 class TestUploadOutcodeParquet:
     def test_writes_sorted_data(self, tmp_path):
@@ -273,3 +337,1148 @@ class TestUploadOutcodeParquet:
                 }
             )
         )
+
+
+class TestReadFirstLetterData:
+    def write_parts(self, tmp_path):
+        make_df(
+            [
+                {
+                    "uprn": "1",
+                    "postcode": "AA1 1AA",
+                    "addressbase_source": "s3://path/to/v1/addressbase_cleaned",
+                },
+            ]
+        ).write_parquet(tmp_path / "part-0")
+        make_df(
+            [
+                {
+                    "uprn": "2",
+                    "postcode": "AA2 1BB",
+                    "addressbase_source": "s3://path/to/v1/addressbase_cleaned",
+                },
+            ]
+        ).write_parquet(tmp_path / "part-1")
+
+    def test_reads_local_dir(self, tmp_path):
+        self.write_parts(tmp_path)
+        result = read_first_letter_data(tmp_path)
+        assert sorted(result["uprn"].to_list()) == ["1", "2"]
+
+    def test_scans_list_of_uris(self, tmp_path):
+        """
+        A list of URIs is scanned in place. Polars treats local paths and
+        s3:// URIs the same way, so local paths stand in for S3 here.
+        """
+        source_dir = tmp_path / "first_letter=A"
+        source_dir.mkdir()
+        self.write_parts(source_dir)
+        result = read_first_letter_data(
+            [str(source_dir / "part-0"), str(source_dir / "part-1")]
+        )
+        assert sorted(result["uprn"].to_list()) == ["1", "2"]
+        # The hive style directory name isn't turned into a column
+        assert result.columns == ["uprn", "postcode", "addressbase_source"]
+
+    def test_both_sources_give_the_same_outcodes(self, tmp_path):
+        self.write_parts(tmp_path)
+        from_dir = get_outcode_dfs("A", tmp_path)
+        from_uris = get_outcode_dfs(
+            "A", [str(tmp_path / "part-0"), str(tmp_path / "part-1")]
+        )
+        assert [f.df["outcode"][0] for f in from_dir] == ["AA1", "AA2"]
+        assert [f.df["outcode"][0] for f in from_uris] == ["AA1", "AA2"]
+
+
+def test_get_s3_uris():
+    assert get_s3_uris("bucket", ["prefix/first_letter=A/part-0"]) == [
+        "s3://bucket/prefix/first_letter=A/part-0"
+    ]
+
+
+class TestDownloadParquet:
+    @patch("first_letter_to_outcode_parquet.s3_client")
+    def test_downloads_every_key(self, mock_s3_client, tmp_path):
+        def fake_download(bucket, key, filename, Config, Callback):
+            Callback(10)
+            Callback(5)
+
+        mock_s3_client.download_file.side_effect = fake_download
+        keys = [f"prefix/first_letter=A/part-{i}" for i in range(20)]
+
+        download_parquet(keys, tmp_path, "bucket", max_workers=4)
+
+        downloaded = sorted(
+            call.args[1] for call in mock_s3_client.download_file.call_args_list
+        )
+        assert downloaded == sorted(keys)
+        local_files = sorted(
+            call.args[2] for call in mock_s3_client.download_file.call_args_list
+        )
+        assert local_files == sorted(tmp_path / f"part-{i}" for i in range(20))
+
+    @patch("first_letter_to_outcode_parquet.s3_client")
+    def test_failed_download_raises(self, mock_s3_client, tmp_path):
+        mock_s3_client.download_file.side_effect = OSError("boom")
+        with pytest.raises(OSError, match="boom"):
+            download_parquet(["prefix/part-0"], tmp_path, "bucket")
+
+
+class TestS3ClientPool:
+    def test_pool_fits_every_worker(self):
+        pool_size = s3_client.meta.config.max_pool_connections
+        assert pool_size >= UPLOAD_WORKERS
+        assert (
+            pool_size
+            >= DOWNLOAD_WORKERS * download_transfer_config.max_concurrency
+        )
+
+
+class TestUploadPool:
+    def test_runs_every_upload(self):
+        uploaded = []
+        with UploadPool(max_workers=4) as pool:
+            for i in range(50):
+                pool.submit(uploaded.append, i)
+        assert sorted(uploaded) == list(range(50))
+
+    def test_limits_pending_uploads(self):
+        lock = threading.Lock()
+        in_flight = 0
+        max_in_flight = 0
+
+        def slow_upload():
+            nonlocal in_flight, max_in_flight
+            with lock:
+                in_flight += 1
+                max_in_flight = max(max_in_flight, in_flight)
+            time.sleep(0.01)
+            with lock:
+                in_flight -= 1
+
+        with UploadPool(max_workers=8, max_pending=2) as pool:
+            for _ in range(10):
+                pool.submit(slow_upload)
+        assert max_in_flight <= 2
+
+    def test_failed_upload_raises_on_exit(self):
+        def failing_upload():
+            raise OSError("boom")
+
+        with pytest.raises(OSError, match="boom"), UploadPool() as pool:
+            pool.submit(failing_upload)
+
+    def test_upload_outcode_parquet_queues_upload(self, tmp_path):
+        outcode_df = polars.DataFrame(
+            {
+                "uprn": ["1"],
+                "postcode": ["AA1 1AA"],
+                "outcode": ["AA1"],
+                "ballot_ids": [["b1"]],
+            }
+        )
+        with (
+            patch("first_letter_to_outcode_parquet.s3_client") as mock_s3,
+            UploadPool() as pool,
+        ):
+            upload_outcode_parquet(
+                tmp_path,
+                "dest-bucket",
+                "dest/path",
+                "ballot_ids",
+                outcode_df,
+                upload_pool=pool,
+            )
+        mock_s3.upload_file.assert_called_once_with(
+            tmp_path / "AA1.parquet", "dest-bucket", "dest/path/AA1.parquet"
+        )
+
+
+class TestInMemoryUploadOutcodeParquet:
+    outcode_df = polars.DataFrame(
+        {
+            "uprn": ["2", "1"],
+            "postcode": ["AA1 1AA", "AA1 1AA"],
+            "outcode": ["AA1", "AA1"],
+            "ballot_ids": [["b1"], ["b2"]],
+        }
+    )
+
+    @patch("first_letter_to_outcode_parquet.s3_client")
+    def test_puts_encoded_parquet(self, mock_s3_client):
+        upload_outcode_parquet(
+            None, "dest-bucket", "dest/path", "ballot_ids", self.outcode_df
+        )
+
+        mock_s3_client.upload_file.assert_not_called()
+        put_kwargs = mock_s3_client.put_object.call_args.kwargs
+        assert put_kwargs["Bucket"] == "dest-bucket"
+        assert put_kwargs["Key"] == "dest/path/AA1.parquet"
+        assert "ContentMD5" not in put_kwargs
+        written = polars.read_parquet(io.BytesIO(put_kwargs["Body"]))
+        assert written["uprn"].to_list() == ["1", "2"]
+
+    @patch("first_letter_to_outcode_parquet.s3_client")
+    def test_content_md5(self, mock_s3_client):
+        upload_outcode_parquet(
+            None,
+            "dest-bucket",
+            "dest/path",
+            "ballot_ids",
+            self.outcode_df,
+            content_md5=True,
+        )
+
+        put_kwargs = mock_s3_client.put_object.call_args.kwargs
+        assert (
+            put_kwargs["ContentMD5"]
+            == base64.b64encode(
+                hashlib.md5(put_kwargs["Body"]).digest()
+            ).decode()
+        )
+
+
+class TestSkipUnchangedOutcodes:
+    outcode_df = polars.DataFrame(
+        {
+            "uprn": ["2", "1"],
+            "postcode": ["AA1 1AA", "AA1 1AA"],
+            "outcode": ["AA1", "AA1"],
+            "ballot_ids": [["b1"], ["b2"]],
+        }
+    )
+
+    def test_hash_is_stable(self):
+        assert frame_content_hash(self.outcode_df) == frame_content_hash(
+            self.outcode_df.clone()
+        )
+
+    def test_hash_changes_with_data(self):
+        changed = self.outcode_df.with_columns(
+            polars.Series("ballot_ids", [["b1"], ["b3"]])
+        )
+        assert frame_content_hash(self.outcode_df) != frame_content_hash(
+            changed
+        )
+
+    def test_hash_of_slice_matches_equal_frame(self):
+        letter_df = polars.concat(
+            [
+                polars.DataFrame(
+                    {
+                        "uprn": ["3"],
+                        "postcode": ["AA2 1AA"],
+                        "outcode": ["AA2"],
+                        "ballot_ids": [["b1", "b2"]],
+                    }
+                ),
+                self.outcode_df,
+            ],
+            rechunk=True,
+        )
+        assert frame_content_hash(letter_df.slice(1)) == frame_content_hash(
+            self.outcode_df
+        )
+
+    def test_hash_changes_with_list_contents(self):
+        for ballot_ids in (
+            [["b1", None], ["b2"]],
+            [None, ["b2"]],
+            [[], ["b2"]],
+        ):
+            changed = self.outcode_df.with_columns(
+                polars.Series("ballot_ids", ballot_ids)
+            )
+            assert frame_content_hash(self.outcode_df) != frame_content_hash(
+                changed
+            )
+
+    def test_hash_changes_with_parquet_options(self):
+        assert frame_content_hash(self.outcode_df) != frame_content_hash(
+            self.outcode_df, {"compression": "snappy"}
+        )
+
+    def test_hash_of_empty_frames(self):
+        assert frame_content_hash(polars.DataFrame()) != frame_content_hash(
+            self.outcode_df.clear()
+        )
+
+    @patch("first_letter_to_outcode_parquet.s3_client")
+    def test_skips_unchanged(self, mock_s3_client):
+        content_hash = frame_content_hash(
+            self.outcode_df.sort(by=["postcode", "uprn"])
+        )
+        mock_s3_client.head_object.return_value = {
+            "Metadata": {"content-hash": content_hash}
+        }
+
+        uploaded = upload_outcode_parquet(
+            None,
+            "dest-bucket",
+            "dest/path",
+            "ballot_ids",
+            self.outcode_df,
+            skip_unchanged=True,
+        )
+
+        assert uploaded is False
+        mock_s3_client.put_object.assert_not_called()
+
+    @patch("first_letter_to_outcode_parquet.s3_client")
+    def test_uploads_changed_with_hash(self, mock_s3_client, tmp_path):
+        mock_s3_client.head_object.return_value = {
+            "Metadata": {"content-hash": "stale"}
+        }
+
+        uploaded = upload_outcode_parquet(
+            tmp_path,
+            "dest-bucket",
+            "dest/path",
+            "ballot_ids",
+            self.outcode_df,
+            skip_unchanged=True,
+        )
+
+        assert uploaded is True
+        mock_s3_client.upload_file.assert_called_once_with(
+            tmp_path / "AA1.parquet",
+            "dest-bucket",
+            "dest/path/AA1.parquet",
+            ExtraArgs={
+                "Metadata": {
+                    "content-hash": frame_content_hash(
+                        self.outcode_df.sort(by=["postcode", "uprn"])
+                    )
+                }
+            },
+        )
+
+    @patch("first_letter_to_outcode_parquet.s3_client")
+    def test_uploads_new_outcode(self, mock_s3_client):
+        mock_s3_client.head_object.side_effect = ClientError(
+            {"Error": {"Code": "404"}}, "HeadObject"
+        )
+
+        uploaded = upload_outcode_parquet(
+            None,
+            "dest-bucket",
+            "dest/path",
+            "ballot_ids",
+            self.outcode_df,
+            skip_unchanged=True,
+        )
+
+        assert uploaded is True
+        put_kwargs = mock_s3_client.put_object.call_args.kwargs
+        assert "content-hash" in put_kwargs["Metadata"]
+
+
+class TestGetOutcodeDfs:
+    def test_sorted_slices_with_flags(self, tmp_path):
+        polars.DataFrame(
+            {
+                "uprn": ["5", "4", "3", "2", "1"],
+                "postcode": [
+                    "AA2 1AA",
+                    "AA1 1BB",
+                    "AA1 1AA",
+                    "AA2 1AA",
+                    "AA1 1BB",
+                ],
+                "ballot_ids": [[None], [], ["b1"], None, None],
+            }
+        ).write_parquet(tmp_path / "part-0")
+
+        outcode_frames = get_outcode_dfs("A", tmp_path, "ballot_ids")
+
+        assert [f.df["outcode"][0] for f in outcode_frames] == ["AA1", "AA2"]
+        assert [f.has_filter_column_data for f in outcode_frames] == [
+            True,
+            False,
+        ]
+        aa1 = outcode_frames[0].df
+        assert aa1["postcode"].to_list() == ["AA1 1AA", "AA1 1BB", "AA1 1BB"]
+        assert aa1["uprn"].to_list() == ["3", "1", "4"]
+        assert outcode_frames[1].df["uprn"].to_list() == ["2", "5"]
+
+    def test_no_filter_column(self, tmp_path):
+        make_df(
+            [
+                {
+                    "uprn": "1",
+                    "postcode": "AA1 1AA",
+                    "addressbase_source": "s3://path/to/v1/addressbase_cleaned",
+                },
+            ]
+        ).write_parquet(tmp_path / "part-0")
+
+        (outcode_frame,) = get_outcode_dfs("A", tmp_path)
+
+        assert outcode_frame.has_filter_column_data is None
+        assert len(outcode_frame.df) == 1
+
+    @patch("first_letter_to_outcode_parquet.s3_client")
+    def test_precomputed_flag_writes_empty_file(self, mock_s3_client):
+        outcode_df = polars.DataFrame(
+            {
+                "uprn": ["1"],
+                "postcode": ["AA1 1AA"],
+                "outcode": ["AA1"],
+                "ballot_ids": [["b1"]],
+            }
+        )
+        upload_outcode_parquet(
+            None,
+            "dest-bucket",
+            "dest/path",
+            "ballot_ids",
+            outcode_df,
+            has_filter_column_data=False,
+        )
+        body = mock_s3_client.put_object.call_args.kwargs["Body"]
+        assert polars.read_parquet(io.BytesIO(body)).is_empty()
+
+
+class TestParquetWriteOptions:
+    def test_defaults_to_no_options(self):
+        assert get_parquet_write_options(None) == {}
+
+    def test_unknown_option_raises(self):
+        with pytest.raises(ValueError, match="Unknown parquet_options"):
+            get_parquet_write_options({"compresion": "zstd"})
+
+    @patch("first_letter_to_outcode_parquet.s3_client")
+    def test_options_are_used_when_writing(self, mock_s3_client):
+        write_parquet = polars.DataFrame.write_parquet
+        outcode_df = polars.DataFrame(
+            {
+                "uprn": [str(i) for i in range(10)],
+                "postcode": ["AA1 1AA"] * 10,
+                "outcode": ["AA1"] * 10,
+                "ballot_ids": [["b1"]] * 10,
+            }
+        )
+        with patch.object(
+            polars.DataFrame,
+            "write_parquet",
+            autospec=True,
+            side_effect=write_parquet,
+        ) as mock_write_parquet:
+            upload_outcode_parquet(
+                None,
+                "dest-bucket",
+                "dest/path",
+                "ballot_ids",
+                outcode_df,
+                parquet_options=get_parquet_write_options(
+                    {"compression": "uncompressed", "row_group_size": 4}
+                ),
+            )
+
+        assert mock_write_parquet.call_args.kwargs == {
+            "compression": "uncompressed",
+            "row_group_size": 4,
+        }
+        body = mock_s3_client.put_object.call_args.kwargs["Body"]
+        assert polars.read_parquet(io.BytesIO(body)).equals(outcode_df)
+
+
+class TestPostcodeIndex:
+    outcode_df = polars.DataFrame(
+        {
+            "uprn": ["4", "3", "1", "2", "5"],
+            "postcode": ["AA1 1BB", "AA1 1BB", "AA1 1AA", "AA1 1AA", "AA1 1CC"],
+            "outcode": ["AA1"] * 5,
+            "ballot_ids": [[], ["b1"], ["b2"], ["b3"], None],
+        }
+    )
+
+    def test_index_rows(self):
+        sorted_df = self.outcode_df.sort(by=["postcode", "uprn"])
+        index = make_postcode_index(sorted_df)
+        assert index == {
+            "rows": 5,
+            "postcodes": {
+                "AA1 1AA": [0, 2],
+                "AA1 1BB": [2, 2],
+                "AA1 1CC": [4, 1],
+            },
+        }
+        offset, length = index["postcodes"]["AA1 1BB"]
+        assert sorted_df.slice(offset, length)["uprn"].to_list() == ["3", "4"]
+
+    def test_empty_index(self):
+        assert make_postcode_index(polars.DataFrame()) == {
+            "rows": 0,
+            "postcodes": {},
+        }
+
+    @patch("first_letter_to_outcode_parquet.s3_client")
+    def test_index_uploaded_before_outcode_file(self, mock_s3_client):
+        upload_outcode_parquet(
+            None,
+            "dest-bucket",
+            "dest/path",
+            "ballot_ids",
+            self.outcode_df,
+            index_path="dest/index",
+        )
+
+        keys = [
+            call.kwargs["Key"]
+            for call in mock_s3_client.put_object.call_args_list
+        ]
+        assert keys == ["dest/index/AA1.json", "dest/path/AA1.parquet"]
+        index_body = mock_s3_client.put_object.call_args_list[0].kwargs["Body"]
+        assert json.loads(index_body)["postcodes"]["AA1 1CC"] == [4, 1]
+
+    @patch("first_letter_to_outcode_parquet.s3_client")
+    def test_index_skipped_with_unchanged_file(self, mock_s3_client):
+        content_hash = frame_content_hash(
+            self.outcode_df.sort(by=["postcode", "uprn"]),
+            index_path="dest/index",
+        )
+        mock_s3_client.head_object.return_value = {
+            "Metadata": {"content-hash": content_hash}
+        }
+        upload_outcode_parquet(
+            None,
+            "dest-bucket",
+            "dest/path",
+            "ballot_ids",
+            self.outcode_df,
+            skip_unchanged=True,
+            index_path="dest/index",
+        )
+        mock_s3_client.put_object.assert_not_called()
+
+    @patch("first_letter_to_outcode_parquet.s3_client")
+    def test_index_uploaded_when_file_written_without_it(self, mock_s3_client):
+        content_hash = frame_content_hash(
+            self.outcode_df.sort(by=["postcode", "uprn"])
+        )
+        mock_s3_client.head_object.return_value = {
+            "Metadata": {"content-hash": content_hash}
+        }
+        upload_outcode_parquet(
+            None,
+            "dest-bucket",
+            "dest/path",
+            "ballot_ids",
+            self.outcode_df,
+            skip_unchanged=True,
+            index_path="dest/index",
+        )
+
+        keys = [
+            call.kwargs["Key"]
+            for call in mock_s3_client.put_object.call_args_list
+        ]
+        assert keys == ["dest/index/AA1.json", "dest/path/AA1.parquet"]
+
+
+class TestEmptyOutcodes:
+    @patch(
+        "first_letter_to_outcode_parquet.get_all_object_keys",
+        return_value=["dest/empty/A.json"],
+    )
+    @patch("first_letter_to_outcode_parquet.s3_client")
+    def test_manifest_written_before_deleting(self, mock_s3_client, _):
+        mock_s3_client.delete_objects.return_value = {}
+        write_empty_outcodes_manifest(
+            "dest-bucket",
+            "dest/path",
+            "dest/empty",
+            "A",
+            ["AA2", "AA1"],
+            index_path="dest/index",
+        )
+
+        assert [call[0] for call in mock_s3_client.method_calls] == [
+            "put_object",
+            "delete_objects",
+        ]
+        put_kwargs = mock_s3_client.put_object.call_args.kwargs
+        assert put_kwargs["Key"] == "dest/empty/A.json"
+        assert json.loads(put_kwargs["Body"]) == {
+            "first_letter": "A",
+            "outcodes": ["AA1", "AA2"],
+        }
+        deleted = mock_s3_client.delete_objects.call_args.kwargs["Delete"]
+        assert [obj["Key"] for obj in deleted["Objects"]] == [
+            "dest/path/AA2.parquet",
+            "dest/path/AA1.parquet",
+            "dest/index/AA2.json",
+            "dest/index/AA1.json",
+        ]
+
+    @patch("first_letter_to_outcode_parquet.s3_client")
+    def test_failed_delete_raises(self, mock_s3_client):
+        mock_s3_client.delete_objects.return_value = {
+            "Errors": [{"Key": "dest/path/AA1.parquet"}]
+        }
+        with pytest.raises(Exception, match="Failed to delete"):
+            write_empty_outcodes_manifest(
+                "dest-bucket", "dest/path", "dest/empty", "A", ["AA1"]
+            )
+
+    @patch("first_letter_to_outcode_parquet.s3_client")
+    def test_handler_skips_empty_outcodes(self, mock_s3_client, tmp_path):
+        polars.DataFrame(
+            {
+                "uprn": ["1", "2"],
+                "postcode": ["AA1 1AA", "AA2 1AA"],
+                "ballot_ids": [["b1"], []],
+            }
+        ).write_parquet(tmp_path / "part-0")
+        mock_s3_client.delete_objects.return_value = {}
+
+        with (
+            patch(
+                "first_letter_to_outcode_parquet.get_all_object_keys",
+                return_value=["source/first_letter=A/part-0"],
+            ),
+            patch(
+                "first_letter_to_outcode_parquet.get_s3_uris",
+                return_value=[str(tmp_path / "part-0")],
+            ),
+        ):
+            result = handler(
+                {
+                    "first_letter": "A",
+                    "source_bucket_name": "source-bucket",
+                    "source_path": "source/",
+                    "dest_bucket_name": "dest-bucket",
+                    "dest_path": "dest/path",
+                    "filter_column": "ballot_ids",
+                    "stream_source": True,
+                    "in_memory_output": True,
+                    "empty_outcodes_path": "dest/empty",
+                },
+                {},
+            )
+
+        assert result == {
+            "first_letter": "A",
+            "shard_index": 0,
+            "shard_count": 1,
+            "changed_outcodes": 1,
+            "unchanged_outcodes": 0,
+            "empty_outcodes": 1,
+        }
+        put_keys = sorted(
+            call.kwargs["Key"]
+            for call in mock_s3_client.put_object.call_args_list
+        )
+        assert put_keys == ["dest/empty/A.json", "dest/path/AA1.parquet"]
+
+
+class TestShardedLetters:
+    @patch(
+        "first_letter_to_outcode_parquet.get_all_object_keys",
+        return_value=["dest/empty/A.json", "dest/empty/A-0-of-2.json"],
+    )
+    @patch("first_letter_to_outcode_parquet.s3_client")
+    def test_stale_manifests_deleted(self, mock_s3_client, _):
+        mock_s3_client.delete_objects.return_value = {}
+        write_empty_outcodes_manifest(
+            "dest-bucket",
+            "dest/path",
+            "dest/empty",
+            "A",
+            ["AA9"],
+            shard_index=1,
+            shard_count=3,
+        )
+
+        put_kwargs = mock_s3_client.put_object.call_args.kwargs
+        assert put_kwargs["Key"] == "dest/empty/A-1-of-3.json"
+        deleted = mock_s3_client.delete_objects.call_args.kwargs["Delete"]
+        assert [obj["Key"] for obj in deleted["Objects"]] == [
+            "dest/empty/A.json",
+            "dest/empty/A-0-of-2.json",
+            "dest/path/AA9.parquet",
+        ]
+
+    def test_shards_are_contiguous_outcode_ranges(self, tmp_path):
+        outcodes = ["AA1", "AA2", "AA3", "AA4"]
+        polars.DataFrame(
+            {
+                "uprn": [str(i) for i in range(40)],
+                "postcode": [f"{outcodes[i % 4]} 1AA" for i in range(40)],
+                "ballot_ids": [["b1"]] * 40,
+            }
+        ).write_parquet(tmp_path / "part-0")
+
+        shards = [
+            [
+                f.df["outcode"][0]
+                for f in get_outcode_dfs(
+                    "A",
+                    tmp_path,
+                    "ballot_ids",
+                    shard_index=i,
+                    shard_count=2,
+                )
+            ]
+            for i in range(2)
+        ]
+        assert shards == [["AA1", "AA2"], ["AA3", "AA4"]]
+
+    def test_conflicting_duplicates_in_another_shard_raise(self, tmp_path):
+        polars.DataFrame(
+            {
+                "uprn": ["1", "2", "3", "1"],
+                "postcode": ["AA1 1AA", "AA1 1AB", "AA2 1AA", "AA2 1AB"],
+                "ballot_ids": [["b1"]] * 4,
+            }
+        ).write_parquet(tmp_path / "part-0")
+
+        with pytest.raises(ConflictingDuplicateUPRNError):
+            get_outcode_dfs(
+                "A", tmp_path, "ballot_ids", shard_index=0, shard_count=2
+            )
+
+    def test_identical_duplicates_read_once(self, tmp_path):
+        polars.DataFrame(
+            {
+                "uprn": ["1", "2", "3", "3"],
+                "postcode": ["AA1 1AA", "AA1 1AB", "AA2 1AA", "AA2 1AA"],
+                "ballot_ids": [["b1"]] * 4,
+            }
+        ).write_parquet(tmp_path / "part-0")
+
+        frames = get_outcode_dfs(
+            "A", tmp_path, "ballot_ids", shard_index=1, shard_count=2
+        )
+        assert [f.df["uprn"].to_list() for f in frames] == [["3"]]
+
+    def test_outcode_range_matches_outcodes(self):
+        postcodes = polars.DataFrame(
+            {
+                "postcode": [
+                    "AB1 1AA",
+                    "AB1 9ZZ",
+                    "AB10 1AA",
+                    "AB2 1AA",
+                    "AB22 1AA",
+                    "AB3 1AA",
+                    "AB",
+                    "AB2",
+                ]
+            }
+        )
+        in_range = postcodes.filter(outcode_range_expr("AB10", "AB22"))
+        assert in_range["postcode"].to_list() == [
+            "AB10 1AA",
+            "AB2 1AA",
+            "AB22 1AA",
+            "AB2",
+        ]
+
+    @patch("first_letter_to_outcode_parquet.download_parquet")
+    @patch("first_letter_to_outcode_parquet.s3_client")
+    def test_sharded_letters_stream_source(
+        self, mock_s3_client, mock_download, tmp_path
+    ):
+        polars.DataFrame(
+            {
+                "uprn": [str(i) for i in range(4)],
+                "postcode": ["AA1 1AA", "AA2 1AA", "AA3 1AA", "AA4 1AA"],
+                "ballot_ids": [["b1"]] * 4,
+            }
+        ).write_parquet(tmp_path / "part-0")
+
+        with (
+            patch(
+                "first_letter_to_outcode_parquet.get_all_object_keys",
+                return_value=["source/first_letter=A/part-0"],
+            ),
+            patch(
+                "first_letter_to_outcode_parquet.get_s3_uris",
+                return_value=[str(tmp_path / "part-0")],
+            ) as mock_get_s3_uris,
+        ):
+            result = handler(
+                {
+                    "first_letter": "A",
+                    "source_bucket_name": "source-bucket",
+                    "source_path": "source/",
+                    "dest_bucket_name": "dest-bucket",
+                    "dest_path": "dest/path",
+                    "filter_column": "ballot_ids",
+                    "in_memory_output": True,
+                    "shard_index": 1,
+                    "shard_count": 2,
+                },
+                {},
+            )
+
+        mock_get_s3_uris.assert_called_once()
+        mock_download.assert_not_called()
+        assert result["changed_outcodes"] == 2
+        put_keys = sorted(
+            call.kwargs["Key"]
+            for call in mock_s3_client.put_object.call_args_list
+        )
+        assert put_keys == ["dest/path/AA3.parquet", "dest/path/AA4.parquet"]
+
+    @patch("first_letter_to_outcode_parquet.bake_first_letter")
+    def test_handler_bakes_each_item_in_work_unit(self, mock_bake):
+        mock_bake.side_effect = lambda event: event
+        result = handler(
+            {
+                "dest_path": "dest/path",
+                "work_unit": [
+                    {"first_letter": "B", "shard_index": 0, "shard_count": 1},
+                    {"first_letter": "Q", "shard_index": 0, "shard_count": 1},
+                ],
+            },
+            {},
+        )
+        assert [r["first_letter"] for r in result] == ["B", "Q"]
+        assert all(r["dest_path"] == "dest/path" for r in result)
+        assert all("work_unit" not in r for r in result)
+
+
+class TestLocalRunner:
+    @patch("first_letter_to_outcode_parquet.s3_client")
+    def test_bakes_from_source_dir(self, mock_s3_client, tmp_path):
+        letter_dir = tmp_path / "first_letter=A"
+        letter_dir.mkdir()
+        polars.DataFrame(
+            {
+                "uprn": ["1", "2"],
+                "postcode": ["AA1 1AA", "AA2 1AA"],
+                "ballot_ids": [["b1"], ["b2"]],
+            }
+        ).write_parquet(letter_dir / "part-0")
+
+        result = handler(
+            {
+                "first_letter": "A",
+                "source_dir": str(tmp_path),
+                "dest_bucket_name": "dest-bucket",
+                "dest_path": "dest/path",
+                "filter_column": "ballot_ids",
+                "in_memory_output": True,
+            },
+            {},
+        )
+
+        assert result["changed_outcodes"] == 2
+        mock_s3_client.get_paginator.assert_not_called()
+        put_keys = sorted(
+            call.kwargs["Key"]
+            for call in mock_s3_client.put_object.call_args_list
+        )
+        assert put_keys == ["dest/path/AA1.parquet", "dest/path/AA2.parquet"]
+
+    def test_missing_letter_in_source_dir(self, tmp_path):
+        assert (
+            handler(
+                {
+                    "first_letter": "Z",
+                    "source_dir": str(tmp_path),
+                    "dest_bucket_name": "dest-bucket",
+                    "dest_path": "dest/path",
+                    "filter_column": "ballot_ids",
+                },
+                {},
+            )
+            is None
+        )
+
+    @patch(
+        "first_letter_to_outcode_parquet.ProcessPoolExecutor",
+        ThreadPoolExecutor,
+    )
+    @patch("first_letter_to_outcode_parquet.bake_first_letter")
+    def test_main_bakes_each_letter(self, mock_bake, tmp_path, capsys):
+        mock_bake.side_effect = lambda event: {
+            "first_letter": event["first_letter"]
+        }
+        main(
+            ["--source-dir", str(tmp_path), "--letters", "ab", "--workers", "2"]
+        )
+
+        events = sorted(
+            (call.args[0] for call in mock_bake.call_args_list),
+            key=lambda event: event["first_letter"],
+        )
+        assert [event["first_letter"] for event in events] == ["A", "B"]
+        assert all(event["source_dir"] == str(tmp_path) for event in events)
+        assert all("source_bucket_name" not in event for event in events)
+        assert all("stream_source" not in event for event in events)
+        # The same parquet_options as the stacks
+        stack_options = load_shared_module(
+            SHARED_COMPONENTS_DIR / "outcode_parquet_options.py"
+        ).OUTCODE_PARQUET_OPTIONS
+        assert all(
+            event["parquet_options"] == stack_options for event in events
+        )
+        assert "Baked 2 work units" in capsys.readouterr().out
+
+    @patch(
+        "first_letter_to_outcode_parquet.ProcessPoolExecutor",
+        ThreadPoolExecutor,
+    )
+    @patch("first_letter_to_outcode_parquet.handler")
+    def test_main_plans_work_units(self, mock_handler, tmp_path):
+        mock_handler.side_effect = lambda event, context: []
+        for letter, size in [("A", 300), ("B", 50), ("C", 40)]:
+            letter_dir = tmp_path / f"first_letter={letter}"
+            letter_dir.mkdir()
+            (letter_dir / "part-0").write_bytes(b"x" * size)
+
+        main(
+            [
+                "--source-dir",
+                str(tmp_path),
+                "--letters",
+                "ABC",
+                "--work-units",
+                "4",
+                "--parquet-options",
+                '{"compression": "lz4"}',
+                "--empty-outcodes-path",
+                "dest/empty",
+            ]
+        )
+
+        events = [call.args[0] for call in mock_handler.call_args_list]
+        assert sorted(
+            [
+                (item["first_letter"], item["shard_index"], item["shard_count"])
+                for item in event["work_unit"]
+            ]
+            for event in events
+        ) == [
+            [("A", 0, 4)],
+            [("A", 1, 4)],
+            [("A", 2, 4)],
+            [("A", 3, 4)],
+            [("B", 0, 1), ("C", 0, 1)],
+        ]
+        assert all(
+            event["parquet_options"] == {"compression": "lz4"}
+            and event["empty_outcodes_path"] == "dest/empty"
+            for event in events
+        )
+
+
+class TestStageMetrics:
+    def emf_records(self, output):
+        return [
+            json.loads(line)
+            for line in output.splitlines()
+            if line.startswith('{"_aws"')
+        ]
+
+    @patch("first_letter_to_outcode_parquet.sentry_sdk")
+    def test_emits_embedded_metric_format(self, mock_sentry, capsys):
+        metrics = StageMetrics("dest/path", "A", shard_index=1)
+        with metrics.stage("read") as stage:
+            stage["rows"] = 10
+            stage["bytes_read"] = 2048
+
+        [record] = self.emf_records(capsys.readouterr().out)
+        assert record["_aws"]["CloudWatchMetrics"] == [
+            {
+                "Namespace": "DataBaker/OutcodeParquet",
+                "Dimensions": [["Layer", "Stage"]],
+                "Metrics": [
+                    {"Name": "Rows", "Unit": "Count"},
+                    {"Name": "BytesRead", "Unit": "Bytes"},
+                    {"Name": "Duration", "Unit": "Milliseconds"},
+                    {"Name": "PeakRSS", "Unit": "Megabytes"},
+                ],
+            }
+        ]
+        assert isinstance(record["_aws"]["Timestamp"], int)
+        assert record["Layer"] == "dest/path"
+        assert record["Stage"] == "read"
+        assert record["FirstLetter"] == "A"
+        assert record["ShardIndex"] == 1
+        assert record["Rows"] == 10
+        assert record["BytesRead"] == 2048
+        assert record["Duration"] >= 0
+        assert record["PeakRSS"] > 0
+        mock_sentry.set_context.assert_called_with(
+            "outcode_stages", {"read": metrics.stages["read"]}
+        )
+
+    @patch("first_letter_to_outcode_parquet.sentry_sdk")
+    def test_failed_stage_goes_to_sentry_only(self, mock_sentry, capsys):
+        metrics = StageMetrics("dest/path", "A")
+        with pytest.raises(ValueError), metrics.stage("dedupe"):
+            raise ValueError
+
+        assert self.emf_records(capsys.readouterr().out) == []
+        assert "duration_ms" in metrics.stages["dedupe"]
+        mock_sentry.set_context.assert_called_with(
+            "outcode_stages", metrics.stages
+        )
+
+    def test_unknown_metric_raises(self):
+        metrics = StageMetrics("dest/path", "A")
+        with pytest.raises(KeyError), metrics.stage("read") as stage:
+            stage["widgets"] = 1
+
+    @patch("first_letter_to_outcode_parquet.s3_client")
+    def test_handler_records_each_stage(self, mock_s3_client, tmp_path, capsys):
+        polars.DataFrame(
+            {
+                "uprn": ["1", "2", "3"],
+                "postcode": ["AA1 1AA", "AA1 1AB", "AA2 1AA"],
+                "ballot_ids": [["b1"], ["b1"], ["b2"]],
+            }
+        ).write_parquet(tmp_path / "part-0")
+        mock_s3_client.download_file.side_effect = (
+            lambda bucket, key, filename, **kwargs: shutil.copy(
+                tmp_path / "part-0", filename
+            )
+        )
+
+        with patch(
+            "first_letter_to_outcode_parquet.get_all_object_keys",
+            return_value=["source/first_letter=A/part-0"],
+        ):
+            handler(
+                {
+                    "first_letter": "A",
+                    "source_bucket_name": "source-bucket",
+                    "source_path": "source/",
+                    "dest_bucket_name": "dest-bucket",
+                    "dest_path": "dest/path",
+                    "filter_column": "ballot_ids",
+                    "in_memory_output": True,
+                },
+                {},
+            )
+
+        records = {
+            record["Stage"]: record
+            for record in self.emf_records(capsys.readouterr().out)
+        }
+        assert list(records) == [
+            "list",
+            "download",
+            "read",
+            "dedupe",
+            "partition",
+            "encode",
+            "upload",
+        ]
+        assert records["list"]["Files"] == 1
+        assert records["read"]["Rows"] == 3
+        assert records["partition"]["Outcodes"] == 2
+        assert records["encode"]["BytesWritten"] == sum(
+            len(call.kwargs["Body"])
+            for call in mock_s3_client.put_object.call_args_list
+        )
+        assert records["upload"]["Outcodes"] == 2
+
+
+class TestChunkedOutcodeDfs:
+    def write_parts(self, tmp_path):
+        tmp_path.mkdir(exist_ok=True)
+        polars.DataFrame(
+            {
+                "uprn": ["4", "1", "7", "2"],
+                "postcode": ["AA3 1AA", "AA1 1AB", "AA4 1AA", "AA1 1AA"],
+                "ballot_ids": [["b3"], ["b1"], [None], ["b1"]],
+            }
+        ).write_parquet(tmp_path / "part-0")
+        polars.DataFrame(
+            {
+                "uprn": ["5", "3", "6"],
+                "postcode": ["AA3 1AB", "AA2 1AA", "AA3 1AA"],
+                "ballot_ids": [["b3"], [None], ["b3"]],
+            }
+        ).write_parquet(tmp_path / "part-1")
+
+    @pytest.mark.parametrize("max_chunk_rows", [1, 3, 100])
+    @pytest.mark.parametrize("shard_count", [1, 2])
+    def test_same_frames_as_whole_letter(
+        self, tmp_path, max_chunk_rows, shard_count
+    ):
+        self.write_parts(tmp_path)
+        for shard_index in range(shard_count):
+            expected = get_outcode_dfs(
+                "A",
+                tmp_path,
+                "ballot_ids",
+                shard_index=shard_index,
+                shard_count=shard_count,
+            )
+            chunked = list(
+                iter_outcode_dfs_chunked(
+                    "A",
+                    tmp_path,
+                    "ballot_ids",
+                    shard_index=shard_index,
+                    shard_count=shard_count,
+                    max_chunk_rows=max_chunk_rows,
+                )
+            )
+            assert len(chunked) == len(expected)
+            for frame, expected_frame in zip(chunked, expected):
+                assert frame.df.equals(expected_frame.df)
+                assert (
+                    frame.has_filter_column_data
+                    == expected_frame.has_filter_column_data
+                )
+
+    def test_identical_duplicates_across_parts(self, tmp_path):
+        self.write_parts(tmp_path)
+        polars.DataFrame(
+            {"uprn": ["2"], "postcode": ["AA1 1AA"], "ballot_ids": [["b1"]]}
+        ).write_parquet(tmp_path / "part-2")
+
+        frames = list(
+            iter_outcode_dfs_chunked(
+                "A", tmp_path, "ballot_ids", max_chunk_rows=1
+            )
+        )
+        assert frames[0].df["uprn"].to_list() == ["2", "1"]
+        assert sum(len(frame.df) for frame in frames) == 7
+
+    def test_conflicting_duplicates_across_parts(self, tmp_path):
+        self.write_parts(tmp_path)
+        polars.DataFrame(
+            {"uprn": ["7"], "postcode": ["AA1 1AA"], "ballot_ids": [["b1"]]}
+        ).write_parquet(tmp_path / "part-2")
+
+        with pytest.raises(ConflictingDuplicateUPRNError):
+            list(
+                iter_outcode_dfs_chunked(
+                    "A", tmp_path, "ballot_ids", max_chunk_rows=1
+                )
+            )
+
+    @patch("first_letter_to_outcode_parquet.s3_client")
+    def test_handler_in_chunks(self, mock_s3_client, tmp_path):
+        self.write_parts(tmp_path / "first_letter=A")
+
+        result = handler(
+            {
+                "first_letter": "A",
+                "source_dir": str(tmp_path),
+                "dest_bucket_name": "dest-bucket",
+                "dest_path": "dest/path",
+                "filter_column": "ballot_ids",
+                "in_memory_output": True,
+                "max_chunk_rows": 2,
+            },
+            {},
+        )
+
+        assert result["changed_outcodes"] == 4
+        put_keys = [
+            call.kwargs["Key"]
+            for call in mock_s3_client.put_object.call_args_list
+        ]
+        assert sorted(put_keys) == [
+            f"dest/path/AA{i}.parquet" for i in range(1, 5)
+        ]
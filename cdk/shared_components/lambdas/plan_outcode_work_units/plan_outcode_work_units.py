@@ -0,0 +1,121 @@
+"""
+Splits the first_letter=X partitions of a table into work units of about
+the same size, for first_letter_to_outcode_parquet to process in a Map
+state.
+
+Postcode letters are very skewed: some letters have many times the
+addresses of others. Fanning out one lambda per letter means the run takes
+as long as the biggest letter. Instead, letters smaller than the target
+size are packed together into one unit, and letters bigger than it are
+split into shards, each baking a contiguous range of the letter's outcodes.
+"""
+
+import math
+import re
+from collections import defaultdict
+
+import boto3
+
+s3_client = boto3.client("s3")
+
+# How many work units to aim for if no target size is given.
+DEFAULT_MAX_UNITS = 32
+
+FIRST_LETTER_RE = re.compile(r"first_letter=([^/]+)/")
+
+
+def get_first_letter_sizes(bucket_name: str, source_path: str) -> dict:
+    """
+    Returns: the total size in bytes of the objects in each first_letter=X
+        partition under source_path
+    """
+    sizes = defaultdict(int)
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=source_path):
+        for obj in page.get("Contents", []):
+            match = FIRST_LETTER_RE.search(obj["Key"])
+            if match:
+                sizes[match.group(1)] += obj["Size"]
+    return dict(sizes)
+
+
+def plan_work_units(
+    letter_sizes: dict[str, int], target_unit_bytes: int
+) -> list[list[dict]]:
+    """
+    Plans work units of about target_unit_bytes each.
+
+    A letter bigger than the target is split into shards, each in a unit of
+    its own. The other letters are packed first fit, biggest first, into
+    as few units as fit under the target.
+
+    Returns: a list of work units. Each is a list of
+        {"first_letter", "shard_index", "shard_count"} dicts to bake in turn.
+    """
+    work_units = []
+    packed_units = []
+    for letter, size in sorted(
+        letter_sizes.items(), key=lambda item: (-item[1], item[0])
+    ):
+        if size > target_unit_bytes:
+            shard_count = math.ceil(size / target_unit_bytes)
+            work_units.extend(
+                [
+                    {
+                        "first_letter": letter,
+                        "shard_index": shard_index,
+                        "shard_count": shard_count,
+                    }
+                ]
+                for shard_index in range(shard_count)
+            )
+            continue
+
+        work_item = {
+            "first_letter": letter,
+            "shard_index": 0,
+            "shard_count": 1,
+        }
+        for packed_unit in packed_units:
+            if packed_unit["size"] + size <= target_unit_bytes:
+                packed_unit["size"] += size
+                packed_unit["work_unit"].append(work_item)
+                break
+        else:
+            packed_units.append({"size": size, "work_unit": [work_item]})
+
+    return work_units + [
+        packed_unit["work_unit"] for packed_unit in packed_units
+    ]
+
+
+def handler(event, context):
+    source_bucket_name = event["source_bucket_name"]
+    source_path = event["source_path"]
+
+    letter_sizes = get_first_letter_sizes(source_bucket_name, source_path)
+    total_bytes = sum(letter_sizes.values())
+    target_unit_bytes = event.get("target_unit_bytes") or max(
+        math.ceil(total_bytes / event.get("max_units", DEFAULT_MAX_UNITS)), 1
+    )
+
+    work_units = plan_work_units(letter_sizes, target_unit_bytes)
+    print(
+        f"Planned {len(work_units)} work units of about {target_unit_bytes}"
+        f" bytes for {len(letter_sizes)} letters ({total_bytes} bytes)"
+    )
+    for work_unit in work_units:
+        print(work_unit)
+    return {"work_units": work_units}
+
+
+if __name__ == "__main__":
+    print(
+        handler(
+            {
+                "source_bucket_name": "pollingstations.private.data",
+                "source_path": "addressbase/development/current_ballots_joined_to_address_base/",
+            },
+            {},
+        )
+    )
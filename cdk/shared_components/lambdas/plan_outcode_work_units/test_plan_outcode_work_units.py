@@ -0,0 +1,96 @@
+from unittest.mock import patch
+
+from plan_outcode_work_units import (
+    get_first_letter_sizes,
+    handler,
+    plan_work_units,
+)
+
+
+def letters_in(work_units):
+    return sorted(
+        (item["first_letter"], item["shard_index"], item["shard_count"])
+        for work_unit in work_units
+        for item in work_unit
+    )
+
+
+class TestPlanWorkUnits:
+    def test_small_letters_are_packed(self):
+        work_units = plan_work_units({"A": 40, "B": 30, "C": 30, "D": 50}, 100)
+        assert [
+            [item["first_letter"] for item in work_unit]
+            for work_unit in work_units
+        ] == [["D", "A"], ["B", "C"]]
+
+    def test_big_letters_are_sharded(self):
+        work_units = plan_work_units({"B": 250, "Q": 5}, 100)
+        assert work_units[:3] == [
+            [{"first_letter": "B", "shard_index": i, "shard_count": 3}]
+            for i in range(3)
+        ]
+        assert work_units[3] == [
+            {"first_letter": "Q", "shard_index": 0, "shard_count": 1}
+        ]
+
+    def test_every_letter_is_planned_once(self):
+        sizes = {chr(i): (i * 37) % 500 + 1 for i in range(65, 91)}
+        work_units = plan_work_units(sizes, 300)
+        unsharded = [
+            letter
+            for letter, _, shard_count in letters_in(work_units)
+            if shard_count == 1
+        ]
+        sharded = {
+            (letter, shard_count)
+            for letter, _, shard_count in letters_in(work_units)
+            if shard_count > 1
+        }
+        assert sorted(unsharded + [letter for letter, _ in sharded]) == sorted(
+            sizes
+        )
+        for letter, shard_count in sharded:
+            assert [
+                shard_index
+                for item_letter, shard_index, _ in letters_in(work_units)
+                if item_letter == letter
+            ] == list(range(shard_count))
+
+    def test_no_letters(self):
+        assert plan_work_units({}, 100) == []
+
+
+@patch("plan_outcode_work_units.s3_client")
+def test_get_first_letter_sizes(mock_s3_client):
+    mock_s3_client.get_paginator().paginate.return_value = [
+        {
+            "Contents": [
+                {"Key": "prefix/first_letter=A/part-0", "Size": 10},
+                {"Key": "prefix/first_letter=A/part-1", "Size": 5},
+                {"Key": "prefix/first_letter=B/part-0", "Size": 7},
+                {"Key": "prefix/_SUCCESS", "Size": 0},
+            ]
+        }
+    ]
+    assert get_first_letter_sizes("bucket", "prefix/") == {"A": 15, "B": 7}
+
+
+@patch(
+    "plan_outcode_work_units.get_first_letter_sizes",
+    return_value={"A": 60, "B": 20, "C": 20},
+)
+def test_handler_uses_max_units(_):
+    result = handler(
+        {
+            "source_bucket_name": "bucket",
+            "source_path": "prefix/",
+            "max_units": 2,
+        },
+        {},
+    )
+    assert letters_in(result["work_units"]) == [
+        ("A", 0, 2),
+        ("A", 1, 2),
+        ("B", 0, 1),
+        ("C", 0, 1),
+    ]
@@ -7,6 +7,21 @@ from shared_components.buckets import (
 from shared_components.databases import dc_data_baker
 from shared_components.models import BaseQuery, GlueTable
 
+# Bing tile zoom level for the cell_id of each address in
+# addressbase_partitioned. Spatial joins match addresses to the tiles a
+# polygon covers at the same zoom, with an equi-join on cell_id, before
+# the exact polygon test. Zoom 12 tiles are about 6km across in the UK.
+ADDRESSBASE_CELL_ZOOM = 12
+
+# The format the EE exporters write current_ballots and
+# current_boundary_changes in, "csv" or "parquet". Parquet is typed and
+# compressed, so the spatial joins scan less and don't parse text.
+EE_EXPORT_FORMAT = "parquet"
+EE_EXPORT_DATA_FORMATS = {
+    "csv": glue.DataFormat.CSV,
+    "parquet": glue.DataFormat.PARQUET,
+}
+
 addressbase_cleaned_raw = GlueTable(
     table_name="addressbase_cleaned_raw",
     description="Addressbase table as produced for loading into WDIV",
@@ -38,6 +53,7 @@ addressbase_partitioned = GlueTable(
         "longitude": glue.Schema.DOUBLE,
         "latitude": glue.Schema.DOUBLE,
         "addressbase_source": glue.Schema.STRING,
+        "cell_id": glue.Schema.STRING,
     },
     partition_keys=[
         glue.Column(
@@ -48,23 +64,55 @@ addressbase_partitioned = GlueTable(
     depends_on=[addressbase_cleaned_raw],
     populated_with=BaseQuery(
         name="partition-addressbase-cleaned.sql",
-        context={"from_table": addressbase_cleaned_raw.table_name},
+        context={
+            "from_table": addressbase_cleaned_raw.table_name,
+            "cell_zoom": ADDRESSBASE_CELL_ZOOM,
+        },
     ),
 )
 
 current_ballots = GlueTable(
     table_name="current_ballots",
-    description="CSV in S3 generated by EE, contains each current ballot and the WKT of the geography",
+    description="Export in S3 generated by EE, contains each current ballot and the WKT of the geography",
     s3_prefix="ballots-with-wkt/",
     bucket=ee_data_cache_production,
     database=dc_data_baker,
-    data_format=glue.DataFormat.CSV,
+    data_format=EE_EXPORT_DATA_FORMATS[EE_EXPORT_FORMAT],
     columns={
         "election_id": glue.Schema.STRING,
         "division_id": glue.Schema.STRING,
         "geometry": glue.Schema.STRING,
         "source_table": glue.Schema.STRING,
+        "min_longitude": glue.Schema.DOUBLE,
+        "max_longitude": glue.Schema.DOUBLE,
+        "min_latitude": glue.Schema.DOUBLE,
+        "max_latitude": glue.Schema.DOUBLE,
+    },
+)
+
+current_ballot_cells = GlueTable(
+    table_name="current_ballot_cells",
+    description="The Organisation and Division geographies in current_ballots, parsed once into WKB, with a row per Bing tile each one covers",
+    s3_prefix="addressbase/{dc_environment}/current_ballot_cells/",
+    bucket=pollingstations_private_data,
+    database=dc_data_baker,
+    data_format=glue.DataFormat.PARQUET,
+    columns={
+        "election_id": glue.Schema.STRING,
+        "division_id": glue.Schema.STRING,
+        "source_table": glue.Schema.STRING,
+        "geometry": glue.Schema.BINARY,
+        "min_longitude": glue.Schema.DOUBLE,
+        "max_longitude": glue.Schema.DOUBLE,
+        "min_latitude": glue.Schema.DOUBLE,
+        "max_latitude": glue.Schema.DOUBLE,
+        "cell_id": glue.Schema.STRING,
     },
+    depends_on=[current_ballots],
+    populated_with=BaseQuery(
+        name="current-ballots-to-cells.sql",
+        context={"cell_zoom": ADDRESSBASE_CELL_ZOOM},
+    ),
 )
 
 current_ballots_joined_to_address_base = GlueTable(
@@ -86,7 +134,34 @@ current_ballots_joined_to_address_base = GlueTable(
     },
     populated_with=BaseQuery(
         name="uprn-to-ballots-first-letter.sql",
-        context={"from_table": current_ballots.table_name},
+        context={"from_table": current_ballot_cells.table_name},
+    ),
+)
+
+current_ballots_changes = GlueTable(
+    table_name="current_ballots_changes",
+    description="The geographies in current_ballots that changed since the current elections parquet was last baked, with the old and new version of each",
+    s3_prefix="ballots-with-wkt-changes/",
+    bucket=ee_data_cache_production,
+    database=dc_data_baker,
+    data_format=current_ballots.data_format,
+    columns={
+        **current_ballots.columns,
+        "version": glue.Schema.STRING,
+    },
+)
+
+changed_ballots_joined_to_address_base = GlueTable(
+    table_name="changed_ballots_joined_to_address_base",
+    description="A list of current ballots per UPRN, for only the outcodes near a changed geography in current_ballots_changes",
+    s3_prefix="addressbase/{dc_environment}/changed_ballots_joined_to_address_base/",
+    bucket=pollingstations_private_data,
+    database=dc_data_baker,
+    data_format=glue.DataFormat.PARQUET,
+    columns=current_ballots_joined_to_address_base.columns,
+    populated_with=BaseQuery(
+        name="changed-uprn-to-ballots.sql",
+        context={},
     ),
 )
 
@@ -97,7 +172,7 @@ current_boundary_changes = GlueTable(
     s3_prefix="current_boundary_reviews_with_wkt",
     bucket=data_baker_results_bucket,
     database=dc_data_baker,
-    data_format=glue.DataFormat.CSV,
+    data_format=EE_EXPORT_DATA_FORMATS[EE_EXPORT_FORMAT],
     columns={
         "slug": glue.Schema.STRING,
         "status": glue.Schema.STRING,
@@ -160,7 +235,7 @@ addresses_to_boundary_change = GlueTable(
     },
     populated_with=BaseQuery(
         name="addresses_to_boundary_change.sql",
-        context={},
+        context={"cell_zoom": ADDRESSBASE_CELL_ZOOM},
     ),
 )
 
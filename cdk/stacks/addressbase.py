@@ -23,6 +23,9 @@ from shared_components.buckets import (
 from shared_components.constructs.addressbase_data_quality_check_construct import (
     AddressbaseDataQualityCheckConstruct,
 )
+from shared_components.constructs.cell_id_check_construct import (
+    CellIdCheckConstruct,
+)
 from shared_components.constructs.make_partitions_construct import (
     MakePartitionsConstruct,
 )
@@ -121,12 +124,21 @@ class AddressBaseStack(DataBakerStack):
             source_table_name=addressbase_cleaned_raw.table_name,
         )
 
+        cell_id_check = CellIdCheckConstruct(
+            self,
+            "CellIdCheck",
+            athena_query_lambda=self.athena_query_lambda,
+            table_name=addressbase_partitioned.table_name,
+        )
+
         self.state_definition = (
             sfn.Chain.start(get_addressbase_cleaned_raw_glue_table_location)
             .next(delete_old_objects)
             .next(partition)
             .next(make_partitions)
             .next(data_quality_checks.entry_point)
+            .next(cell_id_check.entry_point)
+            .next(sfn.Succeed(self, "AddressBase partitioned"))
         )
 
         self.step_function = sfn.StateMachine(
@@ -5,9 +5,10 @@ from string import Template
 from typing import List
 
 import aws_cdk.aws_glue_alpha as glue
+import aws_cdk.aws_lambda_python_alpha as aws_lambda_python
 import aws_cdk.aws_s3 as s3
 import jsii
-from aws_cdk import Fn, Stack
+from aws_cdk import Fn, Stack, aws_lambda
 from aws_cdk import aws_athena as athena
 from constructs import Construct
 from shared_components.models import BaseQuery, GlueTable, S3Bucket
@@ -100,6 +101,23 @@ class DataBakerStack(abc.ABC, Stack, metaclass=CDKABCMetaClass):
             description=f"Query version: {query_hash}",
         )
 
+    def make_ee_database_layer(self) -> aws_lambda_python.PythonLayerVersion:
+        """
+        A layer with the ee_database module, for lambdas that export from
+        the EveryElection database.
+        """
+        return aws_lambda_python.PythonLayerVersion(
+            self,
+            "EEDatabaseLayer",
+            entry="cdk/shared_components/lambdas/ee_database",
+            compatible_runtimes=[aws_lambda.Runtime.PYTHON_3_12],
+            # The tests sit beside the module, like the other lambdas', but
+            # shouldn't be shipped to every function using the layer.
+            bundling=aws_lambda_python.BundlingOptions(
+                asset_excludes=["test_*.py", "__pycache__"]
+            ),
+        )
+
     def collect_buckets(self):
         self.buckets_by_name = {}
 
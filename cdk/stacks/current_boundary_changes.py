@@ -24,12 +24,18 @@ from shared_components.constructs.addressbase_data_quality_check_construct impor
 from shared_components.constructs.addressbase_source_check_construct import (
     AddressBaseSourceCheckConstruct,
 )
+from shared_components.constructs.cell_id_check_construct import (
+    CellIdCheckConstruct,
+)
 from shared_components.constructs.delete_stale_outcodes_construct import (
     DeleteStaleOutcodesConstruct,
 )
 from shared_components.constructs.make_partitions_construct import (
     MakePartitionsConstruct,
 )
+from shared_components.constructs.outcode_parquet_work_units_construct import (
+    OutcodeParquetWorkUnitsConstruct,
+)
 from shared_components.constructs.singleton_state_machine_construct import (
     SingletonStateMachineConstruct,
 )
@@ -37,8 +43,13 @@ from shared_components.constructs.step_function_event_queue_construct import (
     StepFunctionEventQueueConstruct,
 )
 from shared_components.models import GlueTable, S3Bucket
+from shared_components.outcode_parquet_options import (
+    OUTCODE_PARQUET_OPTIONS,
+)
 from shared_components.tables import (
+    EE_EXPORT_FORMAT,
     addressbase_cleaned_raw,
+    addressbase_partitioned,
     addresses_to_boundary_change,
     current_boundary_changes,
     current_boundary_reviews_joined_to_addressbase,
@@ -46,6 +57,12 @@ from shared_components.tables import (
 )
 from stacks.base_stack import DataBakerStack
 
+# Where first_letter_to_outcode_parquet writes <outcode>.json postcode
+# indexes for current_boundary_reviews_parquet.
+POSTCODE_INDEX_PATH = (
+    "addressbase/{dc_environment}/current_boundary_reviews_postcode_index"
+)
+
 
 class CurrentBoundaryChangesStack(DataBakerStack):
     def __init__(self, scope: Construct, construct_id: str, **kwargs) -> None:
@@ -77,6 +94,14 @@ class CurrentBoundaryChangesStack(DataBakerStack):
             )
         )
 
+        self.plan_outcode_work_units_lambda = (
+            aws_lambda.Function.from_function_arn(
+                self,
+                "PlanOutcodeWorkUnits",
+                Fn.import_value("PlanOutcodeWorkUnitsLambdaArnOutput"),
+            )
+        )
+
         delete_old_current_boundary_changes_task = (
             self.make_delete_old_current_boundary_changes_task()
         )
@@ -85,8 +110,10 @@ class CurrentBoundaryChangesStack(DataBakerStack):
             self.make_current_boundary_changes_csv_task()
         )
 
+        # current_boundary_changes was CSV and is now parquet, so its
+        # partitions are made again rather than keeping their old format.
         make_current_boundary_changes_partitions = self.make_partitions_task(
-            current_boundary_changes
+            current_boundary_changes, replace_partitions=True
         )
 
         boundary_review_pairs_map = self.make_boundary_review_pairs_map()
@@ -126,6 +153,9 @@ class CurrentBoundaryChangesStack(DataBakerStack):
             dest_path=current_boundary_reviews_parquet.s3_prefix.format(
                 dc_environment=self.dc_environment
             ),
+            index_path=POSTCODE_INDEX_PATH.format(
+                dc_environment=self.dc_environment
+            ),
         )
 
         outcode_addressbase_source_check = AddressBaseSourceCheckConstruct(
@@ -135,12 +165,21 @@ class CurrentBoundaryChangesStack(DataBakerStack):
             table_name=current_boundary_reviews_parquet.table_name,
         )
 
-        parallel_outcodes_task = self.make_parallel_outcodes_task()
+        outcodes_task = self.make_outcodes_task()
+
+        # addresses_to_boundary_change joins addresses to divisions on cell_id
+        cell_id_check = CellIdCheckConstruct(
+            self,
+            "CellIdCheck",
+            athena_query_lambda=self.athena_query_lambda,
+            table_name=addressbase_partitioned.table_name,
+        )
 
         main_tasks = (
-            delete_old_current_boundary_changes_task.next(
-                create_current_boundary_changes_csv_task
+            cell_id_check.entry_point.next(
+                delete_old_current_boundary_changes_task
             )
+            .next(create_current_boundary_changes_csv_task)
             .next(make_current_boundary_changes_partitions)
             .next(boundary_review_pairs_map)
             .next(make_addresses_to_boundary_change_partitions)
@@ -152,7 +191,7 @@ class CurrentBoundaryChangesStack(DataBakerStack):
                 make_current_boundary_reviews_joined_to_addressbase_partitions
             )
             .next(first_letter_data_quality_checks.entry_point)
-            .next(parallel_outcodes_task)
+            .next(outcodes_task)
             .next(delete_stale_outcodes.entry_point)
             .next(outcode_addressbase_source_check.entry_point)
         )
@@ -211,6 +250,7 @@ class CurrentBoundaryChangesStack(DataBakerStack):
             runtime=aws_lambda.Runtime.PYTHON_3_12,
             handler="handler",
             entry="cdk/shared_components/lambdas/create_boundary_changes_csv",
+            layers=[self.make_ee_database_layer()],
             index="create_current_boundary_reviews_csv.py",
             timeout=Duration.seconds(900),
             memory_size=2048,
@@ -234,16 +274,22 @@ class CurrentBoundaryChangesStack(DataBakerStack):
                 {
                     "s3_bucket": current_boundary_changes.bucket.bucket_name,
                     "s3_prefix": current_boundary_changes.s3_prefix,
+                    "export_format": EE_EXPORT_FORMAT,
                 }
             ),
         )
 
-    def make_partitions_task(self, table) -> tasks.LambdaInvoke:
+    def make_partitions_task(
+        self, table, replace_partitions: bool = False
+    ) -> sfn.IChainable:
         return MakePartitionsConstruct(
             self,
             f"MakePartitionsConstructFor{table.table_name}",
             athena_query_lambda=self.athena_query_lambda,
             target_table_name=table.table_name,
+            database_name=table.database.database_name
+            if replace_partitions
+            else None,
         ).entry_point
 
     def make_boundary_review_pairs_map(self) -> sfn.Chain:
@@ -383,37 +429,28 @@ class CurrentBoundaryChangesStack(DataBakerStack):
             ),
         )
 
-    def make_parallel_outcodes_task(self) -> sfn.Parallel:
-        parallel_outcodes = sfn.Parallel(
-            self, "Make outcode parquet per first letter"
-        )
-        alphabet = [chr(i) for i in range(ord("A"), ord("Z") + 1)]
-        for letter in alphabet:
-            context = current_boundary_reviews_joined_to_addressbase.populated_with.context.copy()
-            context["first_letter"] = letter
-
-            parallel_outcodes.branch(
-                tasks.LambdaInvoke(
-                    self,
-                    f"Make outcode parquet for {letter}",
-                    lambda_function=self.first_letter_to_outcode_parquet_lambda,
-                    payload=sfn.TaskInput.from_object(
-                        {
-                            "first_letter": letter,
-                            "source_bucket_name": current_boundary_reviews_joined_to_addressbase.bucket.bucket_name,
-                            "source_path": current_boundary_reviews_joined_to_addressbase.s3_prefix.format(
-                                dc_environment=self.dc_environment
-                            ),
-                            "dest_bucket_name": current_boundary_reviews_parquet.bucket.bucket_name,
-                            "dest_path": current_boundary_reviews_parquet.s3_prefix.format(
-                                dc_environment=self.dc_environment
-                            ),
-                            "filter_column": "boundary_reviews",
-                        }
-                    ),
-                )
-            )
-        return parallel_outcodes
+    def make_outcodes_task(self) -> sfn.Chain:
+        return OutcodeParquetWorkUnitsConstruct(
+            self,
+            "MakeOutcodeParquet",
+            plan_work_units_lambda=self.plan_outcode_work_units_lambda,
+            outcode_parquet_lambda=self.first_letter_to_outcode_parquet_lambda,
+            outcode_parquet_payload={
+                "source_bucket_name": current_boundary_reviews_joined_to_addressbase.bucket.bucket_name,
+                "source_path": current_boundary_reviews_joined_to_addressbase.s3_prefix.format(
+                    dc_environment=self.dc_environment
+                ),
+                "dest_bucket_name": current_boundary_reviews_parquet.bucket.bucket_name,
+                "dest_path": current_boundary_reviews_parquet.s3_prefix.format(
+                    dc_environment=self.dc_environment
+                ),
+                "filter_column": "boundary_reviews",
+                "parquet_options": OUTCODE_PARQUET_OPTIONS,
+                "index_path": POSTCODE_INDEX_PATH.format(
+                    dc_environment=self.dc_environment
+                ),
+            },
+        ).entry_point
 
     def make_event_triggers(self):
         event_queue = StepFunctionEventQueueConstruct(
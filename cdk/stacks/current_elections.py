@@ -10,6 +10,10 @@ current elections.
 The list of current elections is generated by EE. An update to that
 list will trigger a re-build of this data package.
 
+If only a few geographies changed since the last build, only the outcodes
+near them are rebuilt. A full rebuild still happens at least nightly, to
+pick up new AddressBase data.
+
 """
 
 from typing import List
@@ -22,6 +26,7 @@ from aws_cdk import (
     aws_events,
     aws_events_targets,
     aws_lambda,
+    aws_s3,
     aws_sqs,
 )
 from aws_cdk import (
@@ -37,9 +42,15 @@ from shared_components.buckets import (
 from shared_components.constructs.addressbase_data_quality_check_construct import (
     AddressbaseDataQualityCheckConstruct,
 )
+from shared_components.constructs.cell_id_check_construct import (
+    CellIdCheckConstruct,
+)
 from shared_components.constructs.make_partitions_construct import (
     MakePartitionsConstruct,
 )
+from shared_components.constructs.outcode_parquet_work_units_construct import (
+    OutcodeParquetWorkUnitsConstruct,
+)
 from shared_components.constructs.singleton_state_machine_construct import (
     SingletonStateMachineConstruct,
 )
@@ -47,9 +58,17 @@ from shared_components.constructs.step_function_event_queue_construct import (
     StepFunctionEventQueueConstruct,
 )
 from shared_components.models import GlueTable, S3Bucket
+from shared_components.outcode_parquet_options import (
+    OUTCODE_PARQUET_OPTIONS,
+)
 from shared_components.tables import (
+    EE_EXPORT_FORMAT,
     addressbase_cleaned_raw,
+    addressbase_partitioned,
+    changed_ballots_joined_to_address_base,
+    current_ballot_cells,
     current_ballots,
+    current_ballots_changes,
     current_ballots_joined_to_address_base,
 )
 from stacks.base_stack import DataBakerStack
@@ -85,6 +104,14 @@ class CurrentElectionsStack(DataBakerStack):
             )
         )
 
+        self.plan_outcode_work_units_lambda = (
+            aws_lambda.Function.from_function_arn(
+                self,
+                "PlanOutcodeWorkUnits",
+                Fn.import_value("PlanOutcodeWorkUnitsLambdaArnOutput"),
+            )
+        )
+
         delete_old_current_ballots_joined_to_addressbase_task = (
             self.make_delete_old_current_ballots_joined_to_addressbase_task()
         )
@@ -95,8 +122,10 @@ class CurrentElectionsStack(DataBakerStack):
             current_ballots_joined_to_address_base
         )
 
-        # Fan-out step (for each letter A-Z)
-        parallel_outcodes_task = self.make_parallel_outcodes_task()
+        # Fan-out step (size balanced work units of letters)
+        outcodes_task = self.make_outcodes_task(
+            "MakeOutcodeParquet", current_ballots_joined_to_address_base
+        )
 
         create_current_csv_task = self.make_create_current_csv_task()
 
@@ -108,14 +137,57 @@ class CurrentElectionsStack(DataBakerStack):
             target_table_name=current_ballots_joined_to_address_base.table_name,
         )
 
-        main_tasks = (
-            delete_old_current_ballots_joined_to_addressbase_task.next(
-                create_current_csv_task
-            )
+        mark_csv_baked_task = self.make_mark_csv_baked_task()
+
+        full_rebuild_tasks = (
+            self.make_ballot_cells_task("full")
+            .next(delete_old_current_ballots_joined_to_addressbase_task)
             .next(parallel_first_letter_task)
             .next(make_partitions)
             .next(first_letter_data_quality_checks.entry_point)
-            .next(parallel_outcodes_task)
+            .next(outcodes_task)
+            .next(mark_csv_baked_task)
+        )
+
+        incremental_rebuild_tasks = (
+            self.make_ballot_cells_task("incremental")
+            .next(self.make_changed_ballots_joined_to_addressbase_task())
+            .next(
+                self.make_outcodes_task(
+                    "MakeChangedOutcodeParquet",
+                    changed_ballots_joined_to_address_base,
+                )
+            )
+            .next(mark_csv_baked_task)
+        )
+
+        # Both rebuilds join addresses to ballots on cell_id
+        cell_id_check = CellIdCheckConstruct(
+            self,
+            "CellIdCheck",
+            athena_query_lambda=self.athena_query_lambda,
+            table_name=addressbase_partitioned.table_name,
+        )
+
+        # create_current_elections_csv compares the new export's manifest
+        # with the one last baked, and says how much needs rebuilding.
+        main_tasks = cell_id_check.entry_point.next(
+            create_current_csv_task
+        ).next(
+            sfn.Choice(self, "How much to rebuild?")
+            .when(
+                sfn.Condition.string_equals("$.Payload.rebuild", "none"),
+                sfn.Succeed(
+                    self,
+                    "Current elections unchanged",
+                    comment="No ballot geographies changed since the last build",
+                ),
+            )
+            .when(
+                sfn.Condition.string_equals("$.Payload.rebuild", "incremental"),
+                incremental_rebuild_tasks,
+            )
+            .otherwise(full_rebuild_tasks)
         )
 
         self.step_function = SingletonStateMachineConstruct(
@@ -136,7 +208,13 @@ class CurrentElectionsStack(DataBakerStack):
 
     @staticmethod
     def glue_tables() -> List[GlueTable]:
-        return [current_ballots, current_ballots_joined_to_address_base]
+        return [
+            current_ballots,
+            current_ballot_cells,
+            current_ballots_joined_to_address_base,
+            current_ballots_changes,
+            changed_ballots_joined_to_address_base,
+        ]
 
     @staticmethod
     def s3_buckets() -> List[S3Bucket]:
@@ -150,9 +228,11 @@ class CurrentElectionsStack(DataBakerStack):
             runtime=aws_lambda.Runtime.PYTHON_3_12,
             handler="handler",
             entry="cdk/shared_components/lambdas/create_current_elections_csv",
+            layers=[self.make_ee_database_layer()],
             index="create_current_elections_csv.py",
             timeout=Duration.seconds(900),
             memory_size=2048,
+            environment={"EXPORT_FORMAT": EE_EXPORT_FORMAT},
         )
 
         create_current_elections_csv_function.add_to_role_policy(
@@ -237,35 +317,129 @@ class CurrentElectionsStack(DataBakerStack):
             target_table_name=table.table_name,
         ).entry_point
 
-    def make_parallel_outcodes_task(self) -> sfn.Parallel:
-        parallel_outcodes = sfn.Parallel(
-            self, "Make outcode parquet per first letter"
+    def make_ballot_cells_task(self, rebuild: str) -> sfn.Chain:
+        """
+        Parses the geographies in the current ballots CSV once, into
+        current_ballot_cells, so the joins to addresses read WKB and
+        precomputed tiles rather than each parsing the WKT again.
+
+        Both kinds of rebuild need this, and state names must be unique,
+        so `rebuild` goes in the names of the states.
+        """
+        table = current_ballot_cells
+        empty_table = tasks.LambdaInvoke(
+            self,
+            f"Remove old ballot cells from S3 ({rebuild} rebuild)",
+            lambda_function=self.empty_bucket_by_prefix_lambda,
+            payload=sfn.TaskInput.from_object(
+                {
+                    "bucket": table.bucket.bucket_name,
+                    "prefix": table.s3_prefix.format(**self.context),
+                }
+            ),
         )
-        alphabet = [chr(i) for i in range(ord("A"), ord("Z") + 1)]
-        for letter in alphabet:
-            context = current_ballots_joined_to_address_base.populated_with.context.copy()
-            context["first_letter"] = letter
-
-            parallel_outcodes.branch(
-                tasks.LambdaInvoke(
-                    self,
-                    f"Make outcode parquet for {letter}",
-                    lambda_function=self.first_letter_to_outcode_parquet_lambda,
-                    payload=sfn.TaskInput.from_object(
-                        {
-                            "first_letter": letter,
-                            "source_bucket_name": current_ballots_joined_to_address_base.bucket.bucket_name,
-                            "source_path": current_ballots_joined_to_address_base.s3_prefix.format(
-                                dc_environment=self.dc_environment
-                            ),
-                            "dest_bucket_name": pollingstations_private_data.bucket_name,
-                            "dest_path": f"addressbase/{self.dc_environment}/current_elections_parquet",
-                            "filter_column": "ballot_ids",
-                        }
-                    ),
+        make_ballot_cells = tasks.LambdaInvoke(
+            self,
+            f"Parse current ballot geographies ({rebuild} rebuild)",
+            lambda_function=self.athena_query_lambda,
+            payload=sfn.TaskInput.from_object(
+                {
+                    "context": table.populated_with.context,
+                    "QueryName": table.populated_with.name,
+                    "blocking": True,
+                }
+            ),
+        )
+        return empty_table.next(make_ballot_cells)
+
+    def make_changed_ballots_joined_to_addressbase_task(self) -> sfn.Chain:
+        """
+        Joins current ballots to the addresses in outcodes near a changed
+        geography only. Baking from this table just replaces those outcode
+        files.
+
+        current_ballots_joined_to_address_base isn't updated, and is
+        brought up to date by the next full rebuild.
+        """
+        table = changed_ballots_joined_to_address_base
+        empty_table = tasks.LambdaInvoke(
+            self,
+            "Remove old changed ballots data from S3",
+            lambda_function=self.empty_bucket_by_prefix_lambda,
+            payload=sfn.TaskInput.from_object(
+                {
+                    "bucket": table.bucket.bucket_name,
+                    "prefix": table.s3_prefix.format(**self.context),
+                }
+            ),
+        )
+        join_changed_outcodes = tasks.LambdaInvoke(
+            self,
+            "Join ballots to addresses in changed outcodes",
+            lambda_function=self.athena_query_lambda,
+            payload=sfn.TaskInput.from_object(
+                {
+                    "context": table.populated_with.context,
+                    "QueryName": table.populated_with.name,
+                    "blocking": True,
+                }
+            ),
+        )
+        return empty_table.next(join_changed_outcodes)
+
+    def make_mark_csv_baked_task(self) -> tasks.CallAwsService:
+        """
+        Copies the manifest of the export this run was built from to where
+        create_current_elections_csv looks for the last baked manifest, so
+        the next run only rebuilds what changed since this one.
+        """
+        bucket = ee_data_cache_production.bucket_name
+        manifest_key = "ballots-with-wkt-manifest/current_elections.csv.gz"
+        return tasks.CallAwsService(
+            self,
+            "Mark current elections CSV as baked",
+            service="s3",
+            action="copyObject",
+            parameters={
+                "Bucket": bucket,
+                "CopySource": f"{bucket}/{manifest_key}",
+                "Key": "ballots-with-wkt-baked/current_elections-manifest.csv.gz",
+            },
+            iam_action="s3:PutObject",
+            iam_resources=[
+                aws_s3.Bucket.from_bucket_name(
+                    self, "EEDataCacheBucket", bucket
+                ).arn_for_objects("ballots-with-wkt-baked/*")
+            ],
+            additional_iam_statements=[
+                iam.PolicyStatement(
+                    actions=["s3:GetObject"],
+                    resources=[f"arn:aws:s3:::{bucket}/{manifest_key}"],
                 )
-            )
-        return parallel_outcodes
+            ],
+        )
+
+    def make_outcodes_task(self, construct_id, source_table) -> sfn.Chain:
+        return OutcodeParquetWorkUnitsConstruct(
+            self,
+            construct_id,
+            plan_work_units_lambda=self.plan_outcode_work_units_lambda,
+            outcode_parquet_lambda=self.first_letter_to_outcode_parquet_lambda,
+            outcode_parquet_payload={
+                "source_bucket_name": source_table.bucket.bucket_name,
+                "source_path": source_table.s3_prefix.format(
+                    dc_environment=self.dc_environment
+                ),
+                "dest_bucket_name": pollingstations_private_data.bucket_name,
+                "dest_path": f"addressbase/{self.dc_environment}/current_elections_parquet",
+                "filter_column": "ballot_ids",
+                # Most outcodes don't change from one night
+                # to the next, so don't re-upload them.
+                "skip_unchanged": True,
+                "parquet_options": OUTCODE_PARQUET_OPTIONS,
+                "index_path": f"addressbase/{self.dc_environment}/current_elections_postcode_index",
+            },
+        ).entry_point
 
     def make_parallel_first_letter_task(self) -> sfn.Parallel:
         # Fan-out step (for each letter A-Z)
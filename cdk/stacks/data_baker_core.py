@@ -158,6 +158,21 @@ class DataBakerCoreStack(DataBakerStack):
             )
         )
 
+        plan_outcode_work_units_lambda = aws_lambda_python.PythonFunction(
+            self,
+            "plan_outcode_work_units",
+            function_name="plan_outcode_work_units",
+            runtime=aws_lambda.Runtime.PYTHON_3_12,
+            handler="handler",
+            entry="cdk/shared_components/lambdas/plan_outcode_work_units",
+            index="plan_outcode_work_units.py",
+            timeout=Duration.seconds(300),
+        )
+
+        plan_outcode_work_units_lambda.add_to_role_policy(
+            iam.PolicyStatement(actions=["s3:ListBucket"], resources=["*"]),
+        )
+
         CfnOutput(
             self,
             "WorkgroupNameOutput",
@@ -203,6 +218,13 @@ class DataBakerCoreStack(DataBakerStack):
             export_name="FirstLetterToOutcodeParquetLambdaArnOutput",
         )
 
+        CfnOutput(
+            self,
+            "PlanOutcodeWorkUnitsLambdaArnOutput",
+            value=plan_outcode_work_units_lambda.function_arn,
+            export_name="PlanOutcodeWorkUnitsLambdaArnOutput",
+        )
+
     def make_database(self):
         return glue.Database(
             self,
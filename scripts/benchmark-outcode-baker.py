@@ -0,0 +1,365 @@
+"""
+Time each stage of the first_letter_to_outcode_parquet lambda on a synthetic
+letter.
+
+The synthetic letter is shaped like a big AddressBase letter partition of
+current_ballots_joined_to_address_base: a few areas with tens of districts
+each, outcode sizes that vary a lot, around 18 addresses per postcode, and
+`ballot_ids` lists where some outcodes have no elections at all and a
+fraction of the other addresses aren't in any ballot.
+
+Usage:
+
+    uv run --with polars==1.22.0 --with sentry-sdk python scripts/benchmark-outcode-baker.py --record benchmarks/outcode-baker.jsonl
+
+S3 is replaced with an in-process stand-in that only counts bytes, so the
+timings are for our code and Polars rather than the network. With
+`--record` each run is appended to a JSON lines file and compared with the
+last run there with the same settings. Stages that got more than
+`--max-regression` slower are listed and the script exits non-zero, so
+this can be run before a big election to catch regressions.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import polars
+
+SHARED_COMPONENTS_DIR = Path(__file__).parent.parent / "cdk/shared_components"
+sys.path.insert(0, str(SHARED_COMPONENTS_DIR))
+sys.path.insert(
+    0, str(SHARED_COMPONENTS_DIR / "lambdas/first_letter_to_outcode_parquet")
+)
+
+import first_letter_to_outcode_parquet as baker  # noqa: E402
+from outcode_parquet_options import OUTCODE_PARQUET_OPTIONS  # noqa: E402
+
+ADDRESSES_PER_POSTCODE = 18
+POSTCODE_UNIT_LETTERS = "ABDEFGHJLNPQRSTUWXYZ"
+
+
+class LocalS3Client:
+    """
+    Stands in for the boto3 S3 client when uploading. Nothing exists
+    already, and uploads are thrown away.
+    """
+
+    def put_object(self, **kwargs):
+        pass
+
+    def upload_file(self, Filename, Bucket, Key, ExtraArgs=None):
+        pass
+
+    def head_object(self, **kwargs):
+        raise baker.ClientError(
+            {"Error": {"Code": "404", "Message": "Not Found"}}, "HeadObject"
+        )
+
+    def delete_objects(self, **kwargs):
+        return {}
+
+
+def make_letter_df(
+    first_letter: str,
+    uprns: int,
+    no_ballot_density: float = 0.3,
+    no_election_outcodes: float = 0.2,
+    seed: int = 0,
+) -> polars.DataFrame:
+    """
+    A letter's worth of rows in the order Athena might write them.
+
+    Args:
+        first_letter: First letter of every postcode.
+        uprns: Roughly how many rows to make.
+        no_ballot_density: Fraction of addresses in outcodes with elections
+            whose ballot_ids is [null].
+        no_election_outcodes: Fraction of outcodes with no elections, so
+            every address there has ballot_ids [null].
+        seed: Seed for the random outcode layout.
+    """
+    rng = random.Random(seed)
+    areas = [first_letter] + [
+        f"{first_letter}{letter}"
+        for letter in rng.sample(POSTCODE_UNIT_LETTERS, 7)
+    ]
+    outcodes = [
+        f"{area}{district}"
+        for area in areas
+        for district in range(1, rng.randint(10, 60))
+    ]
+    # Outcode sizes are skewed: most are a few thousand addresses, a few
+    # are much bigger.
+    weights = [rng.lognormvariate(0, 0.8) for _ in outcodes]
+    scale = uprns / sum(weights)
+    outcodes_df = polars.DataFrame(
+        {
+            "outcode": outcodes,
+            "rows": [max(1, round(weight * scale)) for weight in weights],
+            "has_election": [
+                rng.random() >= no_election_outcodes for _ in outcodes
+            ],
+        }
+    )
+
+    letters = dict(enumerate(POSTCODE_UNIT_LETTERS))
+    unit = polars.col("row_in_outcode") // ADDRESSES_PER_POSTCODE
+    row_hash = polars.col("uprn_number").hash(seed)
+    ballot = "local." + polars.col("outcode").str.to_lowercase() + ".ward-"
+    return (
+        outcodes_df.select(
+            polars.col("outcode").repeat_by("rows").explode(),
+            polars.col("has_election").repeat_by("rows").explode(),
+        )
+        .with_row_index("uprn_number", offset=10_000_000)
+        .with_columns(
+            row_in_outcode=polars.int_range(polars.len()).over("outcode")
+        )
+        .with_columns(
+            uprn=polars.col("uprn_number").cast(polars.Utf8),
+            postcode=polars.format(
+                "{} {}{}{}",
+                "outcode",
+                unit % 10,
+                (unit // 10 % len(letters)).replace_strict(letters),
+                (unit // 200 % len(letters)).replace_strict(letters),
+            ),
+            addressbase_source=polars.lit(
+                "s3://pollingstations.private.data/addressbase/production/addressbase_cleaned/"
+            ),
+            ballot_ids=polars.when(
+                polars.col("has_election")
+                & (row_hash % 1000 >= no_ballot_density * 1000)
+            )
+            .then(
+                polars.concat_list(
+                    ballot + (unit % 7).cast(polars.Utf8) + ".2026-05-07",
+                    polars.lit("parl.") + polars.col("outcode") + ".2026-05-07",
+                    polars.lit("mayor.")
+                    + polars.col("outcode")
+                    + ".2026-05-07",
+                ).list.head((row_hash // 1000) % 3 + 1)
+            )
+            .otherwise(polars.concat_list(polars.lit(None, polars.Utf8))),
+        )
+        .select("uprn", "postcode", "addressbase_source", "ballot_ids")
+        .sample(fraction=1, shuffle=True, seed=seed)
+    )
+
+
+def write_letter_parts(df: polars.DataFrame, letter_dir: Path, parts: int):
+    letter_dir.mkdir(parents=True)
+    part_size = -(-len(df) // parts)
+    for i, part in enumerate(df.iter_slices(part_size)):
+        part.write_parquet(letter_dir / f"part-{i:05d}.parquet")
+
+
+def time_stage(fn, runs: int) -> tuple[float, object]:
+    timings = []
+    for _ in range(runs):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            result = fn()
+            timings.append(time.perf_counter() - start)
+    return statistics.median(timings), result
+
+
+def upload_all(outcode_frames, in_memory: bool):
+    with (
+        tempfile.TemporaryDirectory() as by_outcode_dir,
+        baker.UploadPool() as upload_pool,
+    ):
+        for outcode_frame in outcode_frames:
+            baker.upload_outcode_parquet(
+                None if in_memory else Path(by_outcode_dir),
+                "dest-bucket",
+                "dest/path",
+                "ballot_ids",
+                outcode_frame.df,
+                upload_pool=upload_pool,
+                has_filter_column_data=outcode_frame.has_filter_column_data,
+                parquet_options=OUTCODE_PARQUET_OPTIONS,
+            )
+
+
+def run_benchmarks(args) -> dict:
+    timings = {}
+    baker.s3_client = LocalS3Client()
+    df = make_letter_df(
+        args.first_letter,
+        args.uprns,
+        no_ballot_density=args.no_ballot_density,
+        seed=args.seed,
+    )
+    print(
+        f"{len(df)} UPRNs, {df['postcode'].n_unique()} postcodes, "
+        f"median of {args.runs} runs\n"
+    )
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        source_dir = Path(tmp_dir) / "source"
+        letter_dir = source_dir / f"first_letter={args.first_letter}"
+        write_letter_parts(df, letter_dir, args.parts)
+
+        timings["check_duplicate_uprns"], _ = time_stage(
+            lambda: baker.check_duplicate_uprns(df, args.first_letter),
+            args.runs,
+        )
+        timings["get_outcode_dfs"], outcode_frames = time_stage(
+            lambda: baker.get_outcode_dfs(
+                args.first_letter, letter_dir, "ballot_ids"
+            ),
+            args.runs,
+        )
+        for in_memory in (False, True):
+            name = f"upload_outcode_parquet{' in memory' if in_memory else ''}"
+            timings[name], _ = time_stage(
+                lambda: upload_all(outcode_frames, in_memory),
+                args.runs,
+            )
+
+        for in_memory in (False, True):
+            name = f"handler{' in memory' if in_memory else ''}"
+            timings[name], _ = time_stage(
+                lambda: baker.handler(
+                    {
+                        "first_letter": args.first_letter,
+                        "source_dir": str(source_dir),
+                        "dest_bucket_name": "dest-bucket",
+                        "dest_path": "dest/path",
+                        "filter_column": "ballot_ids",
+                        "in_memory_output": in_memory,
+                        "parquet_options": OUTCODE_PARQUET_OPTIONS,
+                    },
+                    {},
+                ),
+                args.runs,
+            )
+
+    print(f"{len(outcode_frames)} outcodes\n")
+    print(f"{'stage':<36} {'seconds':>8}")
+    for name, seconds in timings.items():
+        print(f"{name:<36} {seconds:>8.3f}")
+    return timings
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def last_recorded_run(record_path: Path, settings: dict) -> dict | None:
+    if not record_path.exists():
+        return None
+    last_run = None
+    with record_path.open() as f:
+        for line in f:
+            run = json.loads(line)
+            if run["settings"] == settings:
+                last_run = run
+    return last_run
+
+
+def find_regressions(
+    timings: dict, previous_timings: dict, max_regression: float
+) -> list[str]:
+    regressions = []
+    for name, seconds in timings.items():
+        previous = previous_timings.get(name)
+        if previous and seconds > previous * (1 + max_regression):
+            regressions.append(
+                f"{name}: {previous:.3f}s -> {seconds:.3f}s "
+                f"({seconds / previous - 1:+.0%})"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--first-letter", default="B")
+    parser.add_argument("--uprns", type=int, default=2_000_000)
+    parser.add_argument("--no-ballot-density", type=float, default=0.3)
+    parser.add_argument(
+        "--parts",
+        type=int,
+        default=8,
+        help="How many parquet files to split the letter into",
+    )
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--record",
+        type=Path,
+        help="JSON lines file to append results to and compare against",
+    )
+    parser.add_argument(
+        "--max-regression",
+        type=float,
+        default=0.2,
+        help="Fail if a stage is this fraction slower than the last run",
+    )
+    args = parser.parse_args()
+
+    settings = {
+        "first_letter": args.first_letter,
+        "uprns": args.uprns,
+        "no_ballot_density": args.no_ballot_density,
+        "parts": args.parts,
+        "seed": args.seed,
+    }
+    timings = run_benchmarks(args)
+    if not args.record:
+        return
+
+    previous_run = last_recorded_run(args.record, settings)
+    args.record.parent.mkdir(parents=True, exist_ok=True)
+    with args.record.open("a") as f:
+        f.write(
+            json.dumps(
+                {
+                    "recorded_at": datetime.now(timezone.utc).isoformat(),
+                    "commit": git_commit(),
+                    "polars_version": polars.__version__,
+                    "settings": settings,
+                    "timings": timings,
+                }
+            )
+            + "\n"
+        )
+    if not previous_run:
+        print(f"\nRecorded first run with these settings in {args.record}")
+        return
+
+    regressions = find_regressions(
+        timings, previous_run["timings"], args.max_regression
+    )
+    if regressions:
+        print(
+            f"\nSlower than the run at {previous_run['commit']} "
+            f"({previous_run['recorded_at']}):"
+        )
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+    print(f"\nNo stage slower than the run at {previous_run['commit']}")
+
+
+if __name__ == "__main__":
+    main()
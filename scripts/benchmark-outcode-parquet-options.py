@@ -0,0 +1,127 @@
+"""
+Compare parquet writer settings for <outcode>.parquet files.
+
+The API reads one outcode file for every postcode lookup, so we care about
+file size (bytes fetched from S3) and how quickly a single postcode or UPRN
+can be pulled out of a file. This writes a synthetic outcode with each set
+of options in OPTION_SETS and prints both.
+
+Usage:
+
+    uv run --with polars==1.22.0 python scripts/benchmark-outcode-parquet-options.py
+
+The option sets are the `parquet_options` a layer can pass to the
+first_letter_to_outcode_parquet lambda.
+"""
+
+import argparse
+import random
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import polars
+
+OPTION_SETS = {
+    "polars defaults": {},
+    "zstd 3, statistics": {
+        "compression": "zstd",
+        "compression_level": 3,
+        "statistics": True,
+    },
+    "zstd 9, statistics": {
+        "compression": "zstd",
+        "compression_level": 9,
+        "statistics": True,
+    },
+    "snappy, statistics": {"compression": "snappy", "statistics": True},
+    "zstd 3, statistics, 1k row groups": {
+        "compression": "zstd",
+        "compression_level": 3,
+        "statistics": True,
+        "row_group_size": 1_000,
+    },
+    "zstd 9, statistics, 1k row groups": {
+        "compression": "zstd",
+        "compression_level": 9,
+        "statistics": True,
+        "row_group_size": 1_000,
+    },
+    "uncompressed, no statistics": {
+        "compression": "uncompressed",
+        "statistics": False,
+    },
+}
+
+
+def make_outcode_df(
+    outcode: str, uprns: int, seed: int = 0
+) -> polars.DataFrame:
+    """
+    An outcode's worth of rows, roughly shaped like the current elections
+    layer: around 20 addresses per postcode, and most addresses with one to
+    three ballots.
+    """
+    rng = random.Random(seed)
+    postcodes = [
+        f"{outcode} {rng.randint(1, 9)}{chr(65 + rng.randint(0, 25))}{chr(65 + rng.randint(0, 25))}"
+        for _ in range(max(uprns // 20, 1))
+    ]
+    ballots = [
+        f"local.place-{i}.ward-{j}.2026-05-07"
+        for i in range(3)
+        for j in range(30)
+    ]
+    return polars.DataFrame(
+        {
+            "uprn": [str(100_000_000 + i) for i in range(uprns)],
+            "postcode": [rng.choice(postcodes) for _ in range(uprns)],
+            "addressbase_source": [
+                "s3://pollingstations.private.data/addressbase/production/addressbase_cleaned/"
+            ]
+            * uprns,
+            "ballot_ids": [
+                rng.sample(ballots, rng.randint(0, 3)) for _ in range(uprns)
+            ],
+        }
+    ).sort(by=["postcode", "uprn"])
+
+
+def time_lookup(path: Path, column: str, value: str, runs: int) -> float:
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        polars.scan_parquet(path).filter(polars.col(column) == value).collect()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--uprns", type=int, default=20_000)
+    parser.add_argument("--runs", type=int, default=50)
+    args = parser.parse_args()
+
+    outcode_df = make_outcode_df("AB1", args.uprns)
+    postcode = outcode_df["postcode"][len(outcode_df) // 2]
+    uprn = outcode_df["uprn"][len(outcode_df) // 2]
+
+    print(f"{args.uprns} UPRNs, median of {args.runs} lookups\n")
+    print(f"{'options':<36} {'size KB':>8} {'postcode ms':>12} {'uprn ms':>8}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, options in OPTION_SETS.items():
+            path = Path(tmp_dir) / f"{len(name)}-{hash(name)}.parquet"
+            outcode_df.write_parquet(path, **options)
+            size = path.stat().st_size / 1024
+            postcode_ms = (
+                time_lookup(path, "postcode", postcode, args.runs) * 1000
+            )
+            uprn_ms = time_lookup(path, "uprn", uprn, args.runs) * 1000
+            print(
+                f"{name:<36} {size:>8.1f} {postcode_ms:>12.2f} {uprn_ms:>8.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
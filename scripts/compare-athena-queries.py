@@ -0,0 +1,156 @@
+"""
+Compare two versions of a layer's Athena query on the same data.
+
+Each query in cdk/queries is an UNLOAD. This runs the SELECT inside it,
+wrapped in a count and an order-insensitive checksum, so nothing is
+written to S3. It prints how much data each version scanned and how long
+it took, and whether they returned the same rows.
+
+Usage, comparing the committed query with the working copy for one letter:
+
+    git show HEAD:cdk/queries/uprn-to-ballots-first-letter.sql > /tmp/before.sql
+    uv run python scripts/compare-athena-queries.py \\
+        /tmp/before.sql cdk/queries/uprn-to-ballots-first-letter.sql \\
+        --context first_letter=S cell_zoom=12 \\
+        --record benchmarks/athena-queries.jsonl
+
+This needs credentials for the account the layers are deployed in.
+"""
+
+import argparse
+import json
+import re
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from string import Template
+
+import boto3
+
+WORKGROUP = "dc-data-baker"
+DATABASE = "dc_data_baker"
+
+UNLOAD_RE = re.compile(r"^\s*UNLOAD\s*\((.*)\)\s*TO\s*'", re.DOTALL)
+
+athena_client = boto3.client("athena")
+
+
+def make_comparison_query(
+    query_path: Path, context: dict, checksum_expression: str
+) -> str:
+    """
+    Fills in a query the way the stacks and run_athena_query_and_report_status
+    do, and wraps the SELECT inside its UNLOAD in a count and checksum.
+    """
+    query = Template(query_path.read_text()).safe_substitute(context)
+    query = query.format(**context)
+    match = UNLOAD_RE.match(query)
+    if not match:
+        raise ValueError(f"{query_path} isn't an UNLOAD query")
+    return f"""
+        SELECT count(*) AS row_count,
+            to_hex(checksum({checksum_expression})) AS row_checksum
+        FROM ({match.group(1)})
+    """
+
+
+def run_query(query: str) -> dict:
+    execution_id = athena_client.start_query_execution(
+        QueryString=query,
+        QueryExecutionContext={"Database": DATABASE},
+        WorkGroup=WORKGROUP,
+    )["QueryExecutionId"]
+
+    while True:
+        time.sleep(1)
+        execution = athena_client.get_query_execution(
+            QueryExecutionId=execution_id
+        )["QueryExecution"]
+        state = execution["Status"]["State"]
+        if state in ["SUCCEEDED", "FAILED", "CANCELLED"]:
+            break
+    if state != "SUCCEEDED":
+        raise ValueError(
+            f"Query did not succeed: {execution['Status'].get('StateChangeReason')}"
+        )
+
+    rows = athena_client.get_query_results(QueryExecutionId=execution_id)[
+        "ResultSet"
+    ]["Rows"]
+    row_count, row_checksum = (
+        column.get("VarCharValue") for column in rows[1]["Data"]
+    )
+    statistics = execution["Statistics"]
+    return {
+        "query_execution_id": execution_id,
+        "row_count": int(row_count),
+        "row_checksum": row_checksum,
+        "data_scanned_bytes": statistics["DataScannedInBytes"],
+        "engine_execution_ms": statistics["EngineExecutionTimeInMillis"],
+        "total_execution_ms": statistics["TotalExecutionTimeInMillis"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("before", type=Path)
+    parser.add_argument("after", type=Path)
+    parser.add_argument(
+        "--context",
+        nargs="*",
+        default=[],
+        help="key=value pairs to fill the query in with",
+    )
+    parser.add_argument(
+        "--checksum-expression",
+        default="uprn || ':' || array_join(ballot_ids, ',')",
+        help="Expression over each row to checksum",
+    )
+    parser.add_argument(
+        "--record",
+        type=Path,
+        help="JSON lines file to append the comparison to",
+    )
+    args = parser.parse_args()
+    context = dict(pair.split("=", 1) for pair in args.context)
+
+    results = {}
+    for name, query_path in (("before", args.before), ("after", args.after)):
+        print(f"Running {name}: {query_path}")
+        results[name] = run_query(
+            make_comparison_query(query_path, context, args.checksum_expression)
+        )
+
+    print(f"\n{'':<8} {'rows':>10} {'scanned MB':>11} {'engine s':>9}")
+    for name, result in results.items():
+        print(
+            f"{name:<8} {result['row_count']:>10}"
+            f" {result['data_scanned_bytes'] / 1024 / 1024:>11.1f}"
+            f" {result['engine_execution_ms'] / 1000:>9.1f}"
+        )
+    same_rows = (
+        results["before"]["row_checksum"] == results["after"]["row_checksum"]
+        and results["before"]["row_count"] == results["after"]["row_count"]
+    )
+    print(f"\nSame rows: {same_rows}")
+
+    if args.record:
+        args.record.parent.mkdir(parents=True, exist_ok=True)
+        with args.record.open("a") as f:
+            f.write(
+                json.dumps(
+                    {
+                        "recorded_at": datetime.now(timezone.utc).isoformat(),
+                        "before": str(args.before),
+                        "after": str(args.after),
+                        "context": context,
+                        "same_rows": same_rows,
+                        **results,
+                    }
+                )
+                + "\n"
+            )
+
+
+if __name__ == "__main__":
+    main()